@@ -0,0 +1,74 @@
+"""
+Benchmark the throughput of the storage backends: ingest N updates, then pop them all.
+
+Usage:
+    python benchmarks/backends.py [--count N] [--threads N] [--consumers N]
+    python benchmarks/backends.py --database-url postgresql+asyncpg://localhost/bench
+
+The in-memory and SQLite backends always run, Postgres only with --database-url. The updates
+are spread over --threads threads and popped by --consumers concurrent consumers.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from basehook.backends import MemoryBackend, PostgresBackend, SQLiteBackend, StorageBackend
+
+
+async def run(backend: StorageBackend, count: int, threads: int, consumers: int) -> tuple:
+    """Returns the ingest and pop throughputs, in updates per second."""
+    await backend.setup()
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            await backend.ingest("bench", f"thread-{i % threads}", i, {"i": i, "data": "x" * 200})
+        ingest_seconds = time.perf_counter() - start
+
+        popped = 0
+
+        async def consume() -> None:
+            nonlocal popped
+            while True:
+                async with backend.pop("bench", only_last_revision=False) as update:
+                    if update is None:
+                        return
+                    popped += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(consume() for _ in range(consumers)))
+        pop_seconds = time.perf_counter() - start
+        assert popped == count, f"popped {popped} of {count}"
+        return count / ingest_seconds, count / pop_seconds
+    finally:
+        await backend.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=5000, help="Updates per backend")
+    parser.add_argument("--threads", type=int, default=1000, help="Distinct thread ids")
+    parser.add_argument("--consumers", type=int, default=4, help="Concurrent consumers")
+    parser.add_argument("--database-url", help="Also benchmark Postgres, on a scratch database")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = [
+            ("memory", MemoryBackend()),
+            ("sqlite", SQLiteBackend(os.path.join(directory, "bench.db"))),
+        ]
+        if args.database_url:
+            from basehook import Basehook
+
+            backends.append(("postgres", PostgresBackend(Basehook(database_url=args.database_url))))
+
+        print(f"{args.count} updates, {args.threads} threads, {args.consumers} consumers")
+        for name, backend in backends:
+            ingest_rate, pop_rate = await run(backend, args.count, args.threads, args.consumers)
+            print(f"  {name:<9} ingest {ingest_rate:10.0f}/s   pop {pop_rate:10.0f}/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Benchmark the cost of instrumenting `Basehook.pop`: pop throughput without instrumentation,
+with a no-op `Instrumentation` (events and round trip counting only) and with
+`OpenTelemetryInstrumentation` (spans, when opentelemetry is installed).
+
+Usage:
+    python benchmarks/instrumentation.py --database-url postgresql+asyncpg://localhost/bench
+
+Runs on a scratch database. Each mode ingests --count updates then pops them all with
+--consumers concurrent consumers, --rounds times, and the best round is kept.
+"""
+
+import argparse
+import asyncio
+import time
+
+from basehook import Basehook
+from basehook.backends import PostgresBackend
+from basehook.instrumentation import Instrumentation, OpenTelemetryInstrumentation
+
+
+async def run(
+    database_url: str,
+    instrumentation: Instrumentation | None,
+    webhook_name: str,
+    count: int,
+    consumers: int,
+) -> float:
+    """Returns the pop throughput, in updates per second."""
+    basehook = Basehook(database_url=database_url, instrumentation=instrumentation)
+    backend = PostgresBackend(basehook)
+    await backend.setup()
+    try:
+        for i in range(count):
+            await backend.ingest(webhook_name, f"thread-{i}", i, {"i": i, "data": "x" * 200})
+
+        popped = 0
+
+        async def consume() -> None:
+            nonlocal popped
+            while True:
+                async with basehook.pop(webhook_name) as update:
+                    if update is None:
+                        return
+                    popped += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(consume() for _ in range(consumers)))
+        pop_seconds = time.perf_counter() - start
+        assert popped == count, f"popped {popped} of {count}"
+        return count / pop_seconds
+    finally:
+        await backend.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", required=True, help="Scratch Postgres database")
+    parser.add_argument("--count", type=int, default=2000, help="Updates per round")
+    parser.add_argument("--consumers", type=int, default=4, help="Concurrent consumers")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per mode")
+    args = parser.parse_args()
+
+    modes = [
+        ("none", lambda: None),
+        ("no-op", Instrumentation),
+        ("otel", OpenTelemetryInstrumentation),
+    ]
+    print(f"{args.count} updates, {args.consumers} consumers, best of {args.rounds} rounds")
+    baseline = None
+    for name, factory in modes:
+        rates = []
+        for round_number in range(args.rounds):
+            webhook_name = f"bench-instrumentation-{name}-{round_number}-{time.time_ns()}"
+            rate = await run(args.database_url, factory(), webhook_name, args.count, args.consumers)
+            rates.append(rate)
+        best = max(rates)
+        if baseline is None:
+            baseline = best
+        overhead = (baseline - best) / baseline * 100
+        print(f"  {name:<6} pop {best:10.0f}/s   overhead {overhead:5.1f}%")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""
+Benchmark the JSON serialization cost of an update, from ingest to pop.
+
+Compares, per update:
+- stdlib: parse the body, re-serialize it for the JSONB bind, parse it again on pop
+- fast: parse with orjson (basehook[fast]), pass the body through to Postgres, parse on pop
+- raw: as fast, but pop(raw=True) hands the JSON text to the handler without parsing it
+
+Usage:
+    python benchmarks/serialization.py [--size BYTES] [--count N]
+    python benchmarks/serialization.py --database-url postgresql+asyncpg://localhost/bench
+
+Without a database, only the Python side is measured (the Postgres JSONB parsing is the same
+for every mode). With one, updates are inserted and popped through Basehook, end to end.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any
+
+from basehook import jsoncodec
+from basehook.jsoncodec import RawJSON
+
+
+def make_body(size: int) -> bytes:
+    """A webhook-like body of about `size` bytes."""
+    items = []
+    body = {"thread_id": "bench", "revision": 1.0, "event": {"type": "order.updated"}}
+    while len(json.dumps(body)) < size:
+        items.append({"id": len(items), "sku": f"sku-{len(items)}", "price": 12.5, "tags": ["a"]})
+        body["items"] = items
+    return json.dumps(body).encode("utf-8")
+
+
+def python_side(body: bytes, count: int) -> dict[str, float]:
+    """Microseconds per update spent serializing in Python, by mode."""
+    # What Postgres sends back on pop, JSONB normalized text
+    stored = json.dumps(json.loads(body), separators=(", ", ": "))
+
+    def stdlib() -> Any:
+        content = json.loads(body)
+        json.dumps(content)  # SQLAlchemy JSONB bind
+        return json.loads(stored)
+
+    def fast() -> Any:
+        jsoncodec.loads(body)
+        body.decode("utf-8-sig")  # Text bind cast to JSONB
+        return jsoncodec.loads(stored)
+
+    def raw() -> Any:
+        jsoncodec.loads(body)
+        body.decode("utf-8-sig")
+        return RawJSON(stored)
+
+    results = {}
+    for name, run in [("stdlib", stdlib), ("fast", fast), ("raw", raw)]:
+        start = time.perf_counter()
+        for _ in range(count):
+            run()
+        results[name] = (time.perf_counter() - start) / count * 1e6
+    return results
+
+
+async def end_to_end(database_url: str, body: bytes, count: int) -> dict[str, float]:
+    """Microseconds per update to insert then pop it, by mode."""
+    from sqlalchemy import Text, cast, delete, literal
+    from sqlalchemy.dialects.postgresql import JSONB, insert
+
+    from basehook import Basehook
+    from basehook.models import (
+        ThreadUpdateStatus,
+        metadata,
+        thread_table,
+        thread_update_table,
+        webhook_table,
+    )
+
+    basehook = Basehook(database_url=database_url)
+    await basehook.create_tables(metadata)
+    async with basehook.engine.begin() as conn:
+        await conn.execute(
+            insert(webhook_table)
+            .values(name="bench", thread_id_path=["thread_id"], revision_number_path=["revision"])
+            .on_conflict_do_nothing()
+        )
+
+    results = {}
+    try:
+        for name in ["stdlib", "fast", "raw"]:
+            async with basehook.engine.begin() as conn:
+                await conn.execute(
+                    delete(thread_update_table).where(thread_update_table.c.webhook_name == "bench")
+                )
+            start = time.perf_counter()
+            for i in range(count):
+                content = json.loads(body) if name == "stdlib" else jsoncodec.loads(body)
+                stored = content if name == "stdlib" else cast(literal(body.decode(), Text), JSONB)
+                async with basehook.engine.begin() as conn:
+                    await conn.execute(
+                        insert(thread_update_table).values(
+                            webhook_name="bench",
+                            thread_id=f"bench-{i}",
+                            revision_number=1.0,
+                            content=stored,
+                            timestamp=time.time(),
+                            status=ThreadUpdateStatus.PENDING,
+                        )
+                    )
+                    await conn.execute(
+                        insert(thread_table)
+                        .values(webhook_name="bench", thread_id=f"bench-{i}")
+                        .on_conflict_do_nothing()
+                    )
+            for _ in range(count):
+                async with basehook.pop("bench", raw=name == "raw") as update:
+                    assert update is not None
+            results[name] = (time.perf_counter() - start) / count * 1e6
+    finally:
+        await basehook.engine.dispose()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=16 * 1024, help="Body size in bytes")
+    parser.add_argument("--count", type=int, default=1000, help="Updates per mode")
+    parser.add_argument("--database-url", help="Also benchmark ingest and pop end to end")
+    args = parser.parse_args()
+
+    body = make_body(args.size)
+    print(f"Body: {len(body)} bytes, orjson {'on' if jsoncodec.orjson else 'off'}")
+    for name, micros in python_side(body, args.count).items():
+        print(f"  python side  {name:<7} {micros:10.1f} us/update")
+    if args.database_url:
+        results = asyncio.run(end_to_end(args.database_url, body, args.count))
+        for name, micros in results.items():
+            print(f"  end to end   {name:<7} {micros:10.1f} us/update")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ This demonstrates the recommended way to use Basehook in your application.
 import asyncio
 
 from basehook import Basehook
-from basehook.models import metadata
 
 
 async def example_with_lifespan():
@@ -15,8 +14,8 @@ async def example_with_lifespan():
     basehook = Basehook()
 
     async with basehook.lifespan():
-        # Create tables if needed
-        await basehook.create_tables(metadata)
+        # Create or migrate the schema if needed
+        await basehook.migrate()
 
         # Process updates
         async with basehook.last_revision(buffer_in_seconds=5) as update:
@@ -33,7 +32,7 @@ async def example_with_manual_init():
 
     try:
         await basehook.init()
-        await basehook.create_tables(metadata)
+        await basehook.migrate()
 
         # Process updates
         async with basehook.last_revision(buffer_in_seconds=5) as update:
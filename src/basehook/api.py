@@ -1,60 +1,445 @@
+import asyncio
+import base64
+import csv
+import io
 import json
+import math
 import os
 import time
 from contextlib import asynccontextmanager
-from typing import Any
+from dataclasses import dataclass
+from typing import Annotated, Any
 from uuid import uuid4
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import String, func, select
+from sqlalchemy import String, Text, and_, cast, func, literal, or_, select, text, tuple_
 from sqlalchemy import update as sql_update
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql import JSONB, JSONPATH, insert
+from sqlalchemy.ext.asyncio import AsyncEngine
 
+from basehook import jsoncodec
+from basehook.archive import MAX_SEGMENT_BYTES
+from basehook.cache import AsyncTTLCache
 from basehook.core import Basehook
+from basehook.dedup import RecentDeliveries, delivery_key, record_delivery
 from basehook.hmac_utils import verify_hmac_signature
+from basehook.instrumentation import IngestTrace, attach, detach, emit
+from basehook.jobs import Job, JobRegistry, update_in_chunks
 from basehook.models import (
     ThreadUpdateStatus,
-    metadata,
+    content_index_table,
     thread_table,
+    thread_update_payload_table,
     thread_update_table,
     webhook_table,
 )
+from basehook.openmetrics import CONTENT_TYPE as OPENMETRICS_CONTENT_TYPE
+from basehook.openmetrics import (
+    INGEST_SECONDS,
+    OLDEST_PENDING_AGE_SECONDS,
+    PENDING_UPDATES,
+    POOL_WAIT_SECONDS,
+)
+from basehook.openmetrics import render as render_openmetrics
+from basehook.payloads import is_offloaded, load_payload, load_payloads, offload_payload
+from basehook.queues import get_queue_stats
+from basehook.rollup import ROLLUP_SECONDS, windowed_counts
+from basehook.stream import UpdateBroadcaster
 
 basehook: Basehook | None = None
+# Shared by all dashboard viewers, so that polling load does not scale with their number
+response_cache: AsyncTTLCache | None = None
+job_registry = JobRegistry()
+# Shared LISTEN connection feeding /api/stream
+update_broadcaster: UpdateBroadcaster | None = None
+# Whether the NOTIFY trigger is enabled, see BASEHOOK_STREAM_UPDATES
+update_notifications = False
+# Default replica staleness bound of read-only endpoints, in seconds
+read_max_staleness = 5.0
+# Delivery keys ingested by this process, answers redelivery storms without a round trip
+recent_deliveries = RecentDeliveries()
+# Request bodies above max_body_bytes are rejected (unless the webhook sets its own limit),
+# bodies above payload_offload_bytes are stored compressed out of line
+max_body_bytes = 10 * 1024 * 1024
+payload_offload_bytes = 256 * 1024
+
+# Number of trailing metric windows recomputed when a cached series expires
+METRICS_TAIL_WINDOWS = 2
+METRICS_FULL_REFRESH_IN_SECONDS = 300
+
+
+async def _run_periodically(name: str, interval_in_seconds: float, job):
+    """Run a maintenance job forever, logging failures without stopping the loop."""
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            print(f"✗ {name} failed: {e}")
+        await asyncio.sleep(interval_in_seconds)
+
+
+async def _retention_job():
+    """Apply retention policies. Safe to run on every node (advisory locked)."""
+    report = await basehook.run_retention()
+    if report is not None and (report.rows_deleted or report.rows_stripped):
+        print(
+            f"✓ Retention: {report.rows_deleted} rows deleted, "
+            f"{report.rows_stripped} rows stripped, {report.bytes_reclaimed} bytes reclaimed"
+        )
+
+
+def _archive_job(older_than_in_seconds: float, max_segment_bytes: int):
+    async def job():
+        report = await basehook.archive(
+            older_than_in_seconds=older_than_in_seconds, max_segment_bytes=max_segment_bytes
+        )
+        if report is not None and report.rows_archived:
+            print(
+                f"✓ Archive: {report.rows_archived} rows in {report.segments_written} segments, "
+                f"{report.bytes_written} bytes written"
+            )
+
+    return job
+
+
+def _partition_job(partition_interval: float, retention_in_seconds: float | None):
+    async def job():
+        created, dropped = await basehook.maintain_partitions(
+            partition_interval, retention_in_seconds=retention_in_seconds
+        )
+        for name in created:
+            print(f"✓ Created partition {name}")
+        for name in dropped:
+            print(f"✓ Dropped partition {name}")
+
+    return job
+
+
+async def _read_engine(max_staleness: float | None = None):
+    """
+    Engine for read-only endpoints: the read replica (READ_DATABASE_URL) unless it lags more
+    than `max_staleness` seconds behind, the primary otherwise.
+    """
+    if max_staleness is None:
+        max_staleness = read_max_staleness
+    try:
+        max_staleness = float(max_staleness)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail="Invalid max_staleness") from e
+    return await basehook.get_read_engine(max_staleness)
+
+
+def _dedup_prune_job(dedup_window: float):
+    async def job():
+        pruned = await basehook.prune_deliveries(older_than_in_seconds=dedup_window)
+        if pruned:
+            print(f"✓ Dedup: {pruned} delivery keys pruned")
+
+    return job
+
+
+async def _payload_prune_job():
+    pruned = await basehook.prune_payloads()
+    if pruned:
+        print(f"✓ Payloads: {pruned} orphaned payloads pruned")
+
+
+async def _background_migrations(partition_interval: float | None):
+    """Apply the migrations startup does not wait for, unless another process is at it."""
+    try:
+        applied = await basehook.migrate(partition_interval=partition_interval)
+        if applied:
+            print(f"✓ Background migrations applied: {applied}")
+    except Exception as e:
+        print(f"✗ Background migrations failed: {e}")
+
+
+async def _metrics_fold_job():
+    """Fold the metrics deltas into the rollup, keeps the tail read by /api/metrics short."""
+    await basehook.fold_metrics()
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
-    global basehook
+    global basehook, response_cache, update_broadcaster, read_max_staleness
+    global max_body_bytes, payload_offload_bytes, update_notifications
     basehook = Basehook()  # Create in event loop
-
-    # Create tables - will fail if database is not available
+    read_max_staleness = float(os.getenv("BASEHOOK_READ_MAX_STALENESS", "5"))
+    max_body_bytes = int(os.getenv("BASEHOOK_MAX_BODY_BYTES", str(max_body_bytes)))
+    payload_offload_bytes = int(
+        os.getenv("BASEHOOK_PAYLOAD_OFFLOAD_BYTES", str(payload_offload_bytes))
+    )
+    update_broadcaster = UpdateBroadcaster(basehook.engine)
+    response_cache = AsyncTTLCache(
+        ttl_in_seconds=float(os.getenv("BASEHOOK_CACHE_TTL", "5")),
+        max_entries=int(os.getenv("BASEHOOK_CACHE_MAX_ENTRIES", "256")),
+    )
+
+    # Optional time-based partitioning of thread_update (interval and retention in seconds)
+    partition_interval = os.getenv("BASEHOOK_PARTITION_INTERVAL")
+    partition_interval = float(partition_interval) if partition_interval else None
+    partition_retention = os.getenv("BASEHOOK_PARTITION_RETENTION")
+    partition_retention = float(partition_retention) if partition_retention else None
+
+    # Migrate the schema - will fail if database is not available
     # Railway will restart the app when DATABASE_URL is added
     try:
-        await basehook.create_tables(metadata)
-        print("✓ Database tables created successfully")
+        # Index builds and rollup rebuilds are left to a background task, see below
+        applied = await basehook.migrate(partition_interval=partition_interval, background=False)
+        if applied:
+            print(f"✓ Database schema migrated to version {applied[-1]}")
+        else:
+            print("✓ Database schema up to date")
     except Exception as e:
         print(f"✗ Database connection failed: {e}")
         print("Waiting for DATABASE_URL to be configured...")
         raise  # Let Railway restart the app
 
+    # The NOTIFY trigger feeding /api/stream costs every writer, it only exists when enabled
+    update_notifications = os.getenv("BASEHOOK_STREAM_UPDATES", "").lower() in ("1", "true")
+    try:
+        await basehook.set_update_notifications(update_notifications)
+    except Exception as e:
+        state = "enabled" if update_notifications else "disabled"
+        print(f"✗ Update notifications not {state}: {e}")
+
+    background_tasks = [
+        asyncio.create_task(
+            _run_periodically(
+                "Metrics fold",
+                float(os.getenv("BASEHOOK_METRICS_FOLD_INTERVAL", "10")),
+                _metrics_fold_job,
+            )
+        ),
+        asyncio.create_task(
+            _run_periodically(
+                "Dedup prune",
+                3600,
+                _dedup_prune_job(float(os.getenv("BASEHOOK_DEDUP_WINDOW", str(7 * 24 * 3600)))),
+            )
+        ),
+        asyncio.create_task(_run_periodically("Payload prune", 3600, _payload_prune_job)),
+        asyncio.create_task(_background_migrations(partition_interval)),
+    ]
+    retention_interval = os.getenv("BASEHOOK_RETENTION_INTERVAL")
+    if retention_interval:
+        background_tasks.append(
+            asyncio.create_task(
+                _run_periodically("Retention", float(retention_interval), _retention_job)
+            )
+        )
+    archive_after = os.getenv("BASEHOOK_ARCHIVE_AFTER")
+    if archive_after and basehook.archive_dir:
+        background_tasks.append(
+            asyncio.create_task(
+                _run_periodically(
+                    "Archive",
+                    3600,
+                    _archive_job(
+                        float(archive_after),
+                        int(os.getenv("BASEHOOK_ARCHIVE_SEGMENT_BYTES", str(MAX_SEGMENT_BYTES))),
+                    ),
+                )
+            )
+        )
+    if partition_interval:
+        background_tasks.append(
+            asyncio.create_task(
+                _run_periodically(
+                    "Partition maintenance",
+                    min(partition_interval / 4, 3600),
+                    _partition_job(partition_interval, partition_retention),
+                )
+            )
+        )
+
     yield
+
+    for task in background_tasks:
+        task.cancel()
+    job_registry.cancel_all()
+    await update_broadcaster.close()
     # Optionally dispose
     await basehook.engine.dispose()
+    if basehook.read_engine is not None:
+        await basehook.read_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+# Native type of the filterable columns, used to compile index-friendly comparisons
+NUMERIC_COLUMNS = {"id": int, "revision_number": float, "timestamp": float, "priority": int}
+TEXT_COLUMNS = {"webhook_name", "thread_id", "traceback"}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+
+def _parse_filter_value(field_name: str, value: Any) -> Any:
+    """Convert a filter value to the native type of the column, raises a 400 if not possible."""
+    try:
+        if field_name in NUMERIC_COLUMNS:
+            return NUMERIC_COLUMNS[field_name](value)
+        if field_name == "status":
+            return ThreadUpdateStatus[str(value).upper()]
+    except (TypeError, ValueError, KeyError) as e:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid value for {field_name}: {value!r}"
+        ) from e
+    return str(value)
+
+
+def _compile_filter(field_name: str, operator: str, value: Any):
+    """
+    Compile one filter into a condition on the native column type, so that it can use an index:
+    - numeric columns: equality and ranges
+    - status: enum membership (text operators match the status names), negations are
+      compiled to the membership of the other statuses
+    - text columns: exact, case-sensitive equality (B-tree), prefix match (text_pattern_ops
+      index), case-insensitive substring match (trigram GIN index)
+
+    Negated text filters (ne, notILike) cannot use an index, they only narrow down the rows
+    selected by the other filters (time range, webhook, status).
+
+    Returns None for unsupported operators.
+    """
+    column = getattr(thread_update_table.c, field_name)
+    values = value if isinstance(value, list) else [value]
+
+    if operator == "isEmpty":
+        return column.is_(None)
+    if operator == "isNotEmpty":
+        return column.isnot(None)
+
+    if field_name == "status" and operator in ("iLike", "notILike"):
+        # substring match on the status names, compiled to an enum membership
+        matching = [s for s in ThreadUpdateStatus if str(value).lower() in s.value]
+        if operator == "notILike":
+            matching = [s for s in ThreadUpdateStatus if s not in matching]
+        return column.in_(matching)
+
+    if field_name == "status" and operator in ("ne", "notInArray"):
+        excluded = {_parse_filter_value(field_name, v) for v in values}
+        return column.in_([s for s in ThreadUpdateStatus if s not in excluded])
+
+    if field_name in NUMERIC_COLUMNS and operator == "iLike":
+        operator = "eq"  # substring match makes no sense for numbers
+
+    if operator == "inArray" or operator == "eq" and isinstance(value, list):
+        return column.in_([_parse_filter_value(field_name, v) for v in values])
+    if operator == "notInArray" or operator == "ne" and isinstance(value, list):
+        return column.notin_([_parse_filter_value(field_name, v) for v in values])
+    if operator == "eq":
+        return column == _parse_filter_value(field_name, value)
+    if operator == "ne":
+        return column != _parse_filter_value(field_name, value)
+
+    if field_name in NUMERIC_COLUMNS:
+        if operator == "lt":
+            return column < _parse_filter_value(field_name, value)
+        if operator == "lte":
+            return column <= _parse_filter_value(field_name, value)
+        if operator == "gt":
+            return column > _parse_filter_value(field_name, value)
+        if operator == "gte":
+            return column >= _parse_filter_value(field_name, value)
+        if operator == "isBetween" and len(values) == 2:
+            lower, upper = (_parse_filter_value(field_name, v) for v in values)
+            return column.between(lower, upper)
+
+    if field_name in TEXT_COLUMNS:
+        if operator == "iLike":
+            return column.ilike(f"%{_escape_like(str(value))}%", escape="/")
+        if operator == "notILike":
+            return ~column.ilike(f"%{_escape_like(str(value))}%", escape="/")
+        if operator == "startsWith":
+            return column.like(f"{_escape_like(str(value))}%", escape="/")
+
+    return None
+
+
+def _parse_content_path(path: Any) -> list[str]:
+    """Accept a JSON path as a list of keys or a dotted string, e.g. "customer.id"."""
+    if isinstance(path, str):
+        path = path.split(".")
+    if not isinstance(path, list) or not path:
+        raise HTTPException(status_code=400, detail="Content filters require a path")
+    return [str(key) for key in path]
+
+
+def _jsonb(value: Any):
+    # cast from text rather than a JSONB bind, so the query can be rendered with literal binds
+    return cast(literal(json.dumps(value), String), JSONB)
+
+
+def _nest(path: list[str], value: Any) -> Any:
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def _compile_content_filter(path: Any, operator: str, value: Any):
+    """
+    Compile a filter on a JSON path within `content`, using operators supported by the
+    `jsonb_path_ops` GIN index:
+    - eq / ne: containment of {path: value} (`@>`). The `content #>> path` text equality is
+      added too, so that a B-tree index promoted for this path (see
+      Basehook.index_content_path) can be used instead of the GIN one. A null value only
+      compiles to the containment of {path: null}.
+    - contains: containment of a JSON document at the path (`@>`)
+    - exists / notExists: path existence (`@?`)
+
+    Numeric keys are array positions, which containment cannot express: they fall back to
+    a non-indexed comparison. Bodies stored out of line only keep their extracted fields in
+    `content`, other paths do not match them.
+    """
+    column = thread_update_table.c.content
+
+    if operator == "isEmpty" and path is None:
+        return column.is_(None)
+    if operator == "isNotEmpty" and path is None:
+        return column.isnot(None)
+
+    path = _parse_content_path(path)
+    has_positions = any(key.isdigit() for key in path)
+
+    if operator in ("exists", "notExists", "isNotEmpty", "isEmpty"):
+        json_path = "$" + "".join(
+            f"[{key}]" if key.isdigit() else "." + json.dumps(key) for key in path
+        )
+        condition = column.op("@?")(cast(json_path, JSONPATH))
+        return condition if operator in ("exists", "isNotEmpty") else ~condition
+
+    if operator in ("eq", "ne", "iLike"):
+        if has_positions:
+            condition = column[path] == _jsonb(value)
+        elif value is None:
+            # `#>>` turns a JSON null into SQL NULL, containment alone matches it
+            condition = column.contains(_jsonb(_nest(path, None)))
+        else:
+            condition = and_(
+                column.contains(_jsonb(_nest(path, value))),
+                column[path].astext == (value if isinstance(value, str) else json.dumps(value)),
+            )
+        return ~condition if operator == "ne" else condition
+
+    if operator == "contains" and not has_positions:
+        return column.contains(_jsonb(_nest(path, value)))
+
+    return None
+
+
 def apply_filters_to_query(query, filters: list):
     """
     Apply filters to a SQLAlchemy query.
 
     Args:
         query: SQLAlchemy select query
-        filters: List of filter objects with {id, value, operator}
+        filters: List of filter objects with {id, value, operator}, and {path} for content
 
     Returns:
         Modified query with filters applied
@@ -64,25 +449,16 @@ def apply_filters_to_query(query, filters: list):
         field_value = filter_item.get("value")
         operator = filter_item.get("operator", "iLike")
 
-        # Check if column exists in table
-        if not field_name or not hasattr(thread_update_table.c, field_name):
+        # Check if column can be filtered on
+        if field_name == "content":
+            condition = _compile_content_filter(filter_item.get("path"), operator, field_value)
+        elif field_name in NUMERIC_COLUMNS or field_name in TEXT_COLUMNS | {"status"}:
+            condition = _compile_filter(field_name, operator, field_value)
+        else:
             continue
 
-        column = func.cast(getattr(thread_update_table.c, field_name), String)
-
-        # Apply operator
-        if operator == "eq":
-            query = query.where(func.lower(column) == func.lower(field_value))
-        elif operator == "ne":
-            query = query.where(func.lower(column) != func.lower(field_value))
-        elif operator == "iLike":
-            query = query.where(column.ilike(f"%{field_value}%"))
-        elif operator == "notILike":
-            query = query.where(~column.ilike(f"%{field_value}%"))
-        elif operator == "isEmpty":
-            query = query.where(column.is_(None))
-        elif operator == "isNotEmpty":
-            query = query.where(column.isnot(None))
+        if condition is not None:
+            query = query.where(condition)
 
     return query
 
@@ -142,20 +518,89 @@ def _get_revision_number(json: Any, path: list[str]) -> float:
     return time.time()
 
 
+# Range of the thread_update.priority column, values beyond are clamped at ingest
+PRIORITY_MIN, PRIORITY_MAX = -(2**31), 2**31 - 1
+
+
+def _validate_priority_map(priority_map: Any) -> None:
+    """Raise a 400 unless the priority map is null or maps values to integer priorities."""
+    if priority_map is None:
+        return
+    if not isinstance(priority_map, dict) or not all(
+        isinstance(priority, int) and not isinstance(priority, bool)
+        for priority in priority_map.values()
+    ):
+        raise HTTPException(
+            status_code=400, detail="priority_map must map values to integer priorities"
+        )
+
+
+def _get_priority(json: Any, webhook_row: Any) -> int:
+    """
+    Compute the priority of an update at ingest.
+
+    The value found at `priority_path` is looked up in `priority_map` if configured
+    (e.g. {"payment_failed": 10}), otherwise used as is when numeric, clamped to the range
+    of the priority column. Falls back to the webhook default priority.
+    """
+    if not webhook_row.priority_path:
+        return webhook_row.priority
+
+    value = _get_from_json(json, webhook_row.priority_path)
+    if value is None:
+        return webhook_row.priority
+
+    if webhook_row.priority_map:
+        mapped = webhook_row.priority_map.get(str(value))
+        if isinstance(mapped, int):
+            value = mapped
+
+    try:
+        priority = int(value)
+    except (TypeError, ValueError, OverflowError):  # e.g. "high", NaN, inf
+        return webhook_row.priority
+    # thread_update.priority is a 32-bit integer
+    return min(max(priority, PRIORITY_MIN), PRIORITY_MAX)
+
+
+def _range_cutoff(time_range: str) -> float | None:
+    """Timestamp from which updates are included for a range (1h, 6h, 24h, 7d, 30d, all)."""
+    range_seconds = {
+        "1h": 3600,
+        "6h": 6 * 3600,
+        "24h": 24 * 3600,
+        "7d": 7 * 24 * 3600,
+        "30d": 30 * 24 * 3600,
+        "all": None,
+    }
+    cutoff_seconds = range_seconds.get(time_range, None)
+    return time.time() - cutoff_seconds if cutoff_seconds else None
+
+
 @app.post("/api/query")
 async def query_thread_updates(request: Request):
     """
     Query thread updates with filtering, sorting, and pagination.
 
+    Pagination is keyset based when a `cursor` (the `next_cursor` of the previous page) is
+    given, so deep pages are as fast as the first one. `page` falls back to OFFSET pagination.
+
     Request body:
         {
             "page": 1,
             "per_page": 10,
+            "cursor": "eyJzb3J0Ij...",  // Optional: next_cursor of the previous page
+            "count": "estimated",  // Optional: exact, estimated (default) or none
+            "fields": ["id", "thread_id", "status", "content_preview"],  // Optional projection
+            "preview_length": 200,  // Optional: length of content_preview
             "range": "24h",  // Optional: 1h, 6h, 24h, 7d, 30d, all
+            "archived": false,  // Optional: query archived updates instead
+            "max_staleness": 5,  // Optional: seconds of replica lag tolerated
             "filters": [
                 {"id": "thread_id", "value": "thread-1"},
                 {"id": "webhook_name", "value": "test"},
-                {"id": "status", "value": ["PENDING", "SUCCESS"]}
+                {"id": "status", "value": ["PENDING", "SUCCESS"]},
+                {"id": "content", "path": ["customer", "id"], "value": "cus_1", "operator": "eq"}
             ],
             "sort": [
                 {"id": "timestamp", "desc": true}
@@ -165,10 +610,11 @@ async def query_thread_updates(request: Request):
     Returns:
         {
             "updates": [...],
-            "total": 123,
+            "total": 123,  // null when count is none
             "page": 1,
             "per_page": 10,
-            "total_pages": 13
+            "total_pages": 13,
+            "next_cursor": "eyJzb3J0Ij..."  // null on the last page
         }
     """
     body = await request.json()
@@ -176,6 +622,8 @@ async def query_thread_updates(request: Request):
     # Extract pagination
     page = body.get("page", 1)
     per_page = body.get("per_page", 10)
+    cursor = body.get("cursor")
+    count_mode = body.get("count", "estimated")
 
     # Extract filters, sort, and time range
     filters = body.get("filters", [])
@@ -183,20 +631,23 @@ async def query_thread_updates(request: Request):
     time_range = body.get("range", "all")
 
     # Calculate time range cutoff
-    range_seconds = {
-        "1h": 3600,
-        "6h": 6 * 3600,
-        "24h": 24 * 3600,
-        "7d": 7 * 24 * 3600,
-        "30d": 30 * 24 * 3600,
-        "all": None,
-    }
-    cutoff_seconds = range_seconds.get(time_range, None)
-    cutoff_timestamp = time.time() - cutoff_seconds if cutoff_seconds else None
+    cutoff_timestamp = _range_cutoff(time_range)
 
-    async with basehook.engine.begin() as conn:
-        # Build base query
-        query = select(thread_update_table)
+    if body.get("archived"):
+        return await _query_archive(page, per_page, filters, cutoff_timestamp)
+
+    # Extract projection, defaults to every column for backward compatibility
+    fields = body.get("fields") or DEFAULT_QUERY_FIELDS
+    preview_length = _parse_preview_length(body.get("preview_length", 200))
+    unknown_fields = set(fields) - QUERY_FIELDS
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown_fields)}")
+    sort_columns = _get_sort_columns(sorts)
+    engine = await _read_engine(body.get("max_staleness"))
+
+    async with engine.begin() as conn:
+        # Build base query, sort columns are always selected to build the cursor
+        query = select(*_get_projection(fields, sort_columns, preview_length))
 
         # Apply time range filter
         if cutoff_timestamp is not None:
@@ -205,75 +656,518 @@ async def query_thread_updates(request: Request):
         # Apply filters
         query = apply_filters_to_query(query, filters)
 
-        # Get total count before pagination
-        count_query = select(func.count()).select_from(query.subquery())
-        total_result = await conn.execute(count_query)
-        total = total_result.scalar() or 0
-
-        # Apply sorting dynamically
-        if sorts and isinstance(sorts, list):
-            for sort_item in sorts:
-                sort_field = sort_item.get("id")
-                sort_desc = sort_item.get("desc", False)
-
-                # Check if column exists
-                if sort_field and hasattr(thread_update_table.c, sort_field):
-                    column = getattr(thread_update_table.c, sort_field)
-                    if sort_desc:
-                        query = query.order_by(column.desc())
-                    else:
-                        query = query.order_by(column.asc())
+        # Get total count before pagination, exact counts are a full scan of the filtered rows
+        if count_mode == "exact":
+            count_query = select(func.count()).select_from(query.subquery())
+
+            async def count(_previous):
+                return (await conn.execute(count_query)).scalar() or 0
+
+            key = ("count", time_range, json.dumps(filters, sort_keys=True))
+            total = await response_cache.get(key, count)
+        elif count_mode == "estimated":
+            unfiltered = cutoff_timestamp is None and not filters
+            total = await _estimate_count(conn, query, unfiltered=unfiltered)
         else:
-            # Default sort by timestamp descending
-            query = query.order_by(thread_update_table.c.timestamp.desc())
+            total = None
 
-        # Apply pagination
-        offset = (page - 1) * per_page
-        query = query.offset(offset).limit(per_page)
+        # Apply sorting dynamically, id breaks ties so that the cursor is unambiguous
+        query = query.order_by(
+            *(column.desc() if desc else column.asc() for column, desc in sort_columns)
+        )
+
+        # Apply pagination, keyset when a cursor is given, offset otherwise
+        if cursor:
+            try:
+                values = _decode_cursor(cursor, sort_columns)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail="Invalid cursor") from e
+            query = query.where(_keyset_condition(sort_columns, values))
+        else:
+            query = query.offset((page - 1) * per_page)
+        query = query.limit(per_page + 1)
 
         # Execute query
         result = await conn.execute(query)
         updates = result.all()
+        has_more = len(updates) > per_page
+        updates = updates[:per_page]
 
         return {
-            "updates": [
-                {
-                    "id": u.id,
-                    "webhook_name": u.webhook_name,
-                    "thread_id": u.thread_id,
-                    "revision_number": u.revision_number,
-                    "content": u.content,
-                    "timestamp": u.timestamp,
-                    "status": u.status.value if hasattr(u.status, "value") else str(u.status),
-                    "traceback": u.traceback,
-                }
-                for u in updates
-            ],
+            "updates": [_serialize_update(u, fields) for u in updates],
             "total": total,
             "page": page,
             "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page,  # Ceiling division
+            "total_pages": (
+                (total + per_page - 1) // per_page if total is not None else None
+            ),  # Ceiling division
+            "next_cursor": _encode_cursor(updates[-1], sort_columns) if has_more else None,
         }
 
 
+# Fields that can be projected in /api/query, content_preview is computed in SQL
+QUERY_FIELDS = {
+    "id",
+    "webhook_name",
+    "thread_id",
+    "revision_number",
+    "content",
+    "content_preview",
+    "timestamp",
+    "status",
+    "traceback",
+    "priority",
+}
+DEFAULT_QUERY_FIELDS = [
+    "id",
+    "webhook_name",
+    "thread_id",
+    "revision_number",
+    "content",
+    "timestamp",
+    "status",
+    "traceback",
+    "priority",
+]
+
+
+def _parse_preview_length(value: Any) -> int:
+    """Length of content_preview, raises a 400 unless it is a non-negative integer."""
+    try:
+        preview_length = int(value)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid preview_length: {value!r}") from e
+    if isinstance(value, bool) or preview_length < 0:
+        raise HTTPException(status_code=400, detail=f"Invalid preview_length: {value!r}")
+    return preview_length
+
+
+def _get_projection(fields: list[str], sort_columns: list[tuple[Any, bool]], preview_length: int):
+    """Columns to select for the requested fields, plus the sort columns and id."""
+    columns = {column.name: column for column, _ in sort_columns}
+    for field_name in fields:
+        if field_name == "content_preview":
+            columns[field_name] = func.left(
+                cast(thread_update_table.c.content, Text), preview_length
+            ).label("content_preview")
+        else:
+            columns[field_name] = getattr(thread_update_table.c, field_name)
+    return list(columns.values())
+
+
+def _serialize_update(row: Any, fields: list[str]) -> dict[str, Any]:
+    update = {"id": row.id}
+    for field_name in fields:
+        value = getattr(row, field_name)
+        if field_name == "status":
+            value = value.value if hasattr(value, "value") else str(value)
+        update[field_name] = value
+    return update
+
+
+# Columns that can be sorted on, they are non-nullable so keyset comparisons are well defined
+SORTABLE_COLUMNS = {
+    "id",
+    "webhook_name",
+    "thread_id",
+    "revision_number",
+    "timestamp",
+    "status",
+    "priority",
+}
+
+
+def _get_sort_columns(sorts: list) -> list[tuple[Any, bool]]:
+    """
+    Resolve the requested sort into (column, desc) pairs, defaulting to timestamp descending.
+    The primary key is always appended as a tie breaker.
+    """
+    sort_columns = []
+    if sorts and isinstance(sorts, list):
+        for sort_item in sorts:
+            sort_field = sort_item.get("id")
+            if sort_field in SORTABLE_COLUMNS and sort_field != "id":
+                sort_columns.append(
+                    (getattr(thread_update_table.c, sort_field), bool(sort_item.get("desc", False)))
+                )
+    if not sort_columns:
+        sort_columns.append((thread_update_table.c.timestamp, True))
+
+    id_desc = next(
+        (bool(s.get("desc", False)) for s in sorts or [] if s.get("id") == "id"),
+        sort_columns[0][1],
+    )
+    sort_columns.append((thread_update_table.c.id, id_desc))
+    return sort_columns
+
+
+def _encode_cursor(row: Any, sort_columns: list[tuple[Any, bool]]) -> str:
+    """Opaque token holding the sort signature and the sort values of the last row."""
+    values = []
+    for column, _ in sort_columns:
+        value = getattr(row, column.name)
+        values.append(value.name if isinstance(value, ThreadUpdateStatus) else value)
+    payload = {"sort": [[column.name, desc] for column, desc in sort_columns], "values": values}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str, sort_columns: list[tuple[Any, bool]]) -> list[Any]:
+    """Decode a cursor, it must have been issued for the same sort. Raises ValueError if not."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+    if not isinstance(payload, dict) or not isinstance(payload.get("values"), list):
+        raise ValueError("Malformed cursor")
+    if payload.get("sort") != [[column.name, desc] for column, desc in sort_columns]:
+        raise ValueError("Cursor was issued for a different sort")
+
+    values = []
+    for (column, _), value in zip(sort_columns, payload["values"], strict=True):
+        if column.name == "status":
+            if value not in ThreadUpdateStatus.__members__:
+                raise ValueError(f"Unknown status in cursor: {value}")
+            value = ThreadUpdateStatus[value]
+        elif column.name in NUMERIC_COLUMNS:
+            if isinstance(value, bool) or not isinstance(value, int | float):
+                raise ValueError(f"Invalid {column.name} in cursor")
+        elif value is not None and not isinstance(value, str):
+            raise ValueError(f"Invalid {column.name} in cursor")
+        values.append(value)
+    return values
+
+
+def _keyset_condition(sort_columns: list[tuple[Any, bool]], values: list[Any]):
+    """
+    Condition selecting the rows strictly after `values` in the sort order.
+    A row comparison is used when all directions match, so the index can be used as a range.
+    """
+    directions = {desc for _, desc in sort_columns}
+    if len(directions) == 1:
+        columns = tuple_(*(column for column, _ in sort_columns))
+        bounds = tuple_(
+            *(
+                literal(value, column.type)
+                for (column, _), value in zip(sort_columns, values, strict=True)
+            )
+        )
+        return columns < bounds if directions.pop() else columns > bounds
+
+    # mixed directions: (a > x) OR (a = x AND b < y) OR ...
+    conditions = []
+    for i, (column, desc) in enumerate(sort_columns):
+        previous = [c == v for (c, _), v in zip(sort_columns[:i], values[:i], strict=True)]
+        conditions.append(and_(*previous, column < values[i] if desc else column > values[i]))
+    return or_(*conditions)
+
+
+async def _estimate_count(conn, query, *, unfiltered: bool) -> int:
+    """
+    Estimate the number of rows returned by the query without scanning them.
+
+    Unfiltered queries use the table statistics (summed over partitions when partitioned),
+    other queries use the planner row estimate.
+    """
+    if unfiltered:
+        estimate = await conn.scalar(
+            text(
+                "SELECT sum(greatest(c.reltuples, 0)) FROM pg_class c "
+                "WHERE c.oid = to_regclass(:table) OR c.oid IN "
+                "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table))"
+            ),
+            {"table": thread_update_table.name},
+        )
+        if estimate:
+            return int(estimate)
+
+    compiled = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def _query_archive(page: int, per_page: int, filters: list, cutoff_timestamp: float | None):
+    """
+    Query archived updates, newest first. Only `eq` filters on webhook_name and thread_id and
+    status membership filters are supported, as segments are only indexed by webhook, thread
+    and time, other filters are rejected with a 400.
+
+    Only the segments up to the requested page are read, so the total is only returned on
+    the last page.
+    """
+    webhook_name = None
+    thread_id = None
+    statuses = None
+    for filter_item in filters:
+        field_name = filter_item.get("id")
+        operator = filter_item.get("operator")
+        value = filter_item.get("value")
+        if field_name == "status" and operator in (None, "eq", "inArray"):
+            values = value if isinstance(value, list) else [value]
+            statuses = {str(v).lower() for v in values}
+        elif field_name == "webhook_name" and operator == "eq":
+            webhook_name = value
+        elif field_name == "thread_id" and operator == "eq":
+            thread_id = value
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported filter on archived updates: {field_name} {operator}",
+            )
+
+    offset = (page - 1) * per_page
+    # Without a status filter, whole segments of the previous pages are skipped unread
+    skip = offset if statuses is None else 0
+    matched = skip
+    updates = []
+    has_more = False
+    async for row in basehook.read_archive(
+        webhook_name=webhook_name,
+        thread_id=thread_id,
+        start=cutoff_timestamp,
+        newest_first=True,
+        skip=skip,
+    ):
+        if statuses is not None and row["status"] not in statuses:
+            continue
+        if matched >= offset + per_page:
+            has_more = True
+            break
+        if matched >= offset:
+            updates.append(row)
+        matched += 1
+
+    # Past the last page, the number of rows skipped (hence the total) is unknown
+    total = matched if not has_more and (updates or not offset) else None
+    return {
+        "updates": updates,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        # Ceiling division
+        "total_pages": (total + per_page - 1) // per_page if total is not None else None,
+        "has_more": has_more,
+    }
+
+
+# Rows fetched per round trip of the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+
+@app.post("/api/export")
+async def export_thread_updates(request: Request):
+    """
+    Stream every update matching the filters, ordered by id, as NDJSON or CSV.
+
+    Rows are read through a server-side cursor in batches and written as they come, so memory
+    stays constant whatever the size of the export. An interrupted export is resumed by passing
+    the last id received as `after_id`.
+
+    Request body:
+        {
+            "format": "ndjson",  // Optional: ndjson (default) or csv
+            "fields": ["thread_id", "status", "content"],  // Optional, id is always included
+            "after_id": 1234,  // Optional: only export updates with a greater id
+            "range": "24h",  // Optional: 1h, 6h, 24h, 7d, 30d, all
+            "max_staleness": 5,  // Optional: seconds of replica lag tolerated
+            "filters": [...]  // Same as /api/query
+        }
+
+    Returns:
+        One JSON object per line (NDJSON), or a CSV file with a header row. Content is
+        JSON-encoded in CSV cells.
+    """
+    body = await request.json()
+    export_format = body.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail=f"Unknown format: {export_format}")
+    fields = [f for f in body.get("fields") or DEFAULT_QUERY_FIELDS if f != "id"]
+    unknown_fields = set(fields) - QUERY_FIELDS
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown_fields)}")
+    after_id = body.get("after_id")
+    cutoff_timestamp = _range_cutoff(body.get("range", "all"))
+
+    id_column = thread_update_table.c.id
+    preview_length = _parse_preview_length(body.get("preview_length", 200))
+    query = select(*_get_projection(fields, [(id_column, False)], preview_length))
+    if cutoff_timestamp is not None:
+        query = query.where(thread_update_table.c.timestamp >= cutoff_timestamp)
+    if after_id is not None:
+        query = query.where(id_column > _parse_filter_value("id", after_id))
+    # Filters are compiled before streaming, so that invalid ones are still reported as a 400
+    query = apply_filters_to_query(query, body.get("filters", [])).order_by(id_column.asc())
+    engine = await _read_engine(body.get("max_staleness"))
+
+    async def rows():
+        async with engine.connect() as conn:
+            result = await conn.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for batch in result.partitions():
+                updates = [_serialize_update(row, fields) for row in batch]
+                if "content" in fields and any(is_offloaded(u["content"]) for u in updates):
+                    # Bodies stored out of line are exported in full, one round trip per batch,
+                    # on another connection as this one is busy with the cursor
+                    async with engine.connect() as payload_conn:
+                        contents = await load_payloads(
+                            payload_conn, {update["id"]: update["content"] for update in updates}
+                        )
+                    for update in updates:
+                        update["content"] = contents[update["id"]]
+                yield updates
+
+    if export_format == "csv":
+        header = ["id", *fields]
+
+        async def lines():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(header)
+            yield buffer.getvalue()
+            async for batch in rows():
+                buffer.seek(0)
+                buffer.truncate()
+                for update in batch:
+                    writer.writerow(
+                        json.dumps(value) if isinstance(value, dict | list) else value
+                        for value in update.values()
+                    )
+                yield buffer.getvalue()
+
+        media_type = "text/csv"
+    else:
+
+        async def lines():
+            async for batch in rows():
+                yield "".join(jsoncodec.dumps(update) + "\n" for update in batch)
+
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        lines(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="updates.{export_format}"'},
+    )
+
+
+@app.post("/api/archive/replay")
+async def replay_archived(request: Request):
+    """
+    Re-inject archived updates as PENDING.
+
+    Request body:
+        {
+            "ids": [1, 2, 3]
+        }
+
+    Returns:
+        {
+            "replayed": 3
+        }
+    """
+    body = await request.json()
+    ids = body.get("ids", [])
+    if not ids:
+        raise HTTPException(status_code=400, detail="ids is required")
+
+    return {"replayed": await basehook.replay_archived(ids)}
+
+
+@app.get("/api/updates/{update_id}")
+async def get_update(update_id: int, max_staleness: float | None = None):
+    """
+    Get a single thread update with its full content and traceback, for lazy loading from
+    /api/query results projected without them.
+
+    Query params:
+        max_staleness: Seconds of replica lag tolerated
+
+    Returns:
+        {
+            "id": 1,
+            "webhook_name": "test",
+            "content": {...},
+            "traceback": null,
+            ...
+        }
+    """
+    engine = await _read_engine(max_staleness)
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            select(thread_update_table).where(thread_update_table.c.id == update_id)
+        )
+        update = result.first()
+        if update is None:
+            raise HTTPException(status_code=404, detail=f"Update {update_id} not found")
+
+        serialized = _serialize_update(update, DEFAULT_QUERY_FIELDS)
+        serialized["content"] = await load_payload(conn, update.content, update.id)
+        return serialized
+
+
+# Rows updated per transaction by a background status update, at most
+MAX_CHUNK_SIZE = 100000
+
+
+def _parse_chunk_size(value: Any) -> int:
+    """Chunk size of a background update, raises a 400 unless it is in 1..MAX_CHUNK_SIZE."""
+    try:
+        chunk_size = int(value)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid chunk_size: {value!r}") from e
+    if isinstance(value, bool) or not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}"
+        )
+    return chunk_size
+
+
+def _parse_rate(value: Any) -> float | None:
+    """Rows per second of a background update, None if unset, raises a 400 unless positive."""
+    if value is None:
+        return None
+    try:
+        rate = float(value)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid rate: {value!r}") from e
+    if isinstance(value, bool) or not math.isfinite(rate) or rate <= 0:
+        raise HTTPException(status_code=400, detail=f"Invalid rate: {value!r}")
+    return rate
+
+
 @app.post("/api/update-status")
 async def update_status(request: Request):
     """
     Update the status of thread updates.
 
+    Updates selected by id are changed synchronously. Updates selected by filters are changed
+    by a background job, in primary key chunks, see /api/jobs for its progress.
+
     Request body:
         {
-            "thread_ids": ["id1", "id2"],  # Optional: specific IDs when rows selected
+            "ids": [1, 2],  # Optional: specific IDs when rows selected
             "filters": [                    # Optional: filters when "select all" used
                 {"id": "thread_id", "value": "thread-1", "operator": "eq"}
             ],
-            "status": "SKIPPED"
+            "status": "SKIPPED",
+            "rate": 100,  # Optional with filters: maximum rows updated per second, > 0
+            "chunk_size": 1000  # Optional with filters: rows per transaction, 1 to 100000
         }
 
     Returns:
         {
             "updated": 10
         }
+        or, with filters, the job:
+        {
+            "id": "...",
+            "kind": "update_status",
+            "status": "running",
+            "total": null,
+            "updated": 0,
+            ...
+        }
     """
     body = await request.json()
 
@@ -291,40 +1185,178 @@ async def update_status(request: Request):
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Invalid status: {new_status}") from e
 
-    async with basehook.engine.begin() as conn:
-        # Build update statement
-        if ids:
-            # Update specific IDs
-            update_stmt = (
-                sql_update(thread_update_table)
-                .where(thread_update_table.c.id.in_(ids))
-                .values(status=status_enum)
-            )
-        else:
-            # Update based on filters
-            query = select(thread_update_table.c.id)
-            query = apply_filters_to_query(query, filters)
-
-            update_stmt = (
-                sql_update(thread_update_table)
-                .where(thread_update_table.c.id.in_(query.scalar_subquery()))
-                .values(status=status_enum)
+    if not ids:
+        # Update based on filters, in the background
+        query = apply_filters_to_query(select(thread_update_table.c.id), filters)
+        rate = _parse_rate(body.get("rate"))
+        chunk_size = _parse_chunk_size(body.get("chunk_size", 1000))
+
+        async def run(job: Job):
+            await update_in_chunks(
+                basehook.engine,
+                job,
+                query,
+                {"status": status_enum},
+                chunk_size=chunk_size,
+                rate=rate,
             )
 
+        job = job_registry.start("update_status", run, rate=rate)
+        return job.to_dict()
+
+    async with basehook.engine.begin() as conn:
+        # Update specific IDs
+        update_stmt = (
+            sql_update(thread_update_table)
+            .where(thread_update_table.c.id.in_(ids))
+            .values(status=status_enum)
+        )
         result = await conn.execute(update_stmt)
         updated_count = result.rowcount
 
         return {"updated": updated_count}
 
 
+@app.get("/api/jobs")
+async def list_jobs():
+    """List background jobs, most recent first."""
+    return {"jobs": [job.to_dict() for job in job_registry.list()]}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the progress of a background job."""
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a background job, the chunks already processed are kept."""
+    job = job_registry.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+# Seconds between keep-alive comments, so that proxies do not close idle streams
+STREAM_KEEPALIVE_IN_SECONDS = 15
+
+
+@app.get("/api/stream")
+async def stream_updates(
+    webhook: str | None = None, status: Annotated[list[str] | None, Query()] = None
+):
+    """
+    Stream new and status-changed updates as Server-Sent Events.
+
+    Every stream of the process shares a single LISTEN connection. A client that does not keep
+    up is sent a `dropped` event and disconnected, it should then resync with /api/query.
+    Unavailable (503) unless BASEHOOK_STREAM_UPDATES enables the NOTIFY trigger.
+
+    Query params:
+        webhook: Only stream updates of this webhook
+        status: Only stream updates with these statuses (repeatable), e.g. status=ERROR
+
+    Returns:
+        A text/event-stream of `update` events:
+        event: update
+        data: {"id": 1, "webhook_name": "test", "thread_id": "...", "status": "PENDING",
+               "revision_number": 1.0, "timestamp": 1234567890.0, "priority": 0,
+               "operation": "insert"}
+    """
+    if not update_notifications:
+        raise HTTPException(
+            status_code=503, detail="Update stream disabled, set BASEHOOK_STREAM_UPDATES=1"
+        )
+
+    statuses = None
+    if status:
+        try:
+            statuses = [ThreadUpdateStatus[s.upper()].name for s in status]
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid status: {e.args[0]}") from e
+
+    try:
+        subscription = await update_broadcaster.subscribe(webhook_name=webhook, statuses=statuses)
+    except asyncio.TimeoutError as e:
+        raise HTTPException(status_code=503, detail="Update stream unavailable") from e
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    update = await asyncio.wait_for(
+                        subscription.queue.get(), STREAM_KEEPALIVE_IN_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if update is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                yield f"event: update\ndata: {json.dumps(update)}\n\n"
+        finally:
+            update_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _cumulative_points(rows: list[tuple[int, str, int]]) -> list[dict]:
+    """
+    Turn (window_start, status name, count) rows ordered by window into cumulative data points.
+    """
+    cumulative = dict.fromkeys(ThreadUpdateStatus, 0)
+    data_points = []
+    current_window = None
+
+    for window, status, count in rows:
+        # If we hit a new window, push a data point with current cumulative totals
+        if current_window is not None and window != current_window:
+            data_points.append(_metrics_point(current_window, cumulative))
+        # Accumulate count for this status
+        cumulative[ThreadUpdateStatus[status]] += count
+        current_window = window
+
+    # Don't forget the last window
+    if current_window is not None:
+        data_points.append(_metrics_point(current_window, cumulative))
+
+    return data_points
+
+
+def _metrics_point(window: int, cumulative: dict[ThreadUpdateStatus, int]) -> dict:
+    return {
+        "timestamp": window,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(window)),
+        **{status.value: cumulative[status] for status in ThreadUpdateStatus},
+    }
+
+
 @app.get("/api/metrics")
-async def get_metrics(range: str = "24h"):
+async def get_metrics(
+    range: str = "24h",
+    webhook: str | None = None,
+    breakdown: bool = False,
+    max_staleness: float | None = None,
+):
     """
     Get cumulative metrics for thread updates by status over time.
-    Groups data into 10-second windows for better performance.
+    Reads the per-minute rollup maintained by a trigger on thread_update (plus the deltas not
+    folded yet), so the cost depends on the range, not on the table size.
 
     Query params:
         range: Time range to fetch (1h, 6h, 24h, 7d, 30d, all). Default: 24h
+        webhook: Only count updates of this webhook
+        breakdown: Also return one series per webhook
+        max_staleness: Seconds of replica lag tolerated
 
     Returns:
         {
@@ -338,14 +1370,15 @@ async def get_metrics(range: str = "24h"):
                     "skipped": 1
                 },
                 ...
-            ]
+            ],
+            "series": {"my-webhook": [...]}  # Only with breakdown=true
         }
     """
-    from sqlalchemy import Integer
-
     # Calculate cutoff timestamp and window size based on range
+    # Windows are multiples of the rollup granularity (1min), so 1h moved from 10s to 1min
+    # windows when the metrics were moved to the rollup
     range_config = {
-        "1h": {"seconds": 3600, "window": 10},  # 10s windows for 1h
+        "1h": {"seconds": 3600, "window": 60},  # 1min windows for 1h
         "6h": {"seconds": 6 * 3600, "window": 60},  # 1min windows for 6h
         "24h": {"seconds": 24 * 3600, "window": 300},  # 5min windows for 24h
         "7d": {"seconds": 7 * 24 * 3600, "window": 3600},  # 1h windows for 7d
@@ -354,79 +1387,130 @@ async def get_metrics(range: str = "24h"):
     }
 
     config = range_config.get(range, range_config["24h"])
-    cutoff_seconds = config["seconds"]
-    window_size = config["window"]
-    cutoff_timestamp = time.time() - cutoff_seconds if cutoff_seconds else None
+    engine = await _read_engine(max_staleness)
+    key = ("metrics", config["seconds"], config["window"], webhook)
+    cached = await response_cache.get(
+        key,
+        lambda previous: _compute_metrics_counts(
+            engine, config["seconds"], config["window"], webhook, previous
+        ),
+    )
+    counts = sorted(cached.counts.items(), key=lambda item: item[0][2])
+
+    # Merge webhooks per window, dicts keep the window order
+    totals: dict[tuple[int, str], int] = {}
+    for (_, status, window), count in counts:
+        totals[(window, status)] = totals.get((window, status), 0) + count
+    merged = [(window, status, count) for (window, status), count in totals.items()]
+    response: dict[str, Any] = {"data": _cumulative_points(merged)}
+
+    if breakdown:
+        per_webhook: dict[str, list] = {}
+        for (webhook_name, status, window), count in counts:
+            per_webhook.setdefault(webhook_name, []).append((window, status, count))
+        response["series"] = {
+            name: _cumulative_points(webhook_rows) for name, webhook_rows in per_webhook.items()
+        }
 
-    async with basehook.engine.begin() as conn:
-        # Group by dynamic windows based on time range
-        window_expr = (thread_update_table.c.timestamp / window_size).cast(Integer) * window_size
+    return response
 
-        query = select(
-            window_expr.label("window_timestamp"),
-            thread_update_table.c.status,
-            func.count().label("count"),
-        )
 
-        # Apply time range filter if not "all"
-        if cutoff_timestamp is not None:
-            query = query.where(thread_update_table.c.timestamp >= cutoff_timestamp)
+@dataclass
+class MetricsCounts:
+    counts: dict[tuple[str, str, int], int]  # (webhook_name, status, window_start) -> count
+    computed_at: float  # Last time every window was recomputed
 
-        query = query.group_by(window_expr, thread_update_table.c.status).order_by(
-            window_expr.asc(), thread_update_table.c.status.asc()
-        )
 
-        result = await conn.execute(query)
-        rows = result.all()
-
-        # Build cumulative counts
-        cumulative = {
-            ThreadUpdateStatus.PENDING: 0,
-            ThreadUpdateStatus.SUCCESS: 0,
-            ThreadUpdateStatus.ERROR: 0,
-            ThreadUpdateStatus.SKIPPED: 0,
+async def _compute_metrics_counts(
+    engine: AsyncEngine,
+    cutoff_seconds: int | None,
+    window_size: int,
+    webhook: str | None,
+    previous: MetricsCounts | None,
+) -> MetricsCounts:
+    """
+    Compute the per-window counts of a metrics range. Given the expired value of the cache, only
+    the newest windows are recomputed, older ones are refreshed every
+    METRICS_FULL_REFRESH_IN_SECONDS (updates ingested long ago can still change status).
+    """
+    now = time.time()
+    # Align the cutoff on the rollup so the first minute is not partially counted
+    cutoff = int(now - cutoff_seconds) // ROLLUP_SECONDS * ROLLUP_SECONDS if cutoff_seconds else 0
+
+    if previous is None or now - previous.computed_at > METRICS_FULL_REFRESH_IN_SECONDS:
+        counts: dict[tuple[str, str, int], int] = {}
+        start, computed_at = cutoff, now
+    else:
+        newest_window = max((window for _, _, window in previous.counts), default=cutoff)
+        start = max(cutoff, newest_window - METRICS_TAIL_WINDOWS * window_size)
+        first_window = cutoff // window_size * window_size
+        counts = {
+            key: count for key, count in previous.counts.items() if first_window <= key[2] < start
         }
-        data_points = []
-        current_window = None
-
-        for row in rows:
-            # Accumulate count for this status
-            if row.status in cumulative:
-                cumulative[row.status] += row.count
-
-            # If we hit a new window, push a data point with current cumulative totals
-            if current_window is not None and row.window_timestamp != current_window:
-                data_points.append(
-                    {
-                        "timestamp": current_window,
-                        "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(current_window)),
-                        "pending": cumulative[ThreadUpdateStatus.PENDING],
-                        "success": cumulative[ThreadUpdateStatus.SUCCESS],
-                        "error": cumulative[ThreadUpdateStatus.ERROR],
-                        "skipped": cumulative[ThreadUpdateStatus.SKIPPED],
-                    }
-                )
+        computed_at = previous.computed_at
+
+    async with engine.begin() as conn:
+        result = await conn.execute(windowed_counts(window_size, start, webhook))
+        for row in result:
+            if row.count:
+                counts[(row.webhook_name, row.status, row.window_start)] = row.count
+
+    return MetricsCounts(counts, computed_at)
+
 
-            current_window = row.window_timestamp
+@app.get("/api/queues")
+async def get_queues(rate_window: int = 300, max_staleness: float | None = None):
+    """
+    Depth, lag and throughput of every webhook queue, cheap enough to be polled every second
+    (e.g. by an autoscaler). Depth is read from the pending partial index, rates from the
+    metrics rollups.
+
+    Query params:
+        rate_window: Seconds over which the rates are averaged. Default: 300
+        max_staleness: Seconds of replica lag tolerated
 
-        # Don't forget the last window
-        if current_window is not None:
-            data_points.append(
+    Returns:
+        {
+            "queues": [
                 {
-                    "timestamp": current_window,
-                    "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(current_window)),
-                    "pending": cumulative[ThreadUpdateStatus.PENDING],
-                    "success": cumulative[ThreadUpdateStatus.SUCCESS],
-                    "error": cumulative[ThreadUpdateStatus.ERROR],
-                    "skipped": cumulative[ThreadUpdateStatus.SKIPPED],
+                    "webhook_name": "my-webhook",
+                    "depth": 12,
+                    "depth_capped": false,  // depth counted up to 10000 per priority
+                    "oldest_pending_timestamp": 1234567890.0,  // null when empty
+                    "oldest_pending_age": 4.2,  // seconds, null when empty
+                    "ingest_rate": 3.5,  // updates received per second
+                    "drain_rate": 3.1  // updates processed or skipped per second
                 }
-            )
-
-        return {"data": data_points}
+            ]
+        }
+    """
+    engine = await _read_engine(max_staleness)
+    async with engine.begin() as conn:
+        queues = await get_queue_stats(conn, rate_window_in_seconds=max(rate_window, 1))
+
+    now = time.time()
+    return {
+        "queues": [
+            {
+                "webhook_name": queue.webhook_name,
+                "depth": queue.depth,
+                "depth_capped": queue.depth_capped,
+                "oldest_pending_timestamp": queue.oldest_pending_timestamp,
+                "oldest_pending_age": (
+                    max(now - queue.oldest_pending_timestamp, 0)
+                    if queue.oldest_pending_timestamp is not None
+                    else None
+                ),
+                "ingest_rate": queue.ingest_rate,
+                "drain_rate": queue.drain_rate,
+            }
+            for queue in queues
+        ]
+    }
 
 
 @app.get("/api/webhooks")
-async def list_webhooks():
+async def list_webhooks(max_staleness: float | None = None):
     """
     Get list of all configured webhooks.
 
@@ -444,7 +1528,8 @@ async def list_webhooks():
             ]
         }
     """
-    async with basehook.engine.begin() as conn:
+    engine = await _read_engine(max_staleness)
+    async with engine.begin() as conn:
         query = select(webhook_table).order_by(webhook_table.c.name.asc())
         result = await conn.execute(query)
         webhooks = result.all()
@@ -465,6 +1550,14 @@ async def list_webhooks():
                     "hmac_encoding": w.hmac_encoding,
                     "hmac_algorithm": w.hmac_algorithm,
                     "hmac_prefix": w.hmac_prefix,
+                    "priority": w.priority,
+                    "priority_path": w.priority_path,
+                    "priority_map": w.priority_map,
+                    "retention_days": w.retention_days,
+                    "skipped_content_retention_days": w.skipped_content_retention_days,
+                    "dedup_header": w.dedup_header,
+                    "dedup_path": w.dedup_path,
+                    "max_body_bytes": w.max_body_bytes,
                     "last_error": w.last_error,
                     "last_error_timestamp": w.last_error_timestamp,
                 }
@@ -490,7 +1583,15 @@ async def create_webhook(request: Request):
             "hmac_signature_format": "{body}",
             "hmac_encoding": "hex",
             "hmac_algorithm": "sha256",
-            "hmac_prefix": "sha256="
+            "hmac_prefix": "sha256=",
+            "priority": 0,
+            "priority_path": ["event", "type"],
+            "priority_map": {"payment_failed": 10},
+            "retention_days": 30,
+            "skipped_content_retention_days": 1,
+            "dedup_header": "X-GitHub-Delivery",
+            "dedup_path": null,
+            "max_body_bytes": 1048576
         }
 
     Returns:
@@ -508,6 +1609,7 @@ async def create_webhook(request: Request):
         raise HTTPException(status_code=400, detail="thread_id_path is required")
     if not body.get("revision_number_path"):
         raise HTTPException(status_code=400, detail="revision_number_path is required")
+    _validate_priority_map(body.get("priority_map"))
 
     async with basehook.engine.begin() as conn:
         # Check if webhook already exists
@@ -534,6 +1636,14 @@ async def create_webhook(request: Request):
                 hmac_encoding=body.get("hmac_encoding"),
                 hmac_algorithm=body.get("hmac_algorithm"),
                 hmac_prefix=body.get("hmac_prefix"),
+                priority=body.get("priority", 0),
+                priority_path=body.get("priority_path"),
+                priority_map=body.get("priority_map"),
+                retention_days=body.get("retention_days"),
+                skipped_content_retention_days=body.get("skipped_content_retention_days"),
+                dedup_header=body.get("dedup_header"),
+                dedup_path=body.get("dedup_path"),
+                max_body_bytes=body.get("max_body_bytes"),
             )
         )
 
@@ -557,6 +1667,14 @@ async def create_webhook(request: Request):
             "hmac_encoding": webhook.hmac_encoding,
             "hmac_algorithm": webhook.hmac_algorithm,
             "hmac_prefix": webhook.hmac_prefix,
+            "priority": webhook.priority,
+            "priority_path": webhook.priority_path,
+            "priority_map": webhook.priority_map,
+            "retention_days": webhook.retention_days,
+            "skipped_content_retention_days": webhook.skipped_content_retention_days,
+            "dedup_header": webhook.dedup_header,
+            "dedup_path": webhook.dedup_path,
+            "max_body_bytes": webhook.max_body_bytes,
             "last_error": webhook.last_error,
             "last_error_timestamp": webhook.last_error_timestamp,
         }
@@ -599,20 +1717,125 @@ async def update_webhook(webhook_name: str, request: Request):
         )
 
 
+@app.get("/api/webhooks/{webhook_name}/content-indexes")
+async def list_content_indexes(webhook_name: str):
+    """
+    List the content paths promoted to B-tree indexes for a webhook.
+
+    Returns:
+        {
+            "indexes": [
+                {"index_name": "ix_thread_update_content_...", "path": ["customer", "id"]}
+            ]
+        }
+    """
+    async with basehook.engine.begin() as conn:
+        result = await conn.execute(
+            select(content_index_table)
+            .where(content_index_table.c.webhook_name == webhook_name)
+            .order_by(content_index_table.c.created_at.asc())
+        )
+        return {
+            "indexes": [
+                {"index_name": row.index_name, "path": row.path, "created_at": row.created_at}
+                for row in result.all()
+            ]
+        }
+
+
+@app.post("/api/webhooks/{webhook_name}/content-indexes")
+async def create_content_index(webhook_name: str, request: Request):
+    """
+    Promote a frequently searched content path to a B-tree index, so that content `eq`
+    filters on it (together with a webhook_name filter) are B-tree lookups.
+    The index is built concurrently, the request returns once it is ready.
+
+    Request body:
+        {
+            "path": ["customer", "id"]
+        }
+
+    Returns:
+        {
+            "index_name": "ix_thread_update_content_..."
+        }
+    """
+    body = await request.json()
+    path = _parse_content_path(body.get("path"))
+    return {"index_name": await basehook.index_content_path(webhook_name, path)}
+
+
+@app.delete("/api/webhooks/{webhook_name}/content-indexes/{index_name}")
+async def delete_content_index(webhook_name: str, index_name: str):
+    """Drop a promoted content path index."""
+    if not await basehook.drop_content_index(index_name):
+        raise HTTPException(status_code=404, detail=f"Index '{index_name}' not found")
+    return {"index_name": index_name}
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """Read the request body, raises a 413 as soon as it exceeds `limit` bytes."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail=f"Body larger than {limit} bytes")
+
+    # Content-Length can be absent (chunked) or wrong, the limit is enforced while streaming
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Body larger than {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
 @app.post("/webhooks/{webhook_name}")
 async def read_root(webhook_name: str, request: Request):
+    instrumentation = basehook.instrumentation
+    if instrumentation is None:
+        return await _ingest(webhook_name, request, None)
+
+    trace = IngestTrace(webhook_name, instrumentation)
+    instrumentation.ingest_started(trace)
+    try:
+        return await _ingest(webhook_name, request, trace)
+    except Exception:
+        trace.outcome = "error"
+        raise
+    finally:
+        instrumentation.ingest_finished(trace)
+
+
+@asynccontextmanager
+async def _begin_ingest(trace: IngestTrace | None):
+    """Begin the ingest transaction, timing the pool checkout."""
+    start = time.perf_counter()
     async with basehook.engine.begin() as conn:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - start, "ingest")
+        attach(trace, conn)
+        try:
+            yield conn
+        finally:
+            detach(trace, conn)
+
+
+async def _ingest(webhook_name: str, request: Request, trace: IngestTrace | None):
+    async with _begin_ingest(trace) as conn:
+        phase_start = time.perf_counter()
         result = await conn.execute(
             select(webhook_table).where(webhook_table.c.name == webhook_name)
         )
         webhook_row = result.first()
         if webhook_row is None:
             raise HTTPException(status_code=404, detail="Webhook not found")
+        # Only observed for known webhooks, to keep the label cardinality bounded
+        INGEST_SECONDS.observe(time.perf_counter() - phase_start, webhook_name, "config")
 
         # Get raw body for HMAC verification (must read before .json())
-        body = await request.body()
+        body = await _read_body(request, webhook_row.max_body_bytes or max_body_bytes)
 
         # Verify HMAC signature if enabled
+        phase_start = time.perf_counter()
         if webhook_row.hmac_enabled:
             try:
                 if not webhook_row.hmac_secret:
@@ -685,14 +1908,29 @@ async def read_root(webhook_name: str, request: Request):
                 )
                 await conn.commit()
                 raise HTTPException(status_code=500, detail=error_msg) from e
+            INGEST_SECONDS.observe(time.perf_counter() - phase_start, webhook_name, "hmac")
+
+        # A header key short-circuits known duplicates before parsing
+        dedup_key = delivery_key(webhook_row, request.headers, None)
+        if dedup_key is not None and recent_deliveries.seen(webhook_name, dedup_key):
+            emit(trace, "duplicate")
+            return {"message": "Duplicate delivery"}
 
-        content = json.loads(body)
+        with INGEST_SECONDS.time(webhook_name, "parse"):
+            content = jsoncodec.loads(body)
 
         # Handle challenge-response for Slack/Discord webhook verification
         challenge = content.get("challenge")
         if challenge:
+            emit(trace, "challenge")
             return {"challenge": challenge}
 
+        if dedup_key is None:
+            dedup_key = delivery_key(webhook_row, request.headers, content)
+            if dedup_key is not None and recent_deliveries.seen(webhook_name, dedup_key):
+                emit(trace, "duplicate")
+                return {"message": "Duplicate delivery"}
+
         # Try primary path, then fallback, then UUID
         thread_id_value = (
             _get_from_json(content, webhook_row.thread_id_path)
@@ -716,26 +1954,106 @@ async def read_root(webhook_name: str, request: Request):
             else float(revision_number)
         )
 
-        await conn.execute(
-            insert(thread_update_table).values(
-                webhook_name=webhook_name,
-                thread_id=thread_id_value,
-                revision_number=revision_number,
-                content=content,
-                timestamp=time.time(),
-                status=ThreadUpdateStatus.PENDING,
+        priority = _get_priority(content, webhook_row)
+        payload = None
+        if len(body) <= payload_offload_bytes:
+            try:
+                # Postgres parses the body as received, instead of a re-serialization of `content`
+                stored_content = cast(literal(body.decode("utf-8-sig"), Text), JSONB)
+            except UnicodeDecodeError:  # UTF-16/32 bodies, also accepted by the parser
+                stored_content = content
+        else:
+            # Keep the extracted fields inline, so that queries on them still work
+            stored_content, payload = await offload_payload(
+                body,
+                content,
+                [
+                    webhook_row.thread_id_path,
+                    webhook_row.thread_id_fallback_path,
+                    webhook_row.revision_number_path,
+                    webhook_row.revision_number_fallback_path,
+                    webhook_row.priority_path,
+                    webhook_row.dedup_path,
+                ],
             )
-        )
-        await conn.execute(
-            insert(thread_table)
-            .values(
-                webhook_name=webhook_name,
-                thread_id=thread_id_value,
+
+        insert_start = time.perf_counter()
+        with INGEST_SECONDS.time(webhook_name, "insert"):
+            if dedup_key is not None and not await record_delivery(conn, webhook_name, dedup_key):
+                recent_deliveries.add(webhook_name, dedup_key)
+                emit(trace, "duplicate")
+                return {"message": "Duplicate delivery"}
+            update_id = await conn.scalar(
+                insert(thread_update_table)
+                .values(
+                    webhook_name=webhook_name,
+                    thread_id=thread_id_value,
+                    revision_number=revision_number,
+                    content=stored_content,
+                    timestamp=time.time(),
+                    status=ThreadUpdateStatus.PENDING,
+                    priority=priority,
+                )
+                .returning(thread_update_table.c.id)
             )
-            .on_conflict_do_nothing()
+            if payload is not None:
+                await conn.execute(
+                    insert(thread_update_payload_table).values(update_id=update_id, **payload)
+                )
+            await conn.execute(
+                insert(thread_table)
+                .values(
+                    webhook_name=webhook_name,
+                    thread_id=thread_id_value,
+                )
+                .on_conflict_do_nothing()
+            )
+        commit_start = time.perf_counter()
+        emit(
+            trace,
+            "inserted",
+            thread_id=thread_id_value,
+            update_id=update_id,
+            insert_seconds=commit_start - insert_start,
         )
+    emit(trace, "committed", commit_seconds=time.perf_counter() - commit_start)
+
+    # Only remembered once committed, a failed ingest must not reject the provider's retry
+    if dedup_key is not None:
+        recent_deliveries.add(webhook_name, dedup_key)
+    # Wake up a consumer of this process waiting on the webhook, if any
+    handed_off = basehook.hand_off(webhook_name, thread_id_value, update_id)
+    emit(trace, "handoff", handed_off=handed_off)
+    return {"message": "Thread created"}
+
+
+async def _collect_pending_gauges(_previous=None) -> None:
+    """Refresh the per-webhook depth and lag gauges."""
+    async with basehook.engine.begin() as conn:
+        queues = await get_queue_stats(conn)
+
+    now = time.time()
+    PENDING_UPDATES.clear()
+    OLDEST_PENDING_AGE_SECONDS.clear()
+    for queue in queues:
+        PENDING_UPDATES.set(queue.depth, queue.webhook_name)
+        age = now - queue.oldest_pending_timestamp if queue.oldest_pending_timestamp else 0
+        OLDEST_PENDING_AGE_SECONDS.set(max(age, 0), queue.webhook_name)
+
+
+@app.get("/metrics")
+async def get_openmetrics(request: Request):
+    """
+    Expose ingest/pop latencies, pending depth and lag in the OpenMetrics text format.
+    Browsers navigating to the dashboard's /metrics page get the frontend instead.
+    """
+    index_path = os.path.join(static_path, "index.html")
+    if "text/html" in request.headers.get("accept", "") and os.path.exists(index_path):
+        return FileResponse(index_path)
 
-        return {"message": "Thread created"}
+    # Several scrapers share one database round trip per TTL
+    await response_cache.get("pending_gauges", _collect_pending_gauges)
+    return Response(render_openmetrics(), media_type=OPENMETRICS_CONTENT_TYPE)
 
 
 # Serve index.html for all non-API routes (SPA routing support)
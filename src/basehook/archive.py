@@ -0,0 +1,343 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+from typing import Any, TextIO
+from urllib.parse import quote
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.compression import DEFAULT_ENCODING, compress, open_decompressed
+from basehook.models import (
+    ThreadUpdateStatus,
+    archive_segment_table,
+    thread_table,
+    thread_update_table,
+    webhook_table,
+)
+from basehook.payloads import load_payloads
+
+# Arbitrary key for pg_try_advisory_lock, only one node archives at a time
+ARCHIVE_LOCK_ID = 0x6261736568000002
+
+_EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
+# Uncompressed size a segment is cut at, reading a segment newest first decodes it whole
+MAX_SEGMENT_BYTES = 8 * 1024 * 1024
+
+# Rows decoded per thread hop when streaming a segment oldest first
+READ_CHUNK_ROWS = 500
+
+
+@dataclass
+class ArchiveReport:
+    """Summary of an archive run."""
+
+    segments_written: int = 0
+    rows_archived: int = 0
+    bytes_written: int = 0
+
+
+def _serialize(row: Any) -> dict[str, Any]:
+    return {
+        "id": row.id,
+        "webhook_name": row.webhook_name,
+        "thread_id": row.thread_id,
+        "revision_number": row.revision_number,
+        "content": row.content,
+        "timestamp": row.timestamp,
+        "status": row.status.value,
+        "traceback": row.traceback,
+        "priority": row.priority,
+    }
+
+
+def _write_segment(path: str, lines: list[bytes], encoding: str) -> int:
+    """Write NDJSON lines compressed, atomically. Returns the file size."""
+    data = compress(b"".join(lines), encoding)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def _read_rows(stream: TextIO, count: int) -> list[dict[str, Any]]:
+    """Decode up to `count` rows from a segment stream, an empty list once exhausted."""
+    rows = []
+    while len(rows) < count:
+        line = stream.readline()
+        if not line:
+            break
+        if line.strip():
+            rows.append(json.loads(line))
+    return rows
+
+
+async def _stream_segment(
+    path: str, encoding: str, *, newest_first: bool
+) -> AsyncGenerator[dict[str, Any], None]:
+    """
+    Iterate over the rows of a segment, decompressing a chunk of rows at a time. Newest first,
+    the segment is decoded whole to be reversed, `MAX_SEGMENT_BYTES` keeps it bounded.
+    """
+    stream = await asyncio.to_thread(open_decompressed, path, encoding)
+    try:
+        if newest_first:
+            rows = await asyncio.to_thread(_read_rows, stream, sys.maxsize)
+            for row in reversed(rows):
+                yield row
+            return
+        while rows := await asyncio.to_thread(_read_rows, stream, READ_CHUNK_ROWS):
+            for row in rows:
+                yield row
+    finally:
+        stream.close()
+
+
+async def archive_updates(
+    engine: AsyncEngine,
+    directory: str,
+    *,
+    older_than_in_seconds: float,
+    batch_size: int = 1000,
+    max_segment_bytes: int = MAX_SEGMENT_BYTES,
+) -> ArchiveReport | None:
+    """
+    Move SUCCESS and SKIPPED updates older than the threshold out of Postgres into compressed
+    NDJSON segment files, one directory per webhook.
+
+    Each batch is locked, written and fsynced to disk, indexed in `archive_segment` and deleted
+    in a single transaction, so a row is either in the table or in an indexed segment.
+    Only one node archives at a time, guarded by an advisory lock.
+
+    Args:
+        batch_size: maximum number of rows per segment.
+        max_segment_bytes: uncompressed size a segment is cut at, the rows left over are
+            archived in the next segment. A segment holds at least one row.
+
+    Returns:
+        The segments and rows written, or None if another node is already archiving.
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = await lock_conn.scalar(select(func.pg_try_advisory_lock(ARCHIVE_LOCK_ID)))
+        if not locked:
+            return None
+
+        try:
+            report = ArchiveReport()
+            async with engine.begin() as conn:
+                webhook_names = (await conn.execute(select(webhook_table.c.name))).scalars().all()
+
+            cutoff = time.time() - older_than_in_seconds
+            for webhook_name in webhook_names:
+                while True:
+                    async with engine.begin() as conn:
+                        rows = (
+                            await conn.execute(
+                                select(thread_update_table)
+                                .where(
+                                    thread_update_table.c.webhook_name == webhook_name,
+                                    thread_update_table.c.status.in_(
+                                        [ThreadUpdateStatus.SUCCESS, ThreadUpdateStatus.SKIPPED]
+                                    ),
+                                    thread_update_table.c.timestamp < cutoff,
+                                )
+                                .order_by(thread_update_table.c.id.asc())
+                                .limit(batch_size)
+                                .with_for_update(skip_locked=True)
+                            )
+                        ).all()
+                        if not rows:
+                            break
+
+                        # Segments hold the full payloads, the out-of-line rows are orphaned
+                        serialized = [_serialize(row) for row in rows]
+                        contents = await load_payloads(
+                            conn, {row["id"]: row["content"] for row in serialized}
+                        )
+                        lines = []
+                        segment_bytes = 0
+                        for serialized_row in serialized:
+                            serialized_row["content"] = contents[serialized_row["id"]]
+                            line = (json.dumps(serialized_row) + "\n").encode("utf-8")
+                            if lines and segment_bytes + len(line) > max_segment_bytes:
+                                break
+                            lines.append(line)
+                            segment_bytes += len(line)
+                        # The rows left over are unlocked on commit, the next batch picks them up
+                        rows = rows[: len(lines)]
+
+                        encoding = DEFAULT_ENCODING
+                        relative_path = os.path.join(
+                            quote(webhook_name, safe=""),
+                            f"{rows[0].id}-{rows[-1].id}.ndjson.{_EXTENSIONS[encoding]}",
+                        )
+                        report.bytes_written += await asyncio.to_thread(
+                            _write_segment,
+                            os.path.join(directory, relative_path),
+                            lines,
+                            encoding,
+                        )
+
+                        await conn.execute(
+                            archive_segment_table.insert().values(
+                                webhook_name=webhook_name,
+                                path=relative_path,
+                                encoding=encoding,
+                                row_count=len(rows),
+                                min_id=rows[0].id,
+                                max_id=rows[-1].id,
+                                min_timestamp=min(row.timestamp for row in rows),
+                                max_timestamp=max(row.timestamp for row in rows),
+                                thread_ids=sorted({row.thread_id for row in rows}),
+                                created_at=time.time(),
+                            )
+                        )
+                        await conn.execute(
+                            delete(thread_update_table).where(
+                                thread_update_table.c.id.in_([row.id for row in rows])
+                            )
+                        )
+
+                    report.segments_written += 1
+                    report.rows_archived += len(rows)
+
+            return report
+        finally:
+            await lock_conn.execute(select(func.pg_advisory_unlock(ARCHIVE_LOCK_ID)))
+
+
+async def read_archive(
+    engine: AsyncEngine,
+    directory: str,
+    *,
+    webhook_name: str | None = None,
+    thread_id: str | None = None,
+    start: float | None = None,
+    end: float | None = None,
+    ids: list[int] | None = None,
+    newest_first: bool = False,
+    skip: int = 0,
+) -> AsyncGenerator[dict[str, Any], None]:
+    """
+    Read archived updates back. Segments are narrowed down through the `archive_segment`
+    index (webhook, thread, time and id ranges), then rows are filtered once decompressed.
+
+    Args:
+        skip: number of matching rows to leave out, e.g. the previous pages. Segments matching
+            as a whole (no thread or id filter, time range covering the segment) are skipped
+            by their row count, without being read.
+    """
+    query = select(archive_segment_table)
+    if webhook_name is not None:
+        query = query.where(archive_segment_table.c.webhook_name == webhook_name)
+    if thread_id is not None:
+        query = query.where(archive_segment_table.c.thread_ids.contains([thread_id]))
+    if start is not None:
+        query = query.where(archive_segment_table.c.max_timestamp >= start)
+    if end is not None:
+        query = query.where(archive_segment_table.c.min_timestamp <= end)
+    if ids:
+        query = query.where(
+            archive_segment_table.c.min_id <= max(ids),
+            archive_segment_table.c.max_id >= min(ids),
+        )
+    query = query.order_by(
+        archive_segment_table.c.max_id.desc()
+        if newest_first
+        else archive_segment_table.c.min_id.asc()
+    )
+
+    async with engine.begin() as conn:
+        segments = (await conn.execute(query)).all()
+
+    wanted_ids = set(ids) if ids else None
+    for segment in segments:
+        whole = (
+            thread_id is None
+            and wanted_ids is None
+            and (start is None or segment.min_timestamp >= start)
+            and (end is None or segment.max_timestamp <= end)
+        )
+        if whole and segment.row_count <= skip:
+            skip -= segment.row_count
+            continue
+
+        async for row in _stream_segment(
+            os.path.join(directory, segment.path), segment.encoding, newest_first=newest_first
+        ):
+            if webhook_name is not None and row["webhook_name"] != webhook_name:
+                continue
+            if thread_id is not None and row["thread_id"] != thread_id:
+                continue
+            if start is not None and row["timestamp"] < start:
+                continue
+            if end is not None and row["timestamp"] > end:
+                continue
+            if wanted_ids is not None and row["id"] not in wanted_ids:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield row
+
+
+async def replay_archived(engine: AsyncEngine, directory: str, ids: list[int]) -> int:
+    """
+    Re-inject archived updates as new PENDING updates. Returns the number of updates replayed.
+
+    Archived updates were processed already, so the last processed revision of their threads
+    is at or above the replayed revisions, and a `pop(only_last_revision=True)` would skip
+    them. It is reset for the replayed threads, the replayed revisions are delivered again.
+    """
+    rows = [row async for row in read_archive(engine, directory, ids=ids)]
+    if not rows:
+        return 0
+
+    now = time.time()
+    async with engine.begin() as conn:
+        await conn.execute(
+            thread_update_table.insert(),
+            [
+                {
+                    "webhook_name": row["webhook_name"],
+                    "thread_id": row["thread_id"],
+                    "revision_number": row["revision_number"],
+                    "content": row["content"],
+                    "timestamp": now,
+                    "status": ThreadUpdateStatus.PENDING,
+                    "priority": row.get("priority", 0),
+                }
+                for row in rows
+            ],
+        )
+        await conn.execute(
+            insert(thread_table)
+            .values(
+                [
+                    {"webhook_name": row["webhook_name"], "thread_id": row["thread_id"]}
+                    for row in rows
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+        await conn.execute(
+            update(thread_table)
+            .where(
+                tuple_(thread_table.c.webhook_name, thread_table.c.thread_id).in_(
+                    list({(row["webhook_name"], row["thread_id"]) for row in rows})
+                )
+            )
+            .values(last_revision_number=None)
+        )
+    return len(rows)
@@ -0,0 +1,11 @@
+"""
+Storage backends of thread updates: Postgres (shared by every node, used by the API), in memory
+(process-local, fastest) and SQLite (a single file, for edge and single box deployments).
+"""
+
+from basehook.backends.base import StorageBackend, StoredUpdate
+from basehook.backends.memory import MemoryBackend
+from basehook.backends.postgres import PostgresBackend
+from basehook.backends.sqlite import SQLiteBackend
+
+__all__ = ["MemoryBackend", "PostgresBackend", "SQLiteBackend", "StorageBackend", "StoredUpdate"]
@@ -0,0 +1,76 @@
+from abc import ABC, abstractmethod
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass
+from typing import Any
+
+from basehook.models import ThreadUpdateStatus
+
+
+@dataclass
+class StoredUpdate:
+    """A thread update, as returned by `StorageBackend.query`."""
+
+    id: int
+    webhook_name: str
+    thread_id: str
+    revision_number: float
+    content: Any
+    timestamp: float
+    status: ThreadUpdateStatus
+    priority: int = 0
+    traceback: str | None = None
+
+
+class StorageBackend(ABC):
+    """
+    Storage of thread updates: ingest, claim and complete (`pop`), query and metrics.
+
+    Every backend follows the semantics of `Basehook.pop`:
+    - updates are claimed by highest priority, then oldest first
+    - a thread is processed by one consumer at a time, the others claim other threads
+    - `only_last_revision=False` yields the lowest pending revision of the thread
+    - `only_last_revision=True` yields the highest pending revision newer than the last one
+      processed, the older pending revisions are marked SKIPPED
+    - the update is marked SUCCESS when the pop block exits, or ERROR (with the traceback) if
+      it raises
+    """
+
+    async def setup(self) -> None:  # noqa: B027 - optional hook, most backends need none
+        """Create the storage, if needed."""
+
+    async def close(self) -> None:  # noqa: B027 - optional hook, most backends need none
+        """Release connections and files."""
+
+    @abstractmethod
+    async def ingest(
+        self,
+        webhook_name: str,
+        thread_id: str,
+        revision_number: float,
+        content: Any,
+        *,
+        priority: int = 0,
+        timestamp: float | None = None,
+    ) -> int:
+        """Store a PENDING update, returns its id."""
+
+    @abstractmethod
+    def pop(
+        self, webhook_name: str, *, only_last_revision: bool = True
+    ) -> AbstractAsyncContextManager[Any]:
+        """Claim one update of the webhook and yield its content, or None if there is no work."""
+
+    @abstractmethod
+    async def query(
+        self,
+        *,
+        webhook_name: str | None = None,
+        thread_id: str | None = None,
+        status: ThreadUpdateStatus | None = None,
+        limit: int = 100,
+    ) -> list[StoredUpdate]:
+        """Updates matching the filters, newest first."""
+
+    @abstractmethod
+    async def counts(self, webhook_name: str | None = None) -> dict[ThreadUpdateStatus, int]:
+        """Number of updates per status, statuses without updates included."""
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import time
+import traceback
+from collections import defaultdict, deque
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from basehook.backends.base import StorageBackend, StoredUpdate
+from basehook.models import ThreadUpdateStatus
+
+_FINISHED = (ThreadUpdateStatus.SUCCESS, ThreadUpdateStatus.SKIPPED)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Process-local backend, for tests and throughput-bound single process deployments.
+    Nothing is persisted.
+
+    Each webhook has a heap of its pending updates ordered like the Postgres claim index
+    (priority descending, then timestamp), so a claim is O(log n). Heap entries of processed
+    updates are discarded lazily when they reach the top.
+
+    Only the last `max_finished` SUCCESS and SKIPPED updates are kept for `query`, older ones
+    are evicted (and leave `counts`), like a retention policy. Pending and ERROR updates are
+    kept. Status counts are maintained on every transition, `counts` does not scan.
+    """
+
+    def __init__(self, *, max_finished: int = 10000):
+        self.max_finished = max_finished
+        self._updates: dict[int, StoredUpdate] = {}
+        # Ids of the SUCCESS and SKIPPED updates, oldest first, evicted past max_finished
+        self._finished: deque[int] = deque()
+        self._counts: dict[str, dict[ThreadUpdateStatus, int]] = defaultdict(
+            lambda: dict.fromkeys(ThreadUpdateStatus, 0)
+        )
+        self._ids = itertools.count(1)
+        # (-priority, timestamp, id) of the pending updates, per webhook
+        self._ready: dict[str, list[tuple[int, float, int]]] = defaultdict(list)
+        # Ids of the pending updates, per (webhook, thread)
+        self._pending: dict[tuple[str, str], set[int]] = defaultdict(set)
+        self._last_revisions: dict[tuple[str, str], float] = {}
+        self._locked: set[tuple[str, str]] = set()
+
+    async def ingest(
+        self,
+        webhook_name: str,
+        thread_id: str,
+        revision_number: float,
+        content: Any,
+        *,
+        priority: int = 0,
+        timestamp: float | None = None,
+    ) -> int:
+        update = StoredUpdate(
+            id=next(self._ids),
+            webhook_name=webhook_name,
+            thread_id=thread_id,
+            revision_number=float(revision_number),
+            content=content,
+            timestamp=time.time() if timestamp is None else timestamp,
+            status=ThreadUpdateStatus.PENDING,
+            priority=priority,
+        )
+        self._updates[update.id] = update
+        self._counts[webhook_name][ThreadUpdateStatus.PENDING] += 1
+        heapq.heappush(self._ready[webhook_name], (-priority, update.timestamp, update.id))
+        self._pending[(webhook_name, thread_id)].add(update.id)
+        return update.id
+
+    def _finish(
+        self, key: tuple[str, str], update: StoredUpdate, status: ThreadUpdateStatus
+    ) -> None:
+        """Move a pending update to its final status, evicting the oldest finished ones."""
+        counts = self._counts[update.webhook_name]
+        counts[update.status] -= 1
+        counts[status] += 1
+        update.status = status
+
+        pending = self._pending[key]
+        pending.discard(update.id)
+        if not pending:
+            del self._pending[key]
+
+        if status in _FINISHED:
+            self._finished.append(update.id)
+            while len(self._finished) > self.max_finished:
+                evicted = self._updates.pop(self._finished.popleft())
+                self._counts[evicted.webhook_name][evicted.status] -= 1
+
+    def _skip(self, key: tuple[str, str], update: StoredUpdate) -> None:
+        self._finish(key, update, ThreadUpdateStatus.SKIPPED)
+
+    def _claim(self, webhook_name: str, only_last_revision: bool) -> StoredUpdate | None:
+        heap = self._ready[webhook_name]
+        # Entries of locked threads, pushed back once the claim is done
+        locked_entries = []
+        try:
+            while heap:
+                # Evicted once skipped, before its heap entry reached the top
+                update = self._updates.get(heap[0][2])
+                if update is None or update.status is not ThreadUpdateStatus.PENDING:
+                    heapq.heappop(heap)
+                    continue
+                key = (webhook_name, update.thread_id)
+                if key in self._locked:
+                    locked_entries.append(heapq.heappop(heap))
+                    continue
+
+                pending = sorted(
+                    (self._updates[update_id] for update_id in self._pending.get(key, ())),
+                    key=lambda u: (u.revision_number, u.id),
+                )
+                if not only_last_revision:
+                    claimed = pending[0]
+                else:
+                    last_revision = self._last_revisions.get(key)
+                    claimed = pending[-1]
+                    if last_revision is not None and claimed.revision_number <= last_revision:
+                        claimed = None
+                    threshold = claimed.revision_number if claimed else last_revision
+                    for older in pending:
+                        if older is not claimed and older.revision_number <= threshold:
+                            self._skip(key, older)
+                    if claimed is None:
+                        continue
+
+                self._locked.add(key)
+                return claimed
+            return None
+        finally:
+            for entry in locked_entries:
+                heapq.heappush(heap, entry)
+
+    @asynccontextmanager
+    async def pop(
+        self, webhook_name: str, *, only_last_revision: bool = True
+    ) -> AsyncGenerator[Any, None]:
+        update = self._claim(webhook_name, only_last_revision)
+        if update is None:
+            yield None
+            return
+
+        key = (webhook_name, update.thread_id)
+        status = ThreadUpdateStatus.SUCCESS
+        error_traceback = None
+        try:
+            yield update.content
+        except Exception:
+            status = ThreadUpdateStatus.ERROR
+            error_traceback = traceback.format_exc()
+            raise
+        else:
+            if only_last_revision:
+                self._last_revisions[key] = update.revision_number
+        finally:
+            update.traceback = error_traceback
+            self._finish(key, update, status)
+            self._locked.discard(key)
+
+    async def query(
+        self,
+        *,
+        webhook_name: str | None = None,
+        thread_id: str | None = None,
+        status: ThreadUpdateStatus | None = None,
+        limit: int = 100,
+    ) -> list[StoredUpdate]:
+        matches = (
+            update
+            for update in reversed(self._updates.values())
+            if (webhook_name is None or update.webhook_name == webhook_name)
+            and (thread_id is None or update.thread_id == thread_id)
+            and (status is None or update.status is status)
+        )
+        return list(itertools.islice(matches, limit))
+
+    async def counts(self, webhook_name: str | None = None) -> dict[ThreadUpdateStatus, int]:
+        if webhook_name is not None:
+            return dict(self._counts.get(webhook_name) or dict.fromkeys(ThreadUpdateStatus, 0))
+        counts = dict.fromkeys(ThreadUpdateStatus, 0)
+        for webhook_counts in self._counts.values():
+            for status, count in webhook_counts.items():
+                counts[status] += count
+        return counts
@@ -0,0 +1,111 @@
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Any
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from basehook.backends.base import StorageBackend, StoredUpdate
+from basehook.core import Basehook
+from basehook.models import ThreadUpdateStatus, thread_table, thread_update_table
+
+
+class PostgresBackend(StorageBackend):
+    """
+    The Postgres storage used by the API, behind the backend interface. `pop` is `Basehook.pop`,
+    so every consumer of the database, whatever its node, shares the same queue.
+    """
+
+    def __init__(self, basehook: Basehook | None = None):
+        self.basehook = basehook if basehook is not None else Basehook()
+
+    async def setup(self) -> None:
+        await self.basehook.migrate()
+
+    async def close(self) -> None:
+        await self.basehook.engine.dispose()
+
+    async def ingest(
+        self,
+        webhook_name: str,
+        thread_id: str,
+        revision_number: float,
+        content: Any,
+        *,
+        priority: int = 0,
+        timestamp: float | None = None,
+    ) -> int:
+        async with self.basehook.engine.begin() as conn:
+            update_id = await conn.scalar(
+                insert(thread_update_table)
+                .values(
+                    webhook_name=webhook_name,
+                    thread_id=thread_id,
+                    revision_number=float(revision_number),
+                    content=content,
+                    timestamp=time.time() if timestamp is None else timestamp,
+                    status=ThreadUpdateStatus.PENDING,
+                    priority=priority,
+                )
+                .returning(thread_update_table.c.id)
+            )
+            await conn.execute(
+                insert(thread_table)
+                .values(webhook_name=webhook_name, thread_id=thread_id)
+                .on_conflict_do_nothing()
+            )
+        return update_id
+
+    @asynccontextmanager
+    async def pop(
+        self, webhook_name: str, *, only_last_revision: bool = True
+    ) -> AsyncGenerator[Any, None]:
+        async with self.basehook.pop(webhook_name, only_last_revision=only_last_revision) as update:
+            yield update
+
+    async def query(
+        self,
+        *,
+        webhook_name: str | None = None,
+        thread_id: str | None = None,
+        status: ThreadUpdateStatus | None = None,
+        limit: int = 100,
+    ) -> list[StoredUpdate]:
+        query = select(thread_update_table).order_by(thread_update_table.c.id.desc()).limit(limit)
+        if webhook_name is not None:
+            query = query.where(thread_update_table.c.webhook_name == webhook_name)
+        if thread_id is not None:
+            query = query.where(thread_update_table.c.thread_id == thread_id)
+        if status is not None:
+            query = query.where(thread_update_table.c.status == status)
+
+        async with self.basehook.engine.begin() as conn:
+            rows = (await conn.execute(query)).all()
+        return [
+            StoredUpdate(
+                id=row.id,
+                webhook_name=row.webhook_name,
+                thread_id=row.thread_id,
+                revision_number=row.revision_number,
+                content=row.content,
+                timestamp=row.timestamp,
+                status=row.status,
+                priority=row.priority,
+                traceback=row.traceback,
+            )
+            for row in rows
+        ]
+
+    async def counts(self, webhook_name: str | None = None) -> dict[ThreadUpdateStatus, int]:
+        query = select(thread_update_table.c.status, func.count()).group_by(
+            thread_update_table.c.status
+        )
+        if webhook_name is not None:
+            query = query.where(thread_update_table.c.webhook_name == webhook_name)
+
+        counts = dict.fromkeys(ThreadUpdateStatus, 0)
+        async with self.basehook.engine.begin() as conn:
+            for status, count in await conn.execute(query):
+                counts[status] = count
+        return counts
@@ -0,0 +1,284 @@
+import asyncio
+import sqlite3
+import time
+import traceback
+from collections.abc import AsyncGenerator, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+
+from basehook import jsoncodec
+from basehook.backends.base import StorageBackend, StoredUpdate
+from basehook.models import ThreadUpdateStatus
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thread_update (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_name TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    revision_number REAL NOT NULL,
+    content TEXT,
+    timestamp REAL NOT NULL,
+    status TEXT NOT NULL,
+    traceback TEXT,
+    priority INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_thread_update_claim_pending
+    ON thread_update (webhook_name, priority DESC, timestamp) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS ix_thread_update_thread_pending
+    ON thread_update (webhook_name, thread_id, revision_number) WHERE status = 'PENDING';
+CREATE TABLE IF NOT EXISTS thread (
+    webhook_name TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    last_revision_number REAL,
+    PRIMARY KEY (webhook_name, thread_id)
+);
+"""
+
+_COLUMNS = (
+    "id, webhook_name, thread_id, revision_number, content, timestamp, status, traceback, priority"
+)
+
+
+def _to_update(row: tuple) -> StoredUpdate:
+    return StoredUpdate(
+        id=row[0],
+        webhook_name=row[1],
+        thread_id=row[2],
+        revision_number=row[3],
+        content=jsoncodec.loads(row[4]) if row[4] is not None else None,
+        timestamp=row[5],
+        status=ThreadUpdateStatus[row[6]],
+        traceback=row[7],
+        priority=row[8],
+    )
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Single file backend for edge and single box deployments, using the standard library sqlite3
+    module in WAL mode.
+
+    Statements run one at a time in a worker thread, off the event loop. Claimed threads are
+    locked in memory (SQLite has no row locks), so a database file must be used by a single
+    process. An update claimed when the process dies stays PENDING and is processed again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._locked: set[tuple[str, str]] = set()
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        async with self._lock:
+            if self._connection is None:
+                await asyncio.to_thread(self._connect)
+            return await asyncio.to_thread(function, self._connection, *args)
+
+    def _connect(self) -> None:
+        # Transactions are explicit (isolation_level=None), see _transaction
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Durable at each checkpoint rather than each commit, the usual setting with WAL
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        self._connection = connection
+
+    @staticmethod
+    def _transaction(connection: sqlite3.Connection, function: Callable[[], Any]) -> Any:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = function()
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    async def setup(self) -> None:
+        await self._run(lambda connection: None)
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._connection is not None:
+                await asyncio.to_thread(self._connection.close)
+                self._connection = None
+
+    async def ingest(
+        self,
+        webhook_name: str,
+        thread_id: str,
+        revision_number: float,
+        content: Any,
+        *,
+        priority: int = 0,
+        timestamp: float | None = None,
+    ) -> int:
+        values = (
+            webhook_name,
+            thread_id,
+            float(revision_number),
+            jsoncodec.dumps(content),
+            time.time() if timestamp is None else timestamp,
+            ThreadUpdateStatus.PENDING.name,
+            priority,
+        )
+
+        def insert(connection: sqlite3.Connection) -> int:
+            return connection.execute(
+                "INSERT INTO thread_update"
+                " (webhook_name, thread_id, revision_number, content, timestamp, status, priority)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                values,
+            ).lastrowid
+
+        return await self._run(insert)
+
+    def _claim(
+        self, connection: sqlite3.Connection, webhook_name: str, only_last_revision: bool
+    ) -> StoredUpdate | None:
+        locked = [thread_id for name, thread_id in self._locked if name == webhook_name]
+        while True:
+            row = connection.execute(
+                "SELECT thread_id FROM thread_update"
+                " WHERE webhook_name = ? AND status = 'PENDING'"
+                f" AND thread_id NOT IN ({', '.join('?' * len(locked))})"
+                " ORDER BY priority DESC, timestamp LIMIT 1",
+                (webhook_name, *locked),
+            ).fetchone()
+            if row is None:
+                return None
+            thread_id = row[0]
+
+            pending = " FROM thread_update WHERE webhook_name = ? AND thread_id = ?"
+            pending += " AND status = 'PENDING'"
+            if not only_last_revision:
+                row = connection.execute(
+                    f"SELECT {_COLUMNS}{pending} ORDER BY revision_number, id LIMIT 1",
+                    (webhook_name, thread_id),
+                ).fetchone()
+                return _to_update(row)
+
+            last_revision = connection.execute(
+                "SELECT last_revision_number FROM thread WHERE webhook_name = ? AND thread_id = ?",
+                (webhook_name, thread_id),
+            ).fetchone()
+            last_revision = last_revision[0] if last_revision is not None else None
+            row = connection.execute(
+                f"SELECT {_COLUMNS}{pending} AND (? IS NULL OR revision_number > ?)"
+                " ORDER BY revision_number DESC, id DESC LIMIT 1",
+                (webhook_name, thread_id, last_revision, last_revision),
+            ).fetchone()
+            claimed = _to_update(row) if row is not None else None
+            threshold = claimed.revision_number if claimed is not None else last_revision
+            connection.execute(
+                f"UPDATE thread_update SET status = 'SKIPPED' WHERE id IN (SELECT id{pending}"
+                " AND revision_number <= ? AND id != ?)",
+                (webhook_name, thread_id, threshold, claimed.id if claimed is not None else 0),
+            )
+            if claimed is not None:
+                return claimed
+
+    def _complete(
+        self,
+        connection: sqlite3.Connection,
+        update: StoredUpdate,
+        status: ThreadUpdateStatus,
+        error_traceback: str | None,
+        last_revision: float | None,
+    ) -> None:
+        connection.execute(
+            "UPDATE thread_update SET status = ?, traceback = ? WHERE id = ?",
+            (status.name, error_traceback, update.id),
+        )
+        if last_revision is not None:
+            connection.execute(
+                "INSERT INTO thread (webhook_name, thread_id, last_revision_number)"
+                " VALUES (?, ?, ?) ON CONFLICT (webhook_name, thread_id)"
+                " DO UPDATE SET last_revision_number = excluded.last_revision_number",
+                (update.webhook_name, update.thread_id, last_revision),
+            )
+
+    @asynccontextmanager
+    async def pop(
+        self, webhook_name: str, *, only_last_revision: bool = True
+    ) -> AsyncGenerator[Any, None]:
+        update = await self._run(
+            lambda connection: self._transaction(
+                connection, lambda: self._claim(connection, webhook_name, only_last_revision)
+            )
+        )
+        if update is None:
+            yield None
+            return
+
+        # Nothing is awaited between the claim and the lock, the next claim skips this thread
+        key = (webhook_name, update.thread_id)
+        self._locked.add(key)
+        status = ThreadUpdateStatus.SUCCESS
+        error_traceback = None
+        last_revision = None
+        try:
+            yield update.content
+        except Exception:
+            status = ThreadUpdateStatus.ERROR
+            error_traceback = traceback.format_exc()
+            raise
+        else:
+            if only_last_revision:
+                last_revision = update.revision_number
+        finally:
+            try:
+                await self._run(
+                    lambda connection: self._transaction(
+                        connection,
+                        lambda: self._complete(
+                            connection, update, status, error_traceback, last_revision
+                        ),
+                    )
+                )
+            finally:
+                self._locked.discard(key)
+
+    async def query(
+        self,
+        *,
+        webhook_name: str | None = None,
+        thread_id: str | None = None,
+        status: ThreadUpdateStatus | None = None,
+        limit: int = 100,
+    ) -> list[StoredUpdate]:
+        conditions, parameters = [], []
+        for column, value in [
+            ("webhook_name", webhook_name),
+            ("thread_id", thread_id),
+            ("status", status.name if status is not None else None),
+        ]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        def select(connection: sqlite3.Connection) -> list[tuple]:
+            return connection.execute(
+                f"SELECT {_COLUMNS} FROM thread_update{where} ORDER BY id DESC LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+
+        return [_to_update(row) for row in await self._run(select)]
+
+    async def counts(self, webhook_name: str | None = None) -> dict[ThreadUpdateStatus, int]:
+        def select(connection: sqlite3.Connection) -> list[tuple]:
+            if webhook_name is None:
+                return connection.execute(
+                    "SELECT status, count(*) FROM thread_update GROUP BY status"
+                ).fetchall()
+            return connection.execute(
+                "SELECT status, count(*) FROM thread_update WHERE webhook_name = ? GROUP BY status",
+                (webhook_name,),
+            ).fetchall()
+
+        counts = dict.fromkeys(ThreadUpdateStatus, 0)
+        for status, count in await self._run(select):
+            counts[ThreadUpdateStatus[status]] = count
+        return counts
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: float
+
+
+class AsyncTTLCache:
+    """
+    In-process cache for expensive read endpoints.
+
+    - Entries expire after `ttl_in_seconds`, the stale value is handed to the refresh function so
+      that it can only recompute what changed (e.g. the newest windows of a metric series).
+    - Concurrent misses on the same key share a single computation (single-flight).
+    - At most `max_entries` are kept, least recently used first out.
+    """
+
+    def __init__(self, *, ttl_in_seconds: float = 5.0, max_entries: int = 256):
+        self.ttl_in_seconds = ttl_in_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable, compute: Callable[[Any | None], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for `key`, computing it on a miss or after expiration.
+
+        Args:
+            key: Cache key
+            compute: Called with the previous (stale) value or None, returns the new value
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry.value
+
+        # Another request is already computing this key, wait for its result
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The computing request was cancelled (client gone), take over if we were not
+                if not inflight.cancelled():
+                    raise
+                return await self.get(key, compute)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute(entry.value if entry is not None else None)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        future.set_result(value)
+        self._set(key, value)
+        return value
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = CacheEntry(value, time.monotonic() + self.ttl_in_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
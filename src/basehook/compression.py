@@ -0,0 +1,45 @@
+import gzip
+import io
+from typing import TextIO
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, install basehook[zstd]
+    zstandard = None
+
+# Encoding used for new data, data is always decoded with the encoding it was written with
+DEFAULT_ENCODING = "zstd" if zstandard is not None else "gzip"
+
+
+def compress(data: bytes, encoding: str = DEFAULT_ENCODING) -> bytes:
+    """Compress data with "zstd" (requires zstandard) or "gzip"."""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd encoding requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """Decompress data written by `compress`."""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd encoding requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def open_decompressed(path: str, encoding: str) -> TextIO:
+    """Open a file of UTF-8 text written with `compress` for streaming, line by line reads."""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd encoding requires the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    if encoding == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    raise ValueError(f"Unknown encoding: {encoding}")
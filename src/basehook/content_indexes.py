@@ -0,0 +1,98 @@
+import hashlib
+import json
+import time
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.models import content_index_table, thread_update_table
+from basehook.partitions import is_partitioned
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _text_array_literal(path: list[str]) -> str:
+    elements = ('"' + key.replace("\\", "\\\\").replace('"', '\\"') + '"' for key in path)
+    return _sql_literal("{" + ",".join(elements) + "}") + "::text[]"
+
+
+def content_index_name(webhook_name: str, path: list[str]) -> str:
+    digest = hashlib.sha1(json.dumps([webhook_name, path]).encode("utf-8")).hexdigest()
+    return f"ix_{thread_update_table.name}_content_{digest[:16]}"
+
+
+async def create_content_index(engine: AsyncEngine, webhook_name: str, path: list[str]) -> str:
+    """
+    Promote a content path of a webhook to a B-tree index on `content #>> path`, partial on the
+    webhook. Equality filters on that path (with a webhook filter) then become B-tree lookups.
+
+    An expression index is used rather than a generated column: it gives the same lookups
+    without rewriting the table. It is built CONCURRENTLY, so ingest is not blocked,
+    except on partitioned tables where Postgres does not support it. The invalid index left
+    by a failed build is dropped, and rebuilt by the next call.
+
+    Returns:
+        The name of the index.
+    """
+    index_name = content_index_name(webhook_name, path)
+
+    # The DDL holds user supplied literals, it is sent as is rather than through text(),
+    # which would take e.g. a ":id" in a path for a bind parameter
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        quote = conn.dialect.identifier_preparer.quote
+        concurrently = "" if await is_partitioned(conn) else "CONCURRENTLY "
+        drop = f"DROP INDEX {concurrently}IF EXISTS {quote(index_name)}"
+        valid = await conn.scalar(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {"name": index_name},
+        )
+        if valid is False:
+            # Left behind by a failed CREATE INDEX CONCURRENTLY, IF NOT EXISTS would keep it
+            await conn.exec_driver_sql(drop)
+        try:
+            await conn.exec_driver_sql(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {quote(index_name)} "
+                f"ON {quote(thread_update_table.name)} "
+                f"((content #>> {_text_array_literal(path)})) "
+                f"WHERE webhook_name = {_sql_literal(webhook_name)}"
+            )
+        except Exception:
+            await conn.exec_driver_sql(drop)
+            raise
+
+    async with engine.begin() as conn:
+        existing = await conn.scalar(
+            select(content_index_table.c.index_name).where(
+                content_index_table.c.index_name == index_name
+            )
+        )
+        if existing is None:
+            await conn.execute(
+                content_index_table.insert().values(
+                    index_name=index_name,
+                    webhook_name=webhook_name,
+                    path=path,
+                    created_at=time.time(),
+                )
+            )
+    return index_name
+
+
+async def drop_content_index(engine: AsyncEngine, index_name: str) -> bool:
+    """Drop a promoted content path index. Returns False if it does not exist."""
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            delete(content_index_table).where(content_index_table.c.index_name == index_name)
+        )
+        if not result.rowcount:
+            return False
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        concurrently = "" if await is_partitioned(conn) else "CONCURRENTLY "
+        quote = conn.dialect.identifier_preparer.quote
+        await conn.exec_driver_sql(f"DROP INDEX {concurrently}IF EXISTS {quote(index_name)}")
+    return True
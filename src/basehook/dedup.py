@@ -0,0 +1,106 @@
+import time
+from hashlib import blake2b
+from typing import Any
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from basehook.models import delivery_table
+
+
+def _fingerprint(webhook_name: str, delivery_key: str) -> int:
+    digest = blake2b(f"{webhook_name}\0{delivery_key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class RecentDeliveries:
+    """
+    In-process filter of the delivery keys ingested recently, answering duplicates of a
+    redelivery storm without a database round trip.
+
+    Keys are kept as 64-bit fingerprints in two generations: the current one and the previous
+    one. Generations are rotated every `window_in_seconds` or when the current one is full, so a
+    key is remembered for at least one window and memory stays bounded. Unlike a Bloom filter
+    there are no false positives in practice (a fingerprint collision needs ~2^32 keys), so a
+    new event is never dropped. A miss is not authoritative: the delivery table decides.
+    """
+
+    def __init__(self, *, window_in_seconds: float = 600.0, max_entries: int = 100_000):
+        self.window_in_seconds = window_in_seconds
+        self.max_entries = max_entries
+        self._current: set[int] = set()
+        self._previous: set[int] = set()
+        self._rotated_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def _rotate_if_needed(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated_at >= 2 * self.window_in_seconds:
+            # Both generations expired
+            self._current, self._previous = set(), set()
+            self._rotated_at = now
+        elif now - self._rotated_at >= self.window_in_seconds or (
+            len(self._current) >= self.max_entries
+        ):
+            self._current, self._previous = set(), self._current
+            self._rotated_at = now
+
+    def seen(self, webhook_name: str, delivery_key: str) -> bool:
+        self._rotate_if_needed()
+        fingerprint = _fingerprint(webhook_name, delivery_key)
+        return fingerprint in self._current or fingerprint in self._previous
+
+    def add(self, webhook_name: str, delivery_key: str) -> None:
+        self._rotate_if_needed()
+        self._current.add(_fingerprint(webhook_name, delivery_key))
+
+    def clear(self) -> None:
+        self._current, self._previous = set(), set()
+
+
+def delivery_key(webhook_row: Any, headers: Any, content: Any) -> str | None:
+    """
+    Key identifying a delivery of `webhook_row`: its dedup header, or the value at its dedup
+    path once the body is parsed (`content` is None before). None if not configured or absent.
+    """
+    if webhook_row.dedup_header:
+        value = headers.get(webhook_row.dedup_header)
+    elif webhook_row.dedup_path and content is not None:
+        value = content
+        for key in webhook_row.dedup_path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        if isinstance(value, (dict, list)):
+            return None
+    else:
+        return None
+    return str(value) if value not in (None, "") else None
+
+
+async def record_delivery(conn: AsyncConnection, webhook_name: str, delivery_key: str) -> bool:
+    """
+    Record a delivery in the current transaction. Returns False if it was already recorded,
+    a concurrent copy waits on the primary key until the first one commits or rolls back.
+    """
+    result = await conn.execute(
+        insert(delivery_table)
+        .values(webhook_name=webhook_name, delivery_key=delivery_key, received_at=time.time())
+        .on_conflict_do_nothing()
+        .returning(delivery_table.c.webhook_name)
+    )
+    return result.first() is not None
+
+
+async def prune_deliveries(engine: AsyncEngine, *, older_than_in_seconds: float) -> int:
+    """Forget the deliveries received before the dedup window. Returns the number of rows."""
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            delete(delivery_table).where(
+                delivery_table.c.received_at < time.time() - older_than_in_seconds
+            )
+        )
+        return result.rowcount
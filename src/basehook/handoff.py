@@ -0,0 +1,62 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class Handoff:
+    """An update just committed by the ingest of this process."""
+
+    thread_id: str
+    update_id: int
+
+
+class LocalConsumers:
+    """
+    Pops of this process waiting for work, per database and webhook (see `pop(wait_in_seconds)`).
+
+    When the API runs in the same event loop as its consumers, the ingest offers each committed
+    update to an idle consumer, which claims its thread right away instead of polling. The
+    update stays a regular PENDING row: if nobody is waiting, or the waiter loses the claim to
+    another node, it is popped from the database as usual.
+    """
+
+    def __init__(self):
+        self._waiters: dict[tuple[str, str], deque[asyncio.Future]] = {}
+
+    def wait(self, database_url: str, webhook_name: str) -> asyncio.Future:
+        """Register an idle consumer, the future resolves to the Handoff it receives."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault((database_url, webhook_name), deque()).append(future)
+        return future
+
+    def cancel(
+        self, database_url: str, webhook_name: str, future: asyncio.Future
+    ) -> Handoff | None:
+        """Unregister a consumer. Returns the handoff it received without consuming it, if any."""
+        waiters = self._waiters.get((database_url, webhook_name))
+        if waiters is not None:
+            try:
+                waiters.remove(future)
+            except ValueError:
+                pass
+            if not waiters:
+                del self._waiters[(database_url, webhook_name)]
+        if future.done() and not future.cancelled():
+            return future.result()
+        future.cancel()
+        return None
+
+    def offer(self, database_url: str, webhook_name: str, handoff: Handoff) -> bool:
+        """Hand an update to the longest idle consumer. Returns False if none is waiting."""
+        waiters = self._waiters.get((database_url, webhook_name))
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(handoff)
+                return True
+        return False
+
+
+# Shared by every Basehook of the process, e.g. the API's and the consumers'
+local_consumers = LocalConsumers()
@@ -0,0 +1,236 @@
+"""
+Pluggable instrumentation of `Basehook.pop` and of the webhook ingest.
+
+Subclass `Instrumentation` and pass it to `Basehook(instrumentation=...)` to receive structured
+events, or use `OpenTelemetryInstrumentation` to record one span per pop or ingest. Nothing is
+traced when no instrumentation is configured, the only cost left is a None check per event.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional dependency, install basehook[otel]
+    otel_trace = None
+
+# Key of the current trace in the connection info, read by the round trip counter
+TRACE_INFO_KEY = "basehook_trace"
+
+
+@dataclass
+class PopTrace:
+    """State of one pop, handed to every hook."""
+
+    webhook_name: str
+    instrumentation: "Instrumentation"
+    started_at: float = field(default_factory=time.perf_counter)
+    thread_id: str | None = None
+    # Statements sent on the claim connection, plus BEGIN and COMMIT
+    round_trips: int = 0
+    claim_attempts: int = 0
+    lock_misses: int = 0
+    rows_skipped: int = 0
+    claim_seconds: float | None = None
+    handler_seconds: float | None = None
+    commit_seconds: float | None = None
+    # "success", "error", "empty" (no work) or "throttled" (rate limited)
+    outcome: str | None = None
+    # Free slot for the instrumentation, e.g. the span
+    context: Any = None
+
+    def record(self, name: str, attributes: dict[str, Any]) -> None:
+        if name == "claim_attempt":
+            self.claim_attempts += 1
+            self.thread_id = attributes["thread_id"]
+        elif name == "lock_miss":
+            self.lock_misses += 1
+        elif name == "rows_skipped":
+            self.rows_skipped += attributes["count"]
+        elif name == "claimed":
+            self.claim_seconds = attributes["claim_seconds"]
+        elif name == "committed":
+            self.commit_seconds = attributes["commit_seconds"]
+            self.round_trips += 1  # COMMIT
+        elif name in ("empty", "throttled"):
+            self.outcome = name
+        self.instrumentation.pop_event(self, name, attributes)
+
+
+@dataclass
+class IngestTrace:
+    """State of one webhook ingest, handed to every hook."""
+
+    webhook_name: str
+    instrumentation: "Instrumentation"
+    started_at: float = field(default_factory=time.perf_counter)
+    thread_id: str | None = None
+    update_id: int | None = None
+    # Statements sent on the ingest connection, plus BEGIN and COMMIT
+    round_trips: int = 0
+    insert_seconds: float | None = None
+    commit_seconds: float | None = None
+    # Whether a pop waiting in this process was handed the update
+    handed_off: bool | None = None
+    # "inserted", "duplicate", "challenge" or "error"
+    outcome: str | None = None
+    # Free slot for the instrumentation, e.g. the span
+    context: Any = None
+
+    def record(self, name: str, attributes: dict[str, Any]) -> None:
+        if name == "inserted":
+            self.thread_id = attributes["thread_id"]
+            self.update_id = attributes["update_id"]
+            self.insert_seconds = attributes["insert_seconds"]
+        elif name == "committed":
+            self.commit_seconds = attributes["commit_seconds"]
+            self.round_trips += 1  # COMMIT
+            self.outcome = "inserted"
+        elif name == "handoff":
+            self.handed_off = attributes["handed_off"]
+        elif name in ("duplicate", "challenge"):
+            self.outcome = name
+        self.instrumentation.ingest_event(self, name, attributes)
+
+
+class Instrumentation:
+    """
+    Receives the events of `Basehook.pop`. Every hook is a no-op, override the ones you need.
+
+    Events passed to `pop_event`:
+        claim_attempt: a pending update was picked, attributes: thread_id
+        lock_miss: its thread is locked by another consumer, the claim is retried
+        rows_skipped: older revisions were skipped, attributes: count
+        empty: there is nothing to process
+        throttled: the rate limit is reached, nothing is claimed
+        handoff: woken up by an update ingested in this process, attributes: thread_id, update_id
+        claimed: the update is handed to the handler, attributes: claim_seconds
+        committed: the status was committed, attributes: commit_seconds
+
+    Events passed to `ingest_event`:
+        duplicate: the delivery was received already, nothing is inserted
+        challenge: a verification challenge was answered, nothing is inserted
+        inserted: the update was inserted, attributes: thread_id, update_id, insert_seconds
+        committed: the update was committed, attributes: commit_seconds
+        handoff: the update was offered to the pops of this process, attributes: handed_off
+    """
+
+    def pop_started(self, trace: PopTrace) -> None:
+        pass
+
+    def pop_event(self, trace: PopTrace, name: str, attributes: dict[str, Any]) -> None:
+        pass
+
+    def pop_finished(self, trace: PopTrace) -> None:
+        pass
+
+    def ingest_started(self, trace: IngestTrace) -> None:
+        pass
+
+    def ingest_event(self, trace: IngestTrace, name: str, attributes: dict[str, Any]) -> None:
+        pass
+
+    def ingest_finished(self, trace: IngestTrace) -> None:
+        pass
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Record each pop as a `basehook.pop` span and each ingest as a `basehook.ingest` span,
+    events included. No-op without opentelemetry.
+    """
+
+    def __init__(self, tracer_provider: Any = None):
+        self.tracer = (
+            otel_trace.get_tracer("basehook", tracer_provider=tracer_provider)
+            if otel_trace is not None
+            else None
+        )
+
+    def pop_started(self, trace: PopTrace) -> None:
+        if self.tracer is not None:
+            trace.context = self.tracer.start_span(
+                "basehook.pop", attributes={"basehook.webhook": trace.webhook_name}
+            )
+
+    def pop_event(self, trace: PopTrace, name: str, attributes: dict[str, Any]) -> None:
+        if trace.context is not None:
+            trace.context.add_event(name, attributes=attributes)
+
+    def pop_finished(self, trace: PopTrace) -> None:
+        span = trace.context
+        if span is None:
+            return
+        span.set_attributes(
+            {
+                "basehook.outcome": trace.outcome or "",
+                "basehook.round_trips": trace.round_trips,
+                "basehook.claim_attempts": trace.claim_attempts,
+                "basehook.lock_misses": trace.lock_misses,
+                "basehook.rows_skipped": trace.rows_skipped,
+            }
+        )
+        if trace.thread_id is not None:
+            span.set_attribute("basehook.thread_id", trace.thread_id)
+        if trace.outcome == "error":
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+        span.end()
+
+    def ingest_started(self, trace: IngestTrace) -> None:
+        if self.tracer is not None:
+            trace.context = self.tracer.start_span(
+                "basehook.ingest", attributes={"basehook.webhook": trace.webhook_name}
+            )
+
+    def ingest_event(self, trace: IngestTrace, name: str, attributes: dict[str, Any]) -> None:
+        if trace.context is not None:
+            trace.context.add_event(name, attributes=attributes)
+
+    def ingest_finished(self, trace: IngestTrace) -> None:
+        span = trace.context
+        if span is None:
+            return
+        span.set_attributes(
+            {"basehook.outcome": trace.outcome or "", "basehook.round_trips": trace.round_trips}
+        )
+        if trace.thread_id is not None:
+            span.set_attribute("basehook.thread_id", trace.thread_id)
+        if trace.handed_off is not None:
+            span.set_attribute("basehook.handed_off", trace.handed_off)
+        if trace.outcome == "error":
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+        span.end()
+
+
+def emit(trace: PopTrace | IngestTrace | None, name: str, **attributes: Any) -> None:
+    """Send an event to the instrumentation of the pop or ingest, if any."""
+    if trace is not None:
+        trace.record(name, attributes)
+
+
+def attach(trace: PopTrace | IngestTrace | None, conn: AsyncConnection) -> None:
+    """Count the statements sent on this connection as round trips of the pop or ingest."""
+    if trace is not None:
+        conn.sync_connection.info[TRACE_INFO_KEY] = trace
+        trace.round_trips += 1  # BEGIN
+
+
+def detach(trace: PopTrace | IngestTrace | None, conn: AsyncConnection) -> None:
+    if trace is not None:
+        conn.sync_connection.info.pop(TRACE_INFO_KEY, None)
+
+
+def _count_round_trip(conn, cursor, statement, parameters, context, executemany) -> None:
+    trace = conn.info.get(TRACE_INFO_KEY)
+    if trace is not None:
+        trace.round_trips += 1
+
+
+def install_round_trip_counter(engine: AsyncEngine) -> None:
+    """Register the statement listener feeding the `round_trips` of the traces."""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _count_round_trip):
+        event.listen(engine.sync_engine, "before_cursor_execute", _count_round_trip)
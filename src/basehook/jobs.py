@@ -0,0 +1,153 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+from uuid import uuid4
+
+from sqlalchemy import Select, func, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.models import thread_update_table
+
+
+@dataclass
+class Job:
+    """A background job, with its progress."""
+
+    id: str
+    kind: str
+    status: str = "running"  # running, completed, cancelled or failed
+    total: int | None = None
+    updated: int = 0
+    rate: float | None = None  # Maximum rows per second
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "updated": self.updated,
+            "rate": self.rate,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    """
+    In-process registry of background jobs. Jobs do not survive a restart, but they commit
+    chunk by chunk, so re-running one only processes what is left.
+    """
+
+    def __init__(self, *, max_finished: int = 100):
+        self.max_finished = max_finished
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def start(
+        self, kind: str, run: Callable[[Job], Awaitable[None]], *, rate: float | None = None
+    ) -> Job:
+        """Run `run(job)` in the background and return the job."""
+        job = Job(id=str(uuid4()), kind=kind, rate=rate)
+        job.task = asyncio.create_task(self._run(job, run))
+        self._jobs[job.id] = job
+        self._forget_finished()
+        return job
+
+    async def _run(self, job: Job, run: Callable[[Job], Awaitable[None]]) -> None:
+        try:
+            await run(job)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{e}\n{traceback.format_exc()}"
+            print(f"✗ Job {job.id} ({job.kind}) failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancel a running job, chunks already committed are kept."""
+        job = self._jobs.get(job_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+        return job
+
+    def cancel_all(self) -> None:
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+
+async def update_in_chunks(
+    engine: AsyncEngine,
+    job: Job,
+    ids_query: Select,
+    values: dict[str, Any],
+    *,
+    chunk_size: int = 1000,
+    rate: float | None = None,
+) -> None:
+    """
+    Apply `values` to the thread updates selected by `ids_query`, in primary key order and one
+    transaction per chunk, so that locks are short lived and WAL is written progressively.
+
+    Args:
+        engine: The engine to run on
+        job: Progress is reported on `job.updated`
+        ids_query: Select of thread_update ids, filters applied
+        values: Columns to update
+        chunk_size: Rows updated per transaction
+        rate: Maximum rows updated per second, e.g. to release replayed updates progressively
+    """
+    ids = ids_query.subquery()
+    async with engine.begin() as conn:
+        job.total = await conn.scalar(select(func.count()).select_from(ids))
+
+    if rate is not None:
+        # Smaller chunks spread the released rows over time instead of in bursts
+        chunk_size = max(1, min(chunk_size, int(rate)))
+
+    last_id = 0
+    while True:
+        started_at = time.monotonic()
+        chunk = select(ids.c.id).where(ids.c.id > last_id).order_by(ids.c.id).limit(chunk_size)
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                update(thread_update_table)
+                .where(thread_update_table.c.id.in_(chunk.scalar_subquery()))
+                .values(**values)
+                .returning(thread_update_table.c.id)
+            )
+            updated_ids = result.scalars().all()
+        if not updated_ids:
+            return
+
+        last_id = max(updated_ids)
+        job.updated += len(updated_ids)
+
+        if rate is not None:
+            await asyncio.sleep(max(len(updated_ids) / rate - (time.monotonic() - started_at), 0))
+        else:
+            # Let other coroutines run between chunks
+            await asyncio.sleep(0)
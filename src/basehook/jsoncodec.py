@@ -0,0 +1,63 @@
+"""
+JSON encoding and decoding of webhook contents, with orjson when installed (basehook[fast]).
+
+orjson parses and serializes several times faster than the standard library. Values it does
+not support (e.g. integers over 64 bits) fall back to the standard library, so switching
+codec never changes which payloads are accepted.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # optional dependency, install basehook[fast]
+    orjson = None
+
+
+def loads(data: str | bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumps(value: Any) -> str:
+    """Serialize to a str, as expected by SQLAlchemy's json_serializer."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(value)
+
+
+class RawJSON:
+    """
+    Content popped with `pop(raw=True)`: the JSON text as stored by Postgres, decoded on first
+    access to `json()` only. Handlers that forward the content as is never parse it.
+    """
+
+    __slots__ = ("text", "_value", "_decoded")
+
+    def __init__(self, text: str | bytes):
+        self.text = text.decode("utf-8") if isinstance(text, bytes) else text
+        self._decoded = False
+        self._value = None
+
+    def __bytes__(self) -> bytes:
+        return self.text.encode("utf-8")
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"RawJSON({self.text[:80]!r})"
+
+    def json(self) -> Any:
+        if not self._decoded:
+            self._value = loads(self.text)
+            self._decoded = True
+        return self._value
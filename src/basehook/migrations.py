@@ -0,0 +1,285 @@
+"""
+Versioned schema migrations, applied at startup instead of `create_all` on every boot.
+
+Applied versions are recorded in the basehook_schema_version table. A process first reads the
+recorded versions with a single query, and only when migrations are pending does it try to take
+an advisory lock: one process migrates while the others go on. The code needs the required
+migrations (tables, columns), so processes not holding the lock wait for them to be recorded.
+Background migrations (index builds, rollup rebuilds) only make things faster, nobody waits for
+them and the lifespan applies them after startup. Every migration is idempotent: a migration
+interrupted before its version was recorded is simply applied again.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from sqlalchemy import MetaData, Table, func, insert, select, text
+from sqlalchemy.exc import DBAPIError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from basehook.models import (
+    metadata,
+    partitioned_metadata,
+    schema_version_table,
+    thread_update_table,
+    webhook_table,
+)
+from basehook.partitions import (
+    DDL_LOCK_TIMEOUT,
+    create_default_partition,
+    create_partitions,
+    is_partitioned,
+)
+from basehook.rollup import rebuild_rollup
+
+# Arbitrary key for pg_try_advisory_lock, only one node migrates at a time
+MIGRATION_LOCK_ID = 0x6261736568000003
+
+# Seconds between two checks of a process waiting for another one's required migrations
+MIGRATION_POLL_INTERVAL = 1.0
+
+# Attempts of a DDL transaction whose table lock is not granted within DDL_LOCK_TIMEOUT
+DDL_LOCK_ATTEMPTS = 5
+# Seconds between two attempts, letting the queries queued behind the lock drain
+DDL_LOCK_RETRY_DELAY = 1.0
+# SQLSTATE of lock_timeout expiring
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    # Called with the engine and the partition interval of the lifespan
+    apply: Callable[[AsyncEngine, float | None], Awaitable[None]]
+    # Not needed by the code to run, applied after startup and never waited for
+    background: bool = False
+
+
+async def create_schema(
+    conn: AsyncConnection, target_metadata: MetaData, partition_interval: float | None = None
+) -> None:
+    """
+    Create the missing tables of `target_metadata`, see `Basehook.create_tables`.
+
+    Args:
+        partition_interval: if set, create thread_update range-partitioned on timestamp,
+            one partition per `partition_interval` seconds. Only applies when the table
+            does not exist yet.
+    """
+    if partition_interval is None:
+        await conn.run_sync(target_metadata.create_all)
+        return
+
+    await conn.run_sync(
+        target_metadata.create_all,
+        tables=[t for t in target_metadata.sorted_tables if t.name != thread_update_table.name],
+    )
+    await conn.run_sync(partitioned_metadata.create_all)
+    await create_default_partition(conn)
+    await create_partitions(conn, partition_interval)
+
+
+async def _run_ddl(engine: AsyncEngine, ddl: Callable[[AsyncConnection], Awaitable[None]]) -> None:
+    """
+    Run `ddl` in a transaction giving up on table locks after DDL_LOCK_TIMEOUT, so that the
+    queries of the table do not queue behind a long wait for the lock. Retried up to
+    DDL_LOCK_ATTEMPTS times when the lock is not granted.
+    """
+    for attempt in range(1, DDL_LOCK_ATTEMPTS + 1):
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+                await ddl(conn)
+            return
+        except DBAPIError as e:
+            if getattr(e.orig, "sqlstate", None) != LOCK_NOT_AVAILABLE:
+                raise
+            if attempt == DDL_LOCK_ATTEMPTS:
+                raise
+            print(f"✗ Table lock not granted, retrying ({attempt}/{DDL_LOCK_ATTEMPTS})")
+            await asyncio.sleep(DDL_LOCK_RETRY_DELAY)
+
+
+async def _create_tables(engine: AsyncEngine, partition_interval: float | None) -> None:
+    async with engine.begin() as conn:
+        await create_schema(conn, metadata, partition_interval)
+
+
+# Columns added to existing tables over time, which create_all does not add
+_ADDED_COLUMNS: list[tuple[Table, str]] = [
+    (webhook_table, "priority"),
+    (webhook_table, "priority_path"),
+    (webhook_table, "priority_map"),
+    (webhook_table, "retention_days"),
+    (webhook_table, "skipped_content_retention_days"),
+    (webhook_table, "dedup_header"),
+    (webhook_table, "dedup_path"),
+    (webhook_table, "max_body_bytes"),
+    (thread_update_table, "priority"),
+]
+
+
+async def _add_columns(engine: AsyncEngine, partition_interval: float | None) -> None:
+    async def add_columns(conn: AsyncConnection) -> None:
+        for table, column in _ADDED_COLUMNS:
+            # Nullable or with a constant default, so no table rewrite
+            definition = CreateColumn(table.c[column]).compile(dialect=conn.dialect)
+            await conn.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS {definition}'
+            )
+
+    await _run_ddl(engine, add_columns)
+
+
+async def _create_indexes(engine: AsyncEngine, partition_interval: float | None) -> None:
+    """
+    Create the missing indexes of the metadata without blocking writes, with CREATE INDEX
+    CONCURRENTLY. A partitioned thread_update does not support it, its indexes are created
+    the regular way.
+    """
+    indexes = [index for table in metadata.sorted_tables for index in table.indexes]
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+        # IF NOT EXISTS would keep
+        invalid = await conn.scalars(
+            text(
+                "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+            ),
+            {"names": [index.name for index in indexes]},
+        )
+        for name in invalid.all():
+            await conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+        partitioned = await is_partitioned(conn)
+        for index in indexes:
+            statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+            if not (partitioned and index.table is thread_update_table):
+                statement = statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            await conn.exec_driver_sql(statement)
+
+
+async def _drop_content_not_null(engine: AsyncEngine, partition_interval: float | None) -> None:
+    """Retention nulls out SKIPPED contents, thread_update tables created before require one."""
+
+    async def drop_not_null(conn: AsyncConnection) -> None:
+        nullable = await conn.scalar(
+            text(
+                "SELECT is_nullable FROM information_schema.columns "
+                "WHERE table_name = 'thread_update' AND column_name = 'content'"
+            )
+        )
+        # Only locks the table when there is something to change
+        if nullable == "NO":
+            await conn.execute(text("ALTER TABLE thread_update ALTER COLUMN content DROP NOT NULL"))
+
+    await _run_ddl(engine, drop_not_null)
+
+
+async def _replace_thread_id_index(engine: AsyncEngine, partition_interval: float | None) -> None:
+    """
+    Tables created before the query indexes have a plain btree named ix_thread_update_thread_id
+    (from `index=True`), which the text_pattern_ops index replaces. Builds the new one first.
+    """
+    await _create_indexes(engine, partition_interval)
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        concurrently = "" if await is_partitioned(conn) else " CONCURRENTLY"
+        await conn.exec_driver_sql(f"DROP INDEX{concurrently} IF EXISTS ix_thread_update_thread_id")
+
+
+async def _rebuild_rollup(engine: AsyncEngine, partition_interval: float | None) -> None:
+    # Updates ingested before the status trigger existed are missing from the rollup
+    await rebuild_rollup(engine)
+
+
+MIGRATIONS = [
+    Migration(1, "Create tables and triggers", _create_tables),
+    Migration(2, "Add the priority, retention, dedup and body size columns", _add_columns),
+    Migration(3, "Create the missing indexes concurrently", _create_indexes, background=True),
+    Migration(4, "Allow null thread update contents", _drop_content_not_null),
+    Migration(
+        5,
+        "Replace the thread_id index with a pattern index",
+        _replace_thread_id_index,
+        background=True,
+    ),
+    Migration(6, "Rebuild the metrics rollup", _rebuild_rollup, background=True),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def applied_versions(engine: AsyncEngine) -> set[int]:
+    """The applied migrations, empty if the schema was never migrated."""
+    async with engine.connect() as conn:
+        try:
+            return set(await conn.scalars(select(schema_version_table.c.version)))
+        except ProgrammingError:
+            # The version table does not exist yet
+            return set()
+
+
+async def schema_version(engine: AsyncEngine) -> int:
+    """The last applied migration, 0 if the schema was never migrated."""
+    return max(await applied_versions(engine), default=0)
+
+
+async def migrate(
+    engine: AsyncEngine, *, partition_interval: float | None = None, background: bool = True
+) -> list[int]:
+    """
+    Apply the pending migrations, the required ones first.
+
+    Costs a single query when the schema is up to date. Otherwise tries to take an advisory
+    lock and applies what is still pending once it holds it. When another process holds the
+    lock, waits until the required migrations are recorded, but not the background ones.
+
+    Args:
+        partition_interval: see `create_schema`, only used when thread_update is created.
+        background: also apply the background migrations (index builds, rollup rebuilds).
+            The lifespan passes False on startup, then applies them in a background task.
+
+    Returns:
+        The versions applied by this call, empty if the schema was already up to date.
+    """
+    migrations = [migration for migration in MIGRATIONS if background or not migration.background]
+    if not _pending(migrations, await applied_versions(engine)):
+        return []
+
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        while not await lock_conn.scalar(select(func.pg_try_advisory_lock(MIGRATION_LOCK_ID))):
+            required = [migration for migration in migrations if not migration.background]
+            if not _pending(required, await applied_versions(engine)):
+                return []
+            await asyncio.sleep(MIGRATION_POLL_INTERVAL)
+
+        applied = []
+        try:
+            # Another process may have migrated while we were trying
+            pending = _pending(migrations, await applied_versions(engine))
+            for migration in sorted(pending, key=lambda migration: migration.background):
+                await migration.apply(engine, partition_interval)
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        insert(schema_version_table).values(
+                            version=migration.version,
+                            description=migration.description,
+                            applied_at=time.time(),
+                        )
+                    )
+                applied.append(migration.version)
+                print(f"✓ Applied migration {migration.version}: {migration.description}")
+        finally:
+            await lock_conn.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK_ID)))
+    return applied
+
+
+def _pending(migrations: list[Migration], applied: set[int]) -> list[Migration]:
+    return [migration for migration in migrations if migration.version not in applied]
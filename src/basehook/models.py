@@ -2,15 +2,20 @@ from enum import Enum
 
 from sqlalchemy import (
     ARRAY,
+    DDL,
     BigInteger,
     Boolean,
     Column,
     Float,
     Index,
+    Integer,
+    LargeBinary,
     MetaData,
     String,
     Table,
     UniqueConstraint,
+    event,
+    text,
 )
 from sqlalchemy import (
     Enum as SQLAlchemyEnum,
@@ -27,6 +32,15 @@ class ThreadUpdateStatus(Enum):
     ERROR = "error"
 
 
+schema_version_table = Table(
+    "basehook_schema_version",
+    metadata,
+    # One row per applied migration, see basehook.migrations
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", Float, nullable=False),
+)
+
 webhook_table = Table(
     "webhook",
     metadata,
@@ -44,6 +58,18 @@ webhook_table = Table(
     Column("hmac_encoding", String, nullable=True),  # "hex" or "base64"
     Column("hmac_algorithm", String, nullable=True),  # "sha256" or "sha1"
     Column("hmac_prefix", String, nullable=True),  # e.g., "v0=" or "sha256="
+    # Priority settings
+    Column("priority", Integer, nullable=False, server_default="0"),  # Default priority
+    Column("priority_path", ARRAY(String), nullable=True),  # e.g., ["event", "type"]
+    Column("priority_map", JSONB, nullable=True),  # e.g., {"payment_failed": 10}
+    # Retention settings (in days, None keeps rows forever)
+    Column("retention_days", Float, nullable=True),  # Delete SUCCESS/SKIPPED rows
+    Column("skipped_content_retention_days", Float, nullable=True),  # Null out SKIPPED content
+    # Deduplication of redelivered events, by header or content path (None disables it)
+    Column("dedup_header", String, nullable=True),  # e.g., "X-GitHub-Delivery"
+    Column("dedup_path", ARRAY(String), nullable=True),  # e.g., ["event_id"]
+    # Bodies above this size are rejected with a 413 (None uses BASEHOOK_MAX_BODY_BYTES)
+    Column("max_body_bytes", Integer, nullable=True),
     # Error tracking
     Column("last_error", String, nullable=True),  # Last validation error message
     Column("last_error_timestamp", Float, nullable=True),  # When the error occurred
@@ -58,21 +84,303 @@ thread_table = Table(
     UniqueConstraint("webhook_name", "thread_id"),
 )
 
-thread_update_table = Table(
-    "thread_update",
+
+def _build_thread_update_table(target_metadata: MetaData, *, partitioned: bool = False) -> Table:
+    """
+    Build the thread_update table. When partitioned, the table is declaratively range-partitioned
+    on `timestamp`, which must then be part of the primary key.
+    """
+    return Table(
+        "thread_update",
+        target_metadata,
+        Column("id", BigInteger, primary_key=True, autoincrement=True),
+        Column("webhook_name", String, nullable=False),
+        Column("thread_id", String, nullable=False),
+        Column("revision_number", Float, nullable=False),
+        # JSONB for better compression and indexing, nulled out by retention for SKIPPED rows
+        Column("content", JSONB, nullable=True),
+        Column("timestamp", Float, nullable=False, primary_key=partitioned),
+        Column("status", SQLAlchemyEnum(ThreadUpdateStatus), nullable=False),
+        Column("traceback", String, nullable=True),  # Error traceback for failed updates
+        Column("priority", Integer, nullable=False, server_default="0"),  # Higher is claimed first
+        # Partial index for pending updates - optimizes pull.py queries
+        Index(
+            "ix_thread_update_timestamp_pending",
+            "timestamp",
+            postgresql_where="status = 'PENDING'",
+        ),
+        # Partial index matching the claim ordering, keeps prioritized claims an index scan
+        Index(
+            "ix_thread_update_claim_pending",
+            "webhook_name",
+            text("priority DESC"),
+            "timestamp",
+            postgresql_where="status = 'PENDING'",
+        ),
+        # Indexes backing the /api/query filters and sorts, see api.apply_filters_to_query
+        Index("ix_thread_update_timestamp", "timestamp"),
+        Index("ix_thread_update_status_timestamp", "status", "timestamp"),
+        # text_pattern_ops supports both equality and prefix (LIKE 'abc%') matches
+        Index(
+            "ix_thread_update_thread_id_pattern",
+            "thread_id",
+            postgresql_ops={"thread_id": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_thread_update_webhook_name_timestamp",
+            "webhook_name",
+            "timestamp",
+            postgresql_ops={"webhook_name": "text_pattern_ops"},
+        ),
+        # Trigram indexes support substring matches (ILIKE '%abc%')
+        Index(
+            "ix_thread_update_thread_id_trgm",
+            "thread_id",
+            postgresql_using="gin",
+            postgresql_ops={"thread_id": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_thread_update_webhook_name_trgm",
+            "webhook_name",
+            postgresql_using="gin",
+            postgresql_ops={"webhook_name": "gin_trgm_ops"},
+        ),
+        # Only ERROR rows have a traceback, the partial index stays small
+        Index(
+            "ix_thread_update_traceback_trgm",
+            "traceback",
+            postgresql_using="gin",
+            postgresql_ops={"traceback": "gin_trgm_ops"},
+            postgresql_where="traceback IS NOT NULL",
+        ),
+        # Content searches: containment (@>) and path existence (@?)
+        Index(
+            "ix_thread_update_content",
+            "content",
+            postgresql_using="gin",
+            postgresql_ops={"content": "jsonb_path_ops"},
+        ),
+        postgresql_partition_by="RANGE (timestamp)" if partitioned else None,
+    )
+
+
+thread_update_table = _build_thread_update_table(metadata)
+
+# Same table, range-partitioned on timestamp, see Basehook.create_tables(partition_interval=...)
+partitioned_metadata = MetaData()
+partitioned_thread_update_table = _build_thread_update_table(partitioned_metadata, partitioned=True)
+
+# Trigram indexes need the pg_trgm extension
+for _metadata in (metadata, partitioned_metadata):
+    event.listen(_metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+rate_limit_bucket_table = Table(
+    "rate_limit_bucket",
+    metadata,
+    # Token bucket shared by all consumers of a webhook, refilled lazily on read
+    Column("webhook_name", String, primary_key=True),
+    Column("tokens", Float, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+
+archive_segment_table = Table(
+    "archive_segment",
+    metadata,
+    # Index of the compressed NDJSON segment files holding archived thread updates
+    Column("id", BigInteger, primary_key=True, autoincrement=True),
+    Column("webhook_name", String, nullable=False),
+    Column("path", String, nullable=False),  # Relative to the archive directory
+    Column("encoding", String, nullable=False),  # "zstd" or "gzip"
+    Column("row_count", Integer, nullable=False),
+    Column("min_id", BigInteger, nullable=False),
+    Column("max_id", BigInteger, nullable=False),
+    Column("min_timestamp", Float, nullable=False),
+    Column("max_timestamp", Float, nullable=False),
+    Column("thread_ids", ARRAY(String), nullable=False),
+    Column("created_at", Float, nullable=False),
+    Index("ix_archive_segment_time_range", "webhook_name", "min_timestamp", "max_timestamp"),
+    Index("ix_archive_segment_thread_ids", "thread_ids", postgresql_using="gin"),
+)
+
+content_index_table = Table(
+    "content_index",
+    metadata,
+    # B-tree indexes on frequently searched content paths, see Basehook.index_content_path
+    Column("index_name", String, primary_key=True),
+    Column("webhook_name", String, nullable=False),
+    Column("path", ARRAY(String), nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+thread_update_payload_table = Table(
+    "thread_update_payload",
+    metadata,
+    # Large bodies stored compressed out of line, the thread_update content only keeps the
+    # extracted fields and a reference to this row, see basehook.payloads
+    Column("id", String, primary_key=True),  # Referenced from the content
+    Column("update_id", BigInteger, nullable=False),
+    Column("encoding", String, nullable=False),  # "zstd" or "gzip"
+    Column("size", Integer, nullable=False),  # Uncompressed size, in bytes
+    Column("data", LargeBinary, nullable=False),
+)
+
+delivery_table = Table(
+    "webhook_delivery",
     metadata,
+    # Delivery keys already ingested, the primary key rejects redeliveries of the same event.
+    # Kept apart from thread_update, whose partitions cannot enforce a unique key without the
+    # timestamp. Rows older than the dedup window are pruned, see Basehook.prune_deliveries.
+    Column("webhook_name", String, primary_key=True),
+    Column("delivery_key", String, primary_key=True),
+    Column("received_at", Float, nullable=False),
+    Index("ix_webhook_delivery_received_at", "received_at"),
+)
+
+thread_update_rollup_table = Table(
+    "thread_update_rollup",
+    metadata,
+    # Number of updates per (webhook, status, minute of ingest), backs /api/metrics
+    Column("webhook_name", String, primary_key=True),
+    Column("status", String, primary_key=True),  # ThreadUpdateStatus name
+    Column("minute", BigInteger, primary_key=True),  # Epoch seconds, truncated to the minute
+    Column("count", BigInteger, nullable=False),
+)
+
+thread_update_delta_table = Table(
+    "thread_update_delta",
+    metadata,
+    # Append-only log of rollup changes written by a trigger on thread_update, folded into
+    # thread_update_rollup periodically. Appending avoids contention on hot rollup rows.
+    Column("id", BigInteger, primary_key=True, autoincrement=True),
+    Column("webhook_name", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("minute", BigInteger, nullable=False),
+    Column("delta", Integer, nullable=False),
+)
+
+thread_update_drain_table = Table(
+    "thread_update_drain",
+    metadata,
+    # Number of updates leaving PENDING per (webhook, minute of the transition), for drain rates
+    Column("webhook_name", String, primary_key=True),
+    Column("minute", BigInteger, primary_key=True),
+    Column("count", BigInteger, nullable=False),
+)
+
+thread_update_drain_delta_table = Table(
+    "thread_update_drain_delta",
+    metadata,
+    # Append-only log folded into thread_update_drain, like thread_update_delta
     Column("id", BigInteger, primary_key=True, autoincrement=True),
     Column("webhook_name", String, nullable=False),
-    Column("thread_id", String, nullable=False, index=True),
-    Column("revision_number", Float, nullable=False),
-    Column("content", JSONB, nullable=False),  # JSONB for better compression and indexing
-    Column("timestamp", Float, nullable=False),
-    Column("status", SQLAlchemyEnum(ThreadUpdateStatus), nullable=False),
-    Column("traceback", String, nullable=True),  # Error traceback for failed updates
-    # Partial index for pending updates - optimizes pull.py queries
-    Index(
-        "ix_thread_update_timestamp_pending",
-        "timestamp",
-        postgresql_where="status = 'PENDING'",
-    ),
+    Column("minute", BigInteger, nullable=False),
+)
+
+# Keep the rollups in sync with every insert and status transition of thread_update,
+# whichever code path writes it. Deletes (retention, archive) do not rewrite history.
+track_status_function = DDL(
+    """
+    CREATE OR REPLACE FUNCTION basehook_track_status() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO thread_update_delta (webhook_name, status, minute, delta)
+            VALUES (OLD.webhook_name, OLD.status::text, floor(OLD.timestamp / 60) * 60, -1);
+            IF OLD.status = 'PENDING' THEN
+                INSERT INTO thread_update_drain_delta (webhook_name, minute)
+                VALUES (NEW.webhook_name, floor(extract(epoch FROM now()) / 60) * 60);
+            END IF;
+        END IF;
+        INSERT INTO thread_update_delta (webhook_name, status, minute, delta)
+        VALUES (NEW.webhook_name, NEW.status::text, floor(NEW.timestamp / 60) * 60, 1);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+)
+track_status_trigger = DDL(
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('thread_update') IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'thread_update_track_status'
+            AND tgrelid = to_regclass('thread_update')
+        ) THEN
+            CREATE TRIGGER thread_update_track_status
+            AFTER INSERT OR UPDATE OF status ON thread_update
+            FOR EACH ROW EXECUTE FUNCTION basehook_track_status();
+        END IF;
+    END;
+    $$
+    """
+)
+
+# Channel on which new and status-changed updates are announced, read by /api/stream.
+# The trigger is opt-in, see Basehook.set_update_notifications: it sends a notification per
+# inserted row and status change, queued at commit under a cluster-wide lock.
+UPDATES_CHANNEL = "basehook_updates"
+
+notify_update_function = DDL(
+    f"""
+    CREATE OR REPLACE FUNCTION basehook_notify_update() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NULL;
+        END IF;
+        -- Content is left out, notification payloads are limited to 8000 bytes
+        PERFORM pg_notify('{UPDATES_CHANNEL}', json_build_object(
+            'id', NEW.id,
+            'webhook_name', NEW.webhook_name,
+            'thread_id', left(NEW.thread_id, 1000),
+            'revision_number', NEW.revision_number,
+            'timestamp', NEW.timestamp,
+            'status', NEW.status::text,
+            'priority', NEW.priority,
+            'operation', lower(TG_OP)
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+)
+notify_update_trigger = DDL(
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('thread_update') IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'thread_update_notify'
+            AND tgrelid = to_regclass('thread_update')
+        ) THEN
+            CREATE TRIGGER thread_update_notify
+            AFTER INSERT OR UPDATE OF status ON thread_update
+            FOR EACH ROW EXECUTE FUNCTION basehook_notify_update();
+        END IF;
+    END;
+    $$
+    """
 )
+
+drop_notify_update_trigger = DDL(
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'thread_update_notify'
+            AND tgrelid = to_regclass('thread_update')
+        ) THEN
+            DROP TRIGGER thread_update_notify ON thread_update;
+        END IF;
+    END;
+    $$
+    """
+)
+
+for _metadata in (metadata, partitioned_metadata):
+    event.listen(_metadata, "after_create", track_status_function)
+    event.listen(_metadata, "after_create", track_status_trigger)
+    event.listen(_metadata, "after_create", notify_update_function)
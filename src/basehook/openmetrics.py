@@ -0,0 +1,207 @@
+"""
+Minimal OpenMetrics instrumentation, served on /metrics.
+
+Recording a sample only increments a counter slot, buckets are pre-computed and cumulated at
+scrape time. No lock is taken: the event loop runs one coroutine at a time, and integer
+increments on a list slot are atomic under the GIL for the other threads.
+"""
+
+import time
+from bisect import bisect_left
+from collections.abc import Iterable
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# From 0.5ms to 10s, covers an insert as well as a slow handler
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter, one series per label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        slot = self._values.get(labels)
+        if slot is None:
+            slot = self._values.setdefault(labels, [0])
+        slot[0] += amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, (value,) in self._values.items():
+            label_string = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_total{label_string} {_format_value(value)}"
+
+
+class Histogram:
+    """Histogram with fixed buckets, one series per label values."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label values: one count per bucket, then +Inf, then the sum
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        slot = self._values.get(labels)
+        if slot is None:
+            slot = self._values.setdefault(labels, [0] * (len(self.buckets) + 2))
+        slot[bisect_left(self.buckets, value)] += 1
+        slot[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        for labels, slot in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), slot, strict=True):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                label_string = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{label_string} {cumulative}"
+            label_string = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_count{label_string} {cumulative}"
+            yield f"{self.name}_sum{label_string} {_format_value(slot[-1])}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge:
+    """Gauge computed at scrape time, e.g. from the database."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def clear(self) -> None:
+        self._values = {}
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+INGEST_SECONDS = Histogram(
+    "basehook_ingest_phase_seconds",
+    "Time spent ingesting a webhook, by phase (config, hmac, parse, insert)",
+    ("webhook", "phase"),
+)
+POP_CLAIM_SECONDS = Histogram(
+    "basehook_pop_claim_seconds",
+    "Time to claim an update in pop, including locked threads retries",
+    ("webhook",),
+)
+POP_HANDLER_SECONDS = Histogram(
+    "basehook_pop_handler_seconds",
+    "Time spent in the pop block, by outcome (success, error)",
+    ("webhook", "status"),
+)
+POOL_WAIT_SECONDS = Histogram(
+    "basehook_pool_wait_seconds",
+    "Time to get a connection from the pool and begin a transaction",
+    ("operation",),
+)
+UPDATES_SKIPPED = Counter(
+    "basehook_updates_skipped",
+    "Updates skipped because a newer revision of their thread was consumed (coalesced)",
+    ("webhook",),
+)
+PENDING_UPDATES = Gauge(
+    "basehook_pending_updates",
+    "Number of pending updates",
+    ("webhook",),
+)
+OLDEST_PENDING_AGE_SECONDS = Gauge(
+    "basehook_oldest_pending_age_seconds",
+    "Age of the oldest pending update (lag)",
+    ("webhook",),
+)
+
+REGISTRY = [
+    INGEST_SECONDS,
+    POP_CLAIM_SECONDS,
+    POP_HANDLER_SECONDS,
+    POOL_WAIT_SECONDS,
+    UPDATES_SKIPPED,
+    PENDING_UPDATES,
+    OLDEST_PENDING_AGE_SECONDS,
+]
+
+
+def render(metrics: Iterable[Counter | Histogram | Gauge] = REGISTRY) -> str:
+    """Render the metrics in the OpenMetrics text format."""
+    lines = []
+    for metric in metrics:
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+        lines.extend(metric.samples())
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
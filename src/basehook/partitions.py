@@ -0,0 +1,156 @@
+import re
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from basehook.models import ThreadUpdateStatus, thread_update_table
+
+# Partition DDL locks the whole parent table (ACCESS EXCLUSIVE for DROP), so it gives up
+# rather than queueing behind long pop transactions and blocking every query queued after it
+DDL_LOCK_TIMEOUT = "5s"
+
+# e.g. "FOR VALUES FROM ('1700000000') TO ('1700086400')"
+_BOUNDS_RE = re.compile(r"FROM \('?([^')]+)'?\) TO \('?([^')]+)'?\)")
+
+
+@dataclass
+class Partition:
+    name: str
+    lower: float
+    upper: float
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    """Whether thread_update was created as a partitioned table."""
+    relkind = await conn.scalar(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": thread_update_table.name},
+    )
+    return relkind == "p"
+
+
+async def list_partitions(conn: AsyncConnection) -> list[Partition]:
+    """List the range partitions of thread_update, ordered by lower bound (default excluded)."""
+    result = await conn.execute(
+        text(
+            "SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bounds "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"
+        ),
+        {"table": thread_update_table.name},
+    )
+    partitions = []
+    for row in result.all():
+        match = _BOUNDS_RE.search(row.bounds or "")
+        if match:
+            partitions.append(Partition(row.name, float(match[1]), float(match[2])))
+    return sorted(partitions, key=lambda partition: partition.lower)
+
+
+async def create_default_partition(conn: AsyncConnection) -> None:
+    """
+    Catch-all partition, so inserts never fail if maintenance falls behind.
+    It should stay empty: a new partition cannot be created over rows sitting in it.
+    """
+    table = thread_update_table.name
+    await conn.execute(
+        text(f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{table}" DEFAULT')
+    )
+
+
+async def create_partitions(
+    conn: AsyncConnection, interval_in_seconds: float, *, ahead: int = 2
+) -> list[str]:
+    """
+    Create the partition holding the current time and the `ahead` next ones.
+    Ranges overlapping an existing partition (e.g. after an interval change) are left out.
+
+    Returns:
+        Names of the created partitions.
+    """
+    table = thread_update_table.name
+    existing = await list_partitions(conn)
+    current = (time.time() // interval_in_seconds) * interval_in_seconds
+
+    created = []
+    for i in range(ahead + 1):
+        lower = current + i * interval_in_seconds
+        upper = lower + interval_in_seconds
+        if any(p.lower < upper and lower < p.upper for p in existing):
+            continue
+
+        name = f"{table}_p{int(lower)}"
+        bounds = f"FOR VALUES FROM ({lower!r}) TO ({upper!r})"
+        if await _default_rows_between(conn, lower, upper):
+            await _create_from_default(conn, name, bounds, lower, upper)
+        else:
+            await conn.execute(
+                text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" {bounds}')
+            )
+        created.append(name)
+    return created
+
+
+async def _default_rows_between(conn: AsyncConnection, lower: float, upper: float) -> bool:
+    table = thread_update_table.name
+    return await conn.scalar(
+        text(
+            f'SELECT EXISTS (SELECT 1 FROM "{table}_default" '
+            "WHERE timestamp >= :lower AND timestamp < :upper)"
+        ),
+        {"lower": lower, "upper": upper},
+    )
+
+
+async def _create_from_default(
+    conn: AsyncConnection, name: str, bounds: str, lower: float, upper: float
+) -> None:
+    """
+    Create a partition over rows that landed in the default partition, which Postgres refuses
+    with CREATE TABLE ... PARTITION OF. The rows are moved into a standalone table, which is
+    then attached. Nothing is inserted through thread_update, so the status triggers do not
+    count the moved rows twice.
+    """
+    table = thread_update_table.name
+    await conn.execute(
+        text(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    )
+    await conn.execute(
+        text(
+            f'WITH moved AS (DELETE FROM "{table}_default" '
+            "WHERE timestamp >= :lower AND timestamp < :upper RETURNING *) "
+            f'INSERT INTO "{name}" SELECT * FROM moved'
+        ),
+        {"lower": lower, "upper": upper},
+    )
+    await conn.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" {bounds}'))
+
+
+async def drop_expired_partitions(conn: AsyncConnection, retention_in_seconds: float) -> list[str]:
+    """
+    Drop partitions whose whole range is older than the retention. Unlike a DELETE, this is
+    instant and leaves no dead tuples behind for vacuum.
+
+    Partitions still holding PENDING or ERROR updates are kept, like per-webhook retention
+    only deletes processed updates. They are dropped by a later run once processed.
+
+    Returns:
+        Names of the dropped partitions.
+    """
+    cutoff = time.time() - retention_in_seconds
+    dropped = []
+    for partition in await list_partitions(conn):
+        if partition.upper > cutoff:
+            continue
+        unprocessed = await conn.scalar(
+            text(f'SELECT count(*) FROM "{partition.name}" WHERE status::text = ANY(:statuses)'),
+            {"statuses": [ThreadUpdateStatus.PENDING.name, ThreadUpdateStatus.ERROR.name]},
+        )
+        if unprocessed:
+            print(f"✗ Kept expired partition {partition.name}: {unprocessed} unprocessed updates")
+            continue
+        await conn.execute(text(f'DROP TABLE IF EXISTS "{partition.name}"'))
+        dropped.append(partition.name)
+    return dropped
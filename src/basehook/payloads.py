@@ -0,0 +1,130 @@
+import asyncio
+from typing import Any
+from uuid import uuid4
+
+from sqlalchemy import and_, delete, exists, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from basehook.compression import DEFAULT_ENCODING, compress, decompress
+from basehook.jsoncodec import RawJSON, loads
+from basehook.models import thread_update_payload_table, thread_update_table
+
+# Key of the out-of-line payload reference in a thread update content
+PAYLOAD_KEY = "_basehook_payload"
+
+
+def payload_reference(content: Any) -> str | None:
+    """
+    Id of the out-of-line payload a content refers to, None if it has no reference. Bodies are
+    untrusted and may contain the key themselves: the reference is only resolved when the
+    payload row belongs to the update, see `load_payload`.
+    """
+    if isinstance(content, RawJSON):
+        # Only parsed when it may be a reference
+        return payload_reference(content.json()) if PAYLOAD_KEY in content.text else None
+    if not isinstance(content, dict):
+        return None
+    reference = content.get(PAYLOAD_KEY)
+    if isinstance(reference, dict) and isinstance(reference.get("id"), str):
+        return reference["id"]
+    return None
+
+
+def is_offloaded(content: Any) -> bool:
+    return payload_reference(content) is not None
+
+
+def _project(content: Any, paths: list[list[str]]) -> dict[str, Any]:
+    """Copy of `content` restricted to the given paths, missing paths are left out."""
+    projection: dict[str, Any] = {}
+    for path in paths:
+        value = content
+        try:
+            for key in path:
+                value = value[int(key)] if key.isdigit() and isinstance(value, list) else value[key]
+        except (KeyError, IndexError, TypeError):
+            continue
+        target = projection
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+            if not isinstance(target, dict):
+                break
+        else:
+            target[path[-1]] = value
+    return projection
+
+
+async def offload_payload(
+    body: bytes, content: Any, paths: list[list[str]]
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """
+    Split a large body into the content kept inline (the values at `paths`, e.g. the thread id
+    and revision number, plus a reference) and the compressed payload row.
+
+    Returns:
+        The inline content, and the values of the payload row without its update_id.
+    """
+    payload_id = str(uuid4())
+    encoding = DEFAULT_ENCODING
+    # The raw body is stored as received, compression runs off the event loop
+    data = await asyncio.to_thread(compress, body, encoding)
+    inline = _project(content, [path for path in paths if path])
+    inline[PAYLOAD_KEY] = {"id": payload_id, "size": len(body), "encoding": encoding}
+    return inline, {"id": payload_id, "encoding": encoding, "size": len(body), "data": data}
+
+
+async def load_payload(conn: AsyncConnection, content: Any, update_id: int) -> Any:
+    """
+    Full content of a thread update: its out-of-line payload if offloaded, the content itself
+    otherwise. The inline content is returned if the payload was pruned, or if the reference
+    does not match a payload of this update (e.g. a body sending the key itself). A `RawJSON`
+    content gets its payload as a `RawJSON` too.
+    """
+    return (await load_payloads(conn, {update_id: content}))[update_id]
+
+
+async def load_payloads(conn: AsyncConnection, contents: dict[int, Any]) -> dict[int, Any]:
+    """Batch version of `load_payload`, by update id, in a single round trip at most."""
+    references = {
+        update_id: reference
+        for update_id, content in contents.items()
+        if (reference := payload_reference(content)) is not None
+    }
+    if not references:
+        return contents
+
+    payload = thread_update_payload_table
+    rows = await conn.execute(
+        select(payload.c.update_id, payload.c.encoding, payload.c.data).where(
+            tuple_(payload.c.id, payload.c.update_id).in_(
+                [(reference, update_id) for update_id, reference in references.items()]
+            )
+        )
+    )
+    loaded = dict(contents)
+    for row in rows:
+        data = await asyncio.to_thread(decompress, row.data, row.encoding)
+        loaded[row.update_id] = (
+            RawJSON(data) if isinstance(contents[row.update_id], RawJSON) else loads(data)
+        )
+    return loaded
+
+
+async def prune_orphan_payloads(engine: AsyncEngine) -> int:
+    """
+    Delete the payloads whose update was deleted (retention, archive, dropped partition) or had
+    its content stripped. Returns the number of payloads deleted.
+    """
+    payload = thread_update_payload_table
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            delete(payload).where(
+                ~exists().where(
+                    and_(
+                        thread_update_table.c.id == payload.c.update_id,
+                        thread_update_table.c.content.isnot(None),
+                    )
+                )
+            )
+        )
+        return result.rowcount
@@ -0,0 +1,153 @@
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import func, select, true, union_all
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from basehook.models import (
+    ThreadUpdateStatus,
+    thread_update_delta_table,
+    thread_update_drain_delta_table,
+    thread_update_drain_table,
+    thread_update_rollup_table,
+    thread_update_table,
+    webhook_table,
+)
+from basehook.rollup import ROLLUP_SECONDS
+
+
+@dataclass
+class QueueStats:
+    webhook_name: str
+    depth: int  # Pending updates, counted up to the depth limit of each priority
+    depth_capped: bool  # The depth limit was reached, depth is a lower bound
+    oldest_pending_timestamp: float | None
+    ingest_rate: float  # Updates received per second
+    drain_rate: float  # Updates leaving PENDING per second
+
+
+async def get_queue_stats(
+    conn: AsyncConnection, *, rate_window_in_seconds: int = 300, depth_limit: int = 10000
+) -> list[QueueStats]:
+    """
+    Depth, age and rates of every webhook queue.
+
+    Depth and oldest pending timestamp are probes of the claim index: a skip scan walks the
+    distinct (webhook, priority) lanes with pending updates, then each lane counts at most
+    `depth_limit` entries in timestamp order, so the first one is its oldest. The cost is
+    bounded by the number of lanes, not by the backlog. Rates are read from the minute rollups
+    over the last `rate_window_in_seconds`, plus the deltas not folded yet.
+    """
+    now = time.time()
+    # Whole minutes plus the current one, rates are averaged over the time actually covered
+    cutoff = (int(now) // ROLLUP_SECONDS * ROLLUP_SECONDS) - rate_window_in_seconds
+    elapsed = now - cutoff
+
+    webhook_names = (await conn.execute(select(webhook_table.c.name))).scalars().all()
+    stats = {name: QueueStats(name, 0, False, None, 0.0, 0.0) for name in sorted(webhook_names)}
+
+    for row in await conn.execute(_pending_query(depth_limit)):
+        # Updates of a deleted webhook are still reported
+        queue = stats.setdefault(
+            row.webhook_name, QueueStats(row.webhook_name, 0, False, None, 0.0, 0.0)
+        )
+        queue.depth = int(row.depth)
+        queue.depth_capped = row.capped
+        queue.oldest_pending_timestamp = row.oldest
+
+    # Every update counts once in the rollup of its ingest minute, whatever its status
+    rollup, delta = thread_update_rollup_table, thread_update_delta_table
+    ingested = union_all(
+        select(rollup.c.webhook_name, rollup.c.count).where(rollup.c.minute >= cutoff),
+        select(delta.c.webhook_name, delta.c.delta).where(delta.c.minute >= cutoff),
+    ).subquery()
+    drain, drain_delta = thread_update_drain_table, thread_update_drain_delta_table
+    drained = union_all(
+        select(drain.c.webhook_name, drain.c.count).where(drain.c.minute >= cutoff),
+        select(drain_delta.c.webhook_name, func.count())
+        .where(drain_delta.c.minute >= cutoff)
+        .group_by(drain_delta.c.webhook_name),
+    ).subquery()
+
+    for source, attribute in [(ingested, "ingest_rate"), (drained, "drain_rate")]:
+        rows = await conn.execute(
+            select(source.c.webhook_name, func.sum(source.c.count)).group_by(source.c.webhook_name)
+        )
+        for name, total in rows:
+            if name in stats:
+                setattr(stats[name], attribute, float(total) / elapsed)
+
+    return list(stats.values())
+
+
+def _pending_query(depth_limit: int):
+    """
+    Build a query returning (webhook_name, depth, capped, oldest) for the webhooks with pending
+    updates, as index seeks on ix_thread_update_claim_pending (webhook, priority, timestamp).
+    """
+    updates = thread_update_table
+    pending = updates.c.status == ThreadUpdateStatus.PENDING
+
+    # Distinct webhooks with pending updates, one seek each
+    names = select(
+        select(func.min(updates.c.webhook_name)).where(pending).scalar_subquery().label("name")
+    ).cte("names", recursive=True)
+    names = names.union_all(
+        select(
+            select(func.min(updates.c.webhook_name))
+            .where(pending, updates.c.webhook_name > names.c.name)
+            .scalar_subquery()
+        ).where(names.c.name.is_not(None))
+    )
+
+    # Distinct priorities of each of them, highest first
+    lanes = (
+        select(
+            names.c.name,
+            select(func.max(updates.c.priority))
+            .where(pending, updates.c.webhook_name == names.c.name)
+            .scalar_subquery()
+            .label("priority"),
+        )
+        .where(names.c.name.is_not(None))
+        .cte("lanes", recursive=True)
+    )
+    lanes = lanes.union_all(
+        select(
+            lanes.c.name,
+            select(func.max(updates.c.priority))
+            .where(
+                pending,
+                updates.c.webhook_name == lanes.c.name,
+                updates.c.priority < lanes.c.priority,
+            )
+            .scalar_subquery(),
+        ).where(lanes.c.priority.is_not(None))
+    )
+
+    lane = (
+        select(updates.c.timestamp)
+        .where(
+            pending, updates.c.webhook_name == lanes.c.name, updates.c.priority == lanes.c.priority
+        )
+        .order_by(updates.c.timestamp)
+        .limit(depth_limit)
+        .lateral("lane")
+    )
+    per_lane = (
+        select(
+            lanes.c.name,
+            func.count().label("depth"),
+            func.min(lane.c.timestamp).label("oldest"),
+        )
+        .select_from(lanes.join(lane, true()))
+        .where(lanes.c.priority.is_not(None))
+        .group_by(lanes.c.name, lanes.c.priority)
+        .subquery()
+    )
+    return select(
+        per_lane.c.name.label("webhook_name"),
+        func.sum(per_lane.c.depth).label("depth"),
+        func.bool_or(per_lane.c.depth >= depth_limit).label("capped"),
+        func.min(per_lane.c.oldest).label("oldest"),
+    ).group_by(per_lane.c.name)
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import Select, delete, func, literal_column, null, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.models import ThreadUpdateStatus, thread_update_table, webhook_table
+
+# Arbitrary key for pg_try_advisory_lock, only one node runs retention at a time
+RETENTION_LOCK_ID = 0x6261736568000001
+
+
+@dataclass
+class RetentionReport:
+    """Summary of a retention run."""
+
+    rows_deleted: int = 0
+    rows_stripped: int = 0
+    bytes_reclaimed: int = 0
+
+
+async def run_retention(
+    engine: AsyncEngine, *, batch_size: int = 1000, pause_in_seconds: float = 0.0
+) -> RetentionReport | None:
+    """
+    Apply the per-webhook retention policies to `thread_update`.
+
+    Policies are read from the webhook table:
+    - `retention_days`: delete SUCCESS and SKIPPED rows older than this value.
+    - `skipped_content_retention_days`: keep SKIPPED rows but null out their content.
+
+    Rows are processed in small batches of consecutive primary keys, each in its own
+    transaction, so locks are short-lived and the claim path is never blocked for long.
+    Only one node runs retention at a time, guarded by an advisory lock.
+
+    Args:
+        batch_size: maximum number of rows touched per transaction.
+        pause_in_seconds: sleep between batches to spread the load.
+
+    Returns:
+        The rows and bytes reclaimed, or None if another node is already running retention.
+    """
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = await lock_conn.scalar(select(func.pg_try_advisory_lock(RETENTION_LOCK_ID)))
+        if not locked:
+            return None
+
+        try:
+            report = RetentionReport()
+            async with engine.begin() as conn:
+                webhooks = (
+                    await conn.execute(
+                        select(
+                            webhook_table.c.name,
+                            webhook_table.c.retention_days,
+                            webhook_table.c.skipped_content_retention_days,
+                        ).where(
+                            (webhook_table.c.retention_days.isnot(None))
+                            | (webhook_table.c.skipped_content_retention_days.isnot(None))
+                        )
+                    )
+                ).all()
+
+            now = time.time()
+            for webhook in webhooks:
+                if webhook.retention_days is not None:
+                    rows, size = await _delete_expired(
+                        engine,
+                        webhook.name,
+                        cutoff=now - webhook.retention_days * 24 * 3600,
+                        batch_size=batch_size,
+                        pause_in_seconds=pause_in_seconds,
+                    )
+                    report.rows_deleted += rows
+                    report.bytes_reclaimed += size
+
+                if webhook.skipped_content_retention_days is not None:
+                    rows, size = await _strip_skipped_content(
+                        engine,
+                        webhook.name,
+                        cutoff=now - webhook.skipped_content_retention_days * 24 * 3600,
+                        batch_size=batch_size,
+                        pause_in_seconds=pause_in_seconds,
+                    )
+                    report.rows_stripped += rows
+                    report.bytes_reclaimed += size
+
+            return report
+        finally:
+            await lock_conn.execute(select(func.pg_advisory_unlock(RETENTION_LOCK_ID)))
+
+
+async def _run_in_batches(
+    engine: AsyncEngine,
+    candidates: Select,
+    apply,
+    *,
+    batch_size: int,
+    pause_in_seconds: float,
+) -> tuple[int, int]:
+    """
+    Walk `candidates` (selecting `id` and a `size` column) in primary key order and call
+    `apply(conn, first_id, last_id)` on each batch. Returns the total rows and bytes.
+    """
+    total_rows = 0
+    total_bytes = 0
+    last_id = None
+
+    while True:
+        async with engine.begin() as conn:
+            query = candidates.order_by(thread_update_table.c.id.asc()).limit(batch_size)
+            if last_id is not None:
+                query = query.where(thread_update_table.c.id > last_id)
+            batch = (await conn.execute(query)).all()
+            if not batch:
+                return total_rows, total_bytes
+
+            first_id, last_id = batch[0].id, batch[-1].id
+            total_rows += await apply(conn, first_id, last_id)
+            total_bytes += sum(row.size or 0 for row in batch)
+
+        if pause_in_seconds:
+            await asyncio.sleep(pause_in_seconds)
+
+
+async def _delete_expired(
+    engine: AsyncEngine,
+    webhook_name: str,
+    *,
+    cutoff: float,
+    batch_size: int,
+    pause_in_seconds: float,
+) -> tuple[int, int]:
+    filters = [
+        thread_update_table.c.webhook_name == webhook_name,
+        thread_update_table.c.status.in_([ThreadUpdateStatus.SUCCESS, ThreadUpdateStatus.SKIPPED]),
+        thread_update_table.c.timestamp < cutoff,
+    ]
+
+    async def apply(conn, first_id, last_id):
+        result = await conn.execute(
+            delete(thread_update_table).where(
+                *filters, thread_update_table.c.id.between(first_id, last_id)
+            )
+        )
+        return result.rowcount
+
+    return await _run_in_batches(
+        engine,
+        select(
+            thread_update_table.c.id,
+            func.pg_column_size(literal_column(f"{thread_update_table.name}.*")).label("size"),
+        ).where(*filters),
+        apply,
+        batch_size=batch_size,
+        pause_in_seconds=pause_in_seconds,
+    )
+
+
+async def _strip_skipped_content(
+    engine: AsyncEngine,
+    webhook_name: str,
+    *,
+    cutoff: float,
+    batch_size: int,
+    pause_in_seconds: float,
+) -> tuple[int, int]:
+    filters = [
+        thread_update_table.c.webhook_name == webhook_name,
+        thread_update_table.c.status == ThreadUpdateStatus.SKIPPED,
+        thread_update_table.c.timestamp < cutoff,
+        thread_update_table.c.content.isnot(None),
+    ]
+
+    async def apply(conn, first_id, last_id):
+        result = await conn.execute(
+            update(thread_update_table)
+            .where(*filters, thread_update_table.c.id.between(first_id, last_id))
+            .values(content=null())
+        )
+        return result.rowcount
+
+    return await _run_in_batches(
+        engine,
+        select(
+            thread_update_table.c.id,
+            func.pg_column_size(thread_update_table.c.content).label("size"),
+        ).where(*filters),
+        apply,
+        batch_size=batch_size,
+        pause_in_seconds=pause_in_seconds,
+    )
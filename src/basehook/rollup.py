@@ -0,0 +1,227 @@
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    ColumnElement,
+    String,
+    Table,
+    func,
+    literal,
+    select,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.models import (
+    thread_update_delta_table,
+    thread_update_drain_delta_table,
+    thread_update_drain_table,
+    thread_update_rollup_table,
+    thread_update_table,
+)
+
+# Granularity of the rollup, coarser windows are derived from it
+ROLLUP_SECONDS = 60
+
+# SQLSTATE of a REPEATABLE READ transaction conflicting with a concurrent one
+SERIALIZATION_FAILURE = "40001"
+
+
+async def fold_deltas(engine: AsyncEngine, *, batch_size: int = 100000) -> int:
+    """
+    Fold the pending deltas into the rollup tables, up to the max delta id seen when starting.
+    Deltas are moved with DELETE ... RETURNING, so concurrent folds never count one twice.
+
+    Args:
+        engine: The engine to run on
+        batch_size: Range of delta ids folded per transaction
+
+    Returns:
+        The number of rollup rows touched
+    """
+    delta = thread_update_delta_table
+    drain_delta = thread_update_drain_delta_table
+    touched = await _fold(
+        engine,
+        delta,
+        thread_update_rollup_table,
+        [delta.c.webhook_name, delta.c.status, delta.c.minute],
+        delta.c.delta,
+        batch_size=batch_size,
+    )
+    touched += await _fold(
+        engine,
+        drain_delta,
+        thread_update_drain_table,
+        [drain_delta.c.webhook_name, drain_delta.c.minute],
+        literal(1),
+        batch_size=batch_size,
+    )
+    return touched
+
+
+async def _fold(
+    engine: AsyncEngine,
+    delta: Table,
+    rollup: Table,
+    keys: list[Column],
+    increment: ColumnElement,
+    *,
+    batch_size: int,
+) -> int:
+    """Move the rows of an append-only delta table into its rollup, summing `increment`."""
+    touched = 0
+
+    async with engine.begin() as conn:
+        bounds = (await conn.execute(select(func.min(delta.c.id), func.max(delta.c.id)))).one()
+    lowest, highest = bounds
+    if lowest is None:
+        return 0
+
+    key_names = [key.name for key in keys]
+    for start in range(lowest, highest + 1, batch_size):
+        end = min(start + batch_size - 1, highest)
+        async with engine.begin() as conn:
+            moved = (
+                delta.delete()
+                .where(delta.c.id.between(start, end))
+                .returning(*keys, increment.label("increment"))
+                .cte("moved")
+            )
+            moved_keys = [moved.c[name] for name in key_names]
+            stmt = insert(rollup).from_select(
+                [*key_names, "count"],
+                select(*moved_keys, func.sum(moved.c.increment)).group_by(*moved_keys),
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_names,
+                set_={"count": rollup.c.count + stmt.excluded["count"]},
+            )
+            result = await conn.execute(stmt)
+            touched += max(result.rowcount, 0)
+
+    return touched
+
+
+async def rebuild_rollup(engine: AsyncEngine, *, batch_seconds: int = 24 * 3600) -> None:
+    """
+    Recompute the rollup from thread_update, for databases created before the trigger existed.
+
+    Works in batches of `batch_seconds` of ingest time, each one a REPEATABLE READ transaction
+    replacing the rollup rows and the pending deltas of its minutes with counts taken from the
+    same snapshot. Writers are not blocked: deltas committed after the snapshot are not visible
+    to the batch, so they are kept and folded later. A batch conflicting with a concurrent fold
+    is retried.
+
+    Args:
+        engine: The engine to run on
+        batch_seconds: Range of ingest time recomputed per transaction
+    """
+    rollup = thread_update_rollup_table
+    delta = thread_update_delta_table
+    async with engine.connect() as conn:
+        bounds = (
+            await conn.execute(
+                select(
+                    func.least(
+                        select(func.min(thread_update_table.c.timestamp)).scalar_subquery(),
+                        select(func.min(rollup.c.minute)).scalar_subquery(),
+                        select(func.min(delta.c.minute)).scalar_subquery(),
+                    ),
+                    func.greatest(
+                        select(func.max(thread_update_table.c.timestamp)).scalar_subquery(),
+                        select(func.max(rollup.c.minute)).scalar_subquery(),
+                        select(func.max(delta.c.minute)).scalar_subquery(),
+                    ),
+                )
+            )
+        ).one()
+    lowest, highest = bounds
+    if lowest is None:
+        return
+
+    batch_seconds = max(batch_seconds // ROLLUP_SECONDS, 1) * ROLLUP_SECONDS
+    start = int(lowest // ROLLUP_SECONDS) * ROLLUP_SECONDS
+    while start <= highest:
+        while True:
+            try:
+                await _rebuild_minutes(engine, start, start + batch_seconds)
+                break
+            except DBAPIError as e:
+                if getattr(e.orig, "sqlstate", None) != SERIALIZATION_FAILURE:
+                    raise
+        start += batch_seconds
+
+
+async def _rebuild_minutes(engine: AsyncEngine, start: int, end: int) -> None:
+    """Replace the rollup and the deltas of the minutes in [start, end) from a single snapshot."""
+    rollup = thread_update_rollup_table
+    delta = thread_update_delta_table
+    minute = (func.floor(thread_update_table.c.timestamp / ROLLUP_SECONDS) * ROLLUP_SECONDS).cast(
+        BigInteger
+    )
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+        async with conn.begin():
+            await conn.execute(delta.delete().where(delta.c.minute >= start, delta.c.minute < end))
+            await conn.execute(
+                rollup.delete().where(rollup.c.minute >= start, rollup.c.minute < end)
+            )
+            await conn.execute(
+                insert(rollup).from_select(
+                    ["webhook_name", "status", "minute", "count"],
+                    select(
+                        thread_update_table.c.webhook_name,
+                        thread_update_table.c.status.cast(String),
+                        minute,
+                        func.count(),
+                    )
+                    .where(
+                        thread_update_table.c.timestamp >= start,
+                        thread_update_table.c.timestamp < end,
+                    )
+                    .group_by(
+                        thread_update_table.c.webhook_name, thread_update_table.c.status, minute
+                    ),
+                )
+            )
+
+
+def windowed_counts(window_in_seconds: int, cutoff: int, webhook_name: str | None = None):
+    """
+    Build a query returning (webhook_name, status, window_start, count) from the rollup plus the
+    deltas not folded yet, so the result is exact without waiting for the next fold.
+
+    Args:
+        window_in_seconds: Bucket size, a multiple of ROLLUP_SECONDS
+        cutoff: Only buckets starting at or after this timestamp are returned
+        webhook_name: Restrict to a single webhook
+    """
+    rollup = thread_update_rollup_table
+    delta = thread_update_delta_table
+    rollup_query = select(
+        rollup.c.webhook_name, rollup.c.status, rollup.c.minute, rollup.c.count.label("count")
+    ).where(rollup.c.minute >= cutoff)
+    delta_query = select(
+        delta.c.webhook_name,
+        delta.c.status,
+        delta.c.minute,
+        delta.c.delta.cast(BigInteger).label("count"),
+    ).where(delta.c.minute >= cutoff)
+    if webhook_name is not None:
+        rollup_query = rollup_query.where(rollup.c.webhook_name == webhook_name)
+        delta_query = delta_query.where(delta.c.webhook_name == webhook_name)
+    sources = union_all(rollup_query, delta_query).subquery()
+
+    window = (sources.c.minute // window_in_seconds) * window_in_seconds
+    return (
+        select(
+            sources.c.webhook_name,
+            sources.c.status,
+            window.label("window_start"),
+            func.sum(sources.c.count).cast(BigInteger).label("count"),
+        )
+        .group_by(sources.c.webhook_name, sources.c.status, window)
+        .order_by(window)
+    )
@@ -0,0 +1,143 @@
+import asyncio
+import json
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from basehook.models import UPDATES_CHANNEL
+
+
+@dataclass(eq=False)
+class Subscription:
+    """
+    Updates matching the filters are queued until the client reads them. When the queue is
+    full, the client is too slow: it is dropped and None is queued to end its stream.
+    """
+
+    webhook_name: str | None = None
+    statuses: frozenset[str] | None = None  # ThreadUpdateStatus names
+    max_buffered: int = 1000
+    queue: asyncio.Queue = field(init=False)
+    dropped: bool = False
+
+    def __post_init__(self):
+        # One extra slot so the end of stream marker always fits
+        self.queue = asyncio.Queue(maxsize=self.max_buffered + 1)
+
+    def matches(self, update: dict[str, Any]) -> bool:
+        if self.webhook_name is not None and update["webhook_name"] != self.webhook_name:
+            return False
+        return self.statuses is None or update["status"] in self.statuses
+
+
+class UpdateBroadcaster:
+    """
+    Fan out the notifications of the thread_update trigger to in-process subscribers.
+
+    A single connection LISTENs for every subscriber, it is opened with the first subscription
+    and re-opened if lost. Notifications are dispatched without awaiting, a slow subscriber is
+    dropped instead of holding back the others.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        *,
+        reconnect_delay_in_seconds: float = 1.0,
+        connect_timeout_in_seconds: float = 10.0,
+    ):
+        self.engine = engine
+        self.reconnect_delay_in_seconds = reconnect_delay_in_seconds
+        self.connect_timeout_in_seconds = connect_timeout_in_seconds
+        self._subscriptions: set[Subscription] = set()
+        self._listener: asyncio.Task | None = None
+        self._listening = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    async def subscribe(
+        self,
+        *,
+        webhook_name: str | None = None,
+        statuses: Iterable[str] | None = None,
+        max_buffered: int = 1000,
+    ) -> Subscription:
+        """
+        Register a subscription, returns once the notifications are being listened to.
+        Raises asyncio.TimeoutError if the listening connection cannot be opened.
+        """
+        subscription = Subscription(
+            webhook_name=webhook_name,
+            statuses=frozenset(statuses) if statuses else None,
+            max_buffered=max_buffered,
+        )
+        self._subscriptions.add(subscription)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._listening.wait(), self.connect_timeout_in_seconds)
+        except asyncio.TimeoutError:
+            self.unsubscribe(subscription)
+            raise
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        for subscription in list(self._subscriptions):
+            self._drop(subscription)
+
+    def dispatch(self, payload: str) -> None:
+        """Queue a notification payload for every matching subscription."""
+        update = json.loads(payload)
+        for subscription in list(self._subscriptions):
+            if not subscription.matches(update):
+                continue
+            if subscription.queue.qsize() >= subscription.max_buffered:
+                self._drop(subscription)
+            else:
+                subscription.queue.put_nowait(update)
+
+    def _drop(self, subscription: Subscription) -> None:
+        subscription.dropped = True
+        self._subscriptions.discard(subscription)
+        subscription.queue.put_nowait(None)
+
+    def _on_notification(self, _connection, _pid, _channel, payload: str) -> None:
+        self.dispatch(payload)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.engine.connect() as conn:
+                    raw_connection = await conn.get_raw_connection()
+                    driver_connection = raw_connection.driver_connection
+                    lost = asyncio.Event()
+
+                    def on_lost(_connection, lost=lost):
+                        lost.set()
+
+                    driver_connection.add_termination_listener(on_lost)
+                    await driver_connection.add_listener(UPDATES_CHANNEL, self._on_notification)
+                    self._listening.set()
+                    try:
+                        await lost.wait()
+                    finally:
+                        self._listening.clear()
+                        driver_connection.remove_termination_listener(on_lost)
+                        if not driver_connection.is_closed():
+                            await driver_connection.remove_listener(
+                                UPDATES_CHANNEL, self._on_notification
+                            )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"✗ Update stream listener failed: {e}")
+            # Notifications sent while reconnecting are lost, clients resync with /api/query
+            await asyncio.sleep(self.reconnect_delay_in_seconds)
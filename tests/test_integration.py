@@ -1,4 +1,11 @@
+import asyncio
+import base64
+import csv
+import io
+import json
 import os
+import random
+import re
 import time
 from collections.abc import AsyncGenerator
 from typing import Any
@@ -7,18 +14,36 @@ import pytest
 import pytest_asyncio
 from asgi_lifespan import LifespanManager
 from httpx import ASGITransport, AsyncClient
-from sqlalchemy import select
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
+import basehook.api as api
+import basehook.migrations as migrations
 from basehook import Basehook
-from basehook.api import app
+from basehook.api import app, apply_filters_to_query, recent_deliveries
+from basehook.backends import MemoryBackend, PostgresBackend, SQLiteBackend, StorageBackend
+from basehook.cache import AsyncTTLCache
+from basehook.instrumentation import (
+    IngestTrace,
+    Instrumentation,
+    PopTrace,
+    install_round_trip_counter,
+)
+from basehook.jsoncodec import RawJSON
+from basehook.migrations import LATEST_VERSION, migrate, schema_version
 from basehook.models import (
     ThreadUpdateStatus,
     metadata,
+    rate_limit_bucket_table,
     thread_table,
     thread_update_table,
     webhook_table,
 )
+from basehook.partitions import is_partitioned, list_partitions
+from basehook.payloads import PAYLOAD_KEY
+from basehook.queues import get_queue_stats
+from basehook.stream import UpdateBroadcaster
 
 
 @pytest.fixture
@@ -303,3 +328,1441 @@ async def test_pop_first_revision(client: AsyncClient, basehook: Basehook) -> No
     thread = await get_thread(basehook, "test", "thread-5")
     assert thread is not None
     assert thread.last_revision_number is None
+
+
+@pytest.mark.asyncio
+async def test_pop_priority(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test priority lanes:
+    - Configure a webhook deriving priority from the payload
+    - Push low priority updates, then an urgent one
+    - Make sure the urgent update is popped first
+    """
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.insert().values(
+                name="prioritized",
+                thread_id_path=["thread_id"],
+                revision_number_path=["revision"],
+                priority_path=["type"],
+                priority_map={"payment_failed": 10},
+            )
+        )
+
+    for i in range(3):
+        response = await client.post(
+            "/webhooks/prioritized",
+            json={"thread_id": f"low-{i}", "revision": 1.0, "type": "page_view"},
+        )
+        assert response.status_code == 200
+    response = await client.post(
+        "/webhooks/prioritized",
+        json={"thread_id": "urgent", "revision": 1.0, "type": "payment_failed"},
+    )
+    assert response.status_code == 200
+
+    updates = await get_thread_updates(basehook, "prioritized", "urgent")
+    assert updates[0].priority == 10
+
+    async with basehook.pop("prioritized") as update:
+        assert update is not None
+        assert update["thread_id"] == "urgent"
+
+    # remaining lanes are drained oldest first
+    async with basehook.pop("prioritized") as update:
+        assert update is not None
+        assert update["thread_id"] == "low-0"
+
+
+@pytest.mark.asyncio
+async def test_pop_weighted_fallback(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test weighted priority claims:
+    - Lock the only update of the low priority lane
+    - Make sure a weighted pop drawing that lane falls back to the urgent lane
+    - Make sure a priority map with non-integer priorities is rejected
+    """
+    response = await client.post(
+        "/api/webhooks",
+        json={
+            "name": "invalid-map",
+            "thread_id_path": ["thread_id"],
+            "revision_number_path": ["revision"],
+            "priority_map": {"payment_failed": "high"},
+        },
+    )
+    assert response.status_code == 400
+
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.insert().values(
+                name="weighted",
+                thread_id_path=["thread_id"],
+                revision_number_path=["revision"],
+                priority_path=["priority"],
+            )
+        )
+    for thread_id, priority in [("low", 0), ("urgent", 10)]:
+        response = await client.post(
+            "/webhooks/weighted",
+            json={"thread_id": thread_id, "revision": 1.0, "priority": priority},
+        )
+        assert response.status_code == 200
+
+    async with test_engine.connect() as lock_conn:
+        await lock_conn.execute(
+            select(thread_update_table.c.id)
+            .where(thread_update_table.c.thread_id == "low")
+            .with_for_update()
+        )
+        async with basehook.pop("weighted", priority_mode="weighted") as update:
+            assert update is not None
+            assert update["thread_id"] == "urgent"
+        await lock_conn.rollback()
+
+
+@pytest.mark.asyncio
+async def test_pop_weighted_shares(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test weighted priority shares:
+    - Push a backlog in a low (0) and an urgent (10) lane
+    - Make sure weighted pops drain both, the urgent lane getting most of them
+    - Make sure priorities out of the column range are clamped, invalid ones use the default
+    """
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.insert().values(
+                name="shares",
+                thread_id_path=["thread_id"],
+                revision_number_path=["revision"],
+                priority_path=["priority"],
+            )
+        )
+    for index in range(60):
+        for priority in [0, 10]:
+            response = await client.post(
+                "/webhooks/shares",
+                json={"thread_id": f"{priority}-{index}", "revision": 1.0, "priority": priority},
+            )
+            assert response.status_code == 200
+
+    random.seed(26)
+    popped = {0: 0, 10: 0}
+    for _ in range(60):
+        async with basehook.pop("shares", priority_mode="weighted") as update:
+            popped[update["priority"]] += 1
+    # Weights 1 and 11: the urgent lane is drawn 11 times out of 12 on average
+    assert popped[0] > 0
+    assert popped[10] > 40
+
+    for thread_id, priority in [("huge", 1e30), ("negative", -(2**40)), ("text", "Infinity")]:
+        response = await client.post(
+            "/webhooks/shares", json={"thread_id": thread_id, "revision": 1.0, "priority": priority}
+        )
+        assert response.status_code == 200
+    async with test_engine.begin() as conn:
+        rows = await conn.execute(
+            select(thread_update_table.c.thread_id, thread_update_table.c.priority).where(
+                thread_update_table.c.thread_id.in_(["huge", "negative", "text"])
+            )
+        )
+        assert dict(rows.all()) == {"huge": 2**31 - 1, "negative": -(2**31), "text": 0}
+
+
+@pytest.mark.asyncio
+async def test_pop_rate_limit(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test shared rate limit:
+    - Push two updates
+    - Pop with a budget of one update per minute
+    - Make sure the second pop is throttled and the update stays PENDING
+    """
+    for thread_id in ["rate-1", "rate-2"]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": thread_id, "revision": 1.0, "data": "rate limited"},
+        )
+        assert response.status_code == 200
+
+    async with basehook.pop("test", rate_limit=1 / 60, rate_limit_burst=1) as update:
+        assert update is not None
+
+    async with basehook.pop("test", rate_limit=1 / 60, rate_limit_burst=1) as update:
+        assert update is None
+
+    updates = await get_thread_updates(basehook, "test", "rate-2")
+    assert updates[0].status == ThreadUpdateStatus.PENDING
+
+
+@pytest.mark.asyncio
+async def test_pop_rate_limit_single_connection(
+    client: AsyncClient, test_engine: AsyncEngine
+) -> None:
+    """
+    Test rate limited pops on a pool of a single connection:
+    - Make sure an empty pop gives its token back
+    - Make sure concurrent pops do not wait for a second connection while holding one
+    """
+    url = test_engine.url.render_as_string(hide_password=False)
+    basehook = Basehook(database_url=url)
+    await basehook.engine.dispose()
+    basehook.engine = create_async_engine(url, pool_size=1, max_overflow=0, pool_timeout=5)
+
+    async with basehook.pop("test", rate_limit=1 / 60, rate_limit_burst=2) as update:
+        assert update is None
+    async with test_engine.begin() as conn:
+        tokens = await conn.scalar(select(rate_limit_bucket_table.c.tokens))
+    assert tokens == 2
+
+    for thread_id in ["single-1", "single-2"]:
+        response = await client.post(
+            "/webhooks/test", json={"thread_id": thread_id, "revision": 1.0, "data": "single"}
+        )
+        assert response.status_code == 200
+
+    async def pop() -> Any:
+        async with basehook.pop("test", rate_limit=1 / 60, rate_limit_burst=2) as update:
+            return update
+
+    updates = await asyncio.wait_for(asyncio.gather(pop(), pop()), 10)
+    assert sorted(update["thread_id"] for update in updates) == ["single-1", "single-2"]
+    await basehook.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_retention(client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine) -> None:
+    """
+    Test retention policies:
+    - Insert old SUCCESS and PENDING updates
+    - Run retention with a small batch size
+    - Make sure SUCCESS rows are deleted and PENDING is untouched
+    - Make sure recent SKIPPED rows only get their content nulled out
+    """
+    old = time.time() - 10 * 24 * 3600
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.update()
+            .where(webhook_table.c.name == "test")
+            .values(retention_days=7, skipped_content_retention_days=1)
+        )
+        await conn.execute(
+            thread_update_table.insert(),
+            [
+                {
+                    "webhook_name": "test",
+                    "thread_id": "retention",
+                    "revision_number": float(i),
+                    "content": {"data": "x" * 100},
+                    "timestamp": old,
+                    "status": status,
+                }
+                for i, status in enumerate(
+                    [ThreadUpdateStatus.SUCCESS] * 5 + [ThreadUpdateStatus.PENDING]
+                )
+            ],
+        )
+
+    report = await basehook.run_retention(batch_size=2)
+    assert report is not None
+    assert report.rows_deleted == 5
+    assert report.bytes_reclaimed > 0
+
+    updates = await get_thread_updates(basehook, "test", "retention")
+    assert [u.status for u in updates] == [ThreadUpdateStatus.PENDING]
+
+    # SKIPPED row within retention_days but past skipped_content_retention_days
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            thread_update_table.insert().values(
+                webhook_name="test",
+                thread_id="retention",
+                revision_number=10.0,
+                content={"data": "skipped"},
+                timestamp=time.time() - 2 * 24 * 3600,
+                status=ThreadUpdateStatus.SKIPPED,
+            )
+        )
+
+    report = await basehook.run_retention()
+    assert report is not None
+    assert report.rows_stripped == 1
+
+    updates = await get_thread_updates(basehook, "test", "retention")
+    skipped = next(u for u in updates if u.status == ThreadUpdateStatus.SKIPPED)
+    assert skipped.content is None
+
+
+@pytest.mark.asyncio
+async def test_partitioned_thread_update(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test time-based partitioning:
+    - Recreate thread_update as a partitioned table
+    - Push and pop an update
+    - Make sure rows of the default partition are moved to new partitions
+    - Make sure expired partitions are dropped, unless they hold unprocessed updates
+    """
+    async with test_engine.begin() as conn:
+        await conn.run_sync(thread_update_table.drop)
+    await basehook.create_tables(metadata, partition_interval=3600)
+
+    response = await client.post(
+        "/webhooks/test",
+        json={"thread_id": "partitioned", "revision": 1.0, "data": "partitioned"},
+    )
+    assert response.status_code == 200
+
+    async with basehook.pop("test") as update:
+        assert update is not None
+        assert update["thread_id"] == "partitioned"
+
+    updates = await get_thread_updates(basehook, "test", "partitioned")
+    assert updates[0].status == ThreadUpdateStatus.SUCCESS
+
+    async with basehook.engine.begin() as conn:
+        assert await is_partitioned(conn)
+        assert len(await list_partitions(conn)) == 3
+
+    # an update beyond the created partitions lands in the default one, and is moved to its
+    # partition once created
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            thread_update_table.insert().values(
+                webhook_name="test",
+                thread_id="future",
+                revision_number=1.0,
+                content={},
+                timestamp=time.time() + 4 * 3600,
+                status=ThreadUpdateStatus.PENDING,
+            )
+        )
+    created, dropped = await basehook.maintain_partitions(3600, ahead=5)
+    assert len(created) == 3
+    assert dropped == []
+    async with test_engine.begin() as conn:
+        assert await conn.scalar(text("SELECT count(*) FROM thread_update_default")) == 0
+    updates = await get_thread_updates(basehook, "test", "future")
+    assert updates[0].status == ThreadUpdateStatus.PENDING
+
+    # every partition ends within the next 6 hours, the one holding a pending update is kept
+    created, dropped = await basehook.maintain_partitions(3600, retention_in_seconds=-6 * 3600)
+    assert created == []
+    assert len(dropped) == 5
+
+
+@pytest.mark.asyncio
+async def test_archive_and_replay(client: AsyncClient, tmp_path: Any, monkeypatch: Any) -> None:
+    """
+    Test cold archive:
+    - Push and process updates, then archive them
+    - Make sure they left the table and can be read back by thread, or page by page
+    - Replay one of them as PENDING, and make sure it is popped again
+    """
+    basehook = Basehook(archive_dir=str(tmp_path))
+    for thread_id in ["archive-1", "archive-2"]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": thread_id, "revision": 1.0, "data": thread_id},
+        )
+        assert response.status_code == 200
+        async with basehook.pop("test") as update:
+            assert update is not None
+
+    report = await basehook.archive(older_than_in_seconds=0)
+    assert report is not None
+    assert report.rows_archived == 2
+    assert report.segments_written == 1
+    assert await get_thread_updates(basehook, "test", "archive-1") == []
+
+    archived = [row async for row in basehook.read_archive(thread_id="archive-2")]
+    assert len(archived) == 1
+    assert archived[0]["content"]["data"] == "archive-2"
+    assert archived[0]["status"] == "success"
+
+    monkeypatch.setattr(api.basehook, "archive_dir", str(tmp_path))
+    response = await client.post(
+        "/api/query", json={"archived": True, "filters": [{"id": "thread_id", "value": "a"}]}
+    )
+    assert response.status_code == 400
+    response = await client.post("/api/query", json={"archived": True, "per_page": 1})
+    assert response.status_code == 200
+    assert response.json()["has_more"] is True
+    response = await client.post("/api/query", json={"archived": True, "per_page": 1, "page": 2})
+    assert [u["thread_id"] for u in response.json()["updates"]] == ["archive-1"]
+    assert response.json()["total"] == 2
+
+    assert await basehook.replay_archived([archived[0]["id"]]) == 1
+    updates = await get_thread_updates(basehook, "test", "archive-2")
+    assert [u.status for u in updates] == [ThreadUpdateStatus.PENDING]
+
+    # the thread was processed up to this revision already, the replay is still delivered
+    async with basehook.pop("test") as update:
+        assert update is not None
+        assert update["data"] == "archive-2"
+    await basehook.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_archive_query_pages(client: AsyncClient, tmp_path: Any, monkeypatch: Any) -> None:
+    """
+    Test paging through archived history from the API:
+    - Archive three updates, one segment each (segments are cut at max_segment_bytes)
+    - Make sure each page of /api/query returns the next one, newest first
+    """
+    basehook = Basehook(archive_dir=str(tmp_path))
+    thread_ids = ["archive-page-1", "archive-page-2", "archive-page-3"]
+    for thread_id in thread_ids:
+        response = await client.post(
+            "/webhooks/test-archive-pages",
+            json={"thread_id": thread_id, "revision": 1.0, "data": thread_id},
+        )
+        assert response.status_code == 200
+        async with basehook.pop("test-archive-pages") as update:
+            assert update is not None
+
+    report = await basehook.archive(older_than_in_seconds=0, max_segment_bytes=1)
+    assert report is not None
+    assert report.rows_archived == 3
+    assert report.segments_written == 3
+
+    monkeypatch.setattr(api.basehook, "archive_dir", str(tmp_path))
+    filters = [{"id": "webhook_name", "value": "test-archive-pages", "operator": "eq"}]
+    for page, thread_id in enumerate(reversed(thread_ids), start=1):
+        response = await client.post(
+            "/api/query",
+            json={"archived": True, "filters": filters, "per_page": 1, "page": page},
+        )
+        assert response.status_code == 200
+        assert [u["thread_id"] for u in response.json()["updates"]] == [thread_id]
+        assert response.json()["has_more"] is (page < 3)
+    await basehook.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_query_keyset_pagination(client: AsyncClient) -> None:
+    """
+    Test keyset pagination:
+    - Push 5 updates
+    - Walk through pages of 2 with next_cursor
+    - Make sure every update is returned once, in order
+    """
+    for rev in range(5):
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": f"page-{rev}", "revision": float(rev), "data": "page"},
+        )
+        assert response.status_code == 200
+
+    body: dict[str, Any] = {"per_page": 2, "count": "exact"}
+    response = await client.post("/api/query", json=body)
+    data = response.json()
+    assert data["total"] == 5
+    assert data["total_pages"] == 3
+
+    thread_ids = [u["thread_id"] for u in data["updates"]]
+    while data["next_cursor"]:
+        body = {"per_page": 2, "count": "none", "cursor": data["next_cursor"]}
+        data = (await client.post("/api/query", json=body)).json()
+        assert data["total"] is None
+        thread_ids += [u["thread_id"] for u in data["updates"]]
+
+    assert thread_ids == [f"page-{rev}" for rev in reversed(range(5))]
+
+    # a cursor only makes sense for the sort it was issued for
+    body = {"per_page": 2, "cursor": data.get("next_cursor") or "bm90LWEtY3Vyc29y"}
+    response = await client.post("/api/query", json=body)
+    assert response.status_code == 400
+
+    # well-formed base64 holding unexpected JSON is a client error too
+    sort = [["timestamp", True], ["id", True]]
+    for payload in [[1, 2], {"sort": sort}, {"sort": sort, "values": ["now", 1]}]:
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        response = await client.post("/api/query", json={"per_page": 2, "cursor": cursor})
+        assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "filters,indexes",
+    [
+        (
+            [{"id": "thread_id", "value": "thread-1234", "operator": "eq"}],
+            ["ix_thread_update_thread_id_pattern"],
+        ),
+        (
+            [{"id": "thread_id", "value": "ad-123", "operator": "iLike"}],
+            ["ix_thread_update_thread_id_trgm"],
+        ),
+        (
+            [{"id": "thread_id", "value": "thread-12", "operator": "startsWith"}],
+            ["ix_thread_update_thread_id_pattern"],
+        ),
+        (
+            [{"id": "thread_id", "value": ["thread-1", "thread-2"], "operator": "inArray"}],
+            ["ix_thread_update_thread_id_pattern"],
+        ),
+        # thread_id is NOT NULL, recent planners drop the scan altogether
+        (
+            [{"id": "thread_id", "value": "x", "operator": "isEmpty"}],
+            ["ix_thread_update_thread_id_pattern", "One-Time Filter: false"],
+        ),
+        (
+            [{"id": "webhook_name", "value": "hook-7", "operator": "eq"}],
+            ["ix_thread_update_webhook_name_timestamp"],
+        ),
+        (
+            [{"id": "webhook_name", "value": "ook-7", "operator": "iLike"}],
+            ["ix_thread_update_webhook_name_trgm"],
+        ),
+        (
+            [{"id": "traceback", "value": "ValueError", "operator": "iLike"}],
+            ["ix_thread_update_traceback_trgm"],
+        ),
+        (
+            [{"id": "status", "value": ["ERROR"], "operator": "inArray"}],
+            ["ix_thread_update_status_timestamp"],
+        ),
+        (
+            [{"id": "status", "value": "ERROR", "operator": "eq"}],
+            ["ix_thread_update_status_timestamp"],
+        ),
+        (
+            [{"id": "status", "value": "SUCCESS", "operator": "ne"}],
+            ["ix_thread_update_status_timestamp"],
+        ),
+        (
+            [{"id": "status", "value": "succ", "operator": "notILike"}],
+            ["ix_thread_update_status_timestamp"],
+        ),
+        (
+            [{"id": "timestamp", "value": "19000", "operator": "gte"}],
+            ["ix_thread_update_timestamp"],
+        ),
+        # negated text filters narrow down the rows of the time range
+        (
+            [
+                {"id": "timestamp", "value": "19000", "operator": "gte"},
+                {"id": "thread_id", "value": "thread-19500", "operator": "ne"},
+            ],
+            ["ix_thread_update_timestamp"],
+        ),
+        (
+            [
+                {"id": "timestamp", "value": "19000", "operator": "gte"},
+                {"id": "thread_id", "value": "thread-195", "operator": "notILike"},
+            ],
+            ["ix_thread_update_timestamp"],
+        ),
+        ([{"id": "id", "value": "42", "operator": "eq"}], ["thread_update_pkey"]),
+        (
+            [{"id": "content", "path": ["customer", "id"], "value": "cus_1", "operator": "eq"}],
+            ["ix_thread_update_content"],
+        ),
+        (
+            [
+                {
+                    "id": "content",
+                    "path": ["customer"],
+                    "value": {"id": "cus_1"},
+                    "operator": "contains",
+                }
+            ],
+            ["ix_thread_update_content"],
+        ),
+        (
+            [{"id": "content", "path": "customer.id", "operator": "exists"}],
+            ["ix_thread_update_content"],
+        ),
+    ],
+)
+async def test_filters_use_indexes(
+    test_engine: AsyncEngine, filters: list, indexes: list[str]
+) -> None:
+    """
+    Test that every filter the UI can produce is served by the index meant for it on a large
+    table. Sequential scans are disabled, and the plan must name one of the expected indexes
+    (a full scan of another index with a Filter would not).
+    """
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            text(
+                "INSERT INTO thread_update "
+                "(webhook_name, thread_id, revision_number, content, timestamp, status, "
+                "traceback) "
+                "SELECT 'hook-' || (i % 50), 'thread-' || i, i, '{}'::jsonb, i, "
+                "CASE WHEN i % 1000 = 0 THEN 'ERROR' ELSE 'SUCCESS' END::threadupdatestatus, "
+                "CASE WHEN i % 1000 = 0 THEN 'ValueError: ' || i END "
+                "FROM generate_series(1, 20000) AS i"
+            )
+        )
+        await conn.execute(text("ANALYZE thread_update"))
+        await conn.execute(text("SET LOCAL enable_seqscan = off"))
+
+        query = apply_filters_to_query(select(thread_update_table), filters)
+        compiled = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        plan = "\n".join(
+            row[0] for row in (await conn.exec_driver_sql(f"EXPLAIN {compiled}")).all()
+        )
+
+    assert "Seq Scan" not in plan, plan
+    assert any(re.search(rf"{re.escape(index)}\b", plan) for index in indexes), plan
+
+
+@pytest.mark.asyncio
+async def test_query_content_filters(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test content search:
+    - Push updates for two customers, and one without
+    - Filter on a content path, before and after promoting it to a B-tree index
+    - Filter on a JSON null
+    """
+    for i, customer in enumerate(["cus_1", "cus_2", "cus_1", None]):
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": f"content-{i}", "revision": 1.0, "customer": {"id": customer}},
+        )
+        assert response.status_code == 200
+
+    body = {
+        "count": "exact",
+        "filters": [
+            {"id": "webhook_name", "value": "test", "operator": "eq"},
+            {"id": "content", "path": ["customer", "id"], "value": "cus_1", "operator": "eq"},
+        ],
+    }
+    data = (await client.post("/api/query", json=body)).json()
+    assert sorted(u["thread_id"] for u in data["updates"]) == ["content-0", "content-2"]
+
+    response = await client.post(
+        "/api/webhooks/test/content-indexes", json={"path": ["customer", "id"]}
+    )
+    assert response.status_code == 200
+    index_name = response.json()["index_name"]
+
+    data = (await client.post("/api/query", json=body)).json()
+    assert data["total"] == 2
+
+    indexes = (await client.get("/api/webhooks/test/content-indexes")).json()["indexes"]
+    assert [index["index_name"] for index in indexes] == [index_name]
+    assert await basehook.drop_content_index(index_name)
+
+    body["filters"][1]["value"] = None
+    data = (await client.post("/api/query", json=body)).json()
+    assert [u["thread_id"] for u in data["updates"]] == ["content-3"]
+
+    # Paths and webhook names are literals in the DDL, not bind parameters
+    response = await client.post(
+        "/api/webhooks/test/content-indexes", json={"path": ["customer", ":id", "it's"]}
+    )
+    assert response.status_code == 200
+    assert await basehook.drop_content_index(response.json()["index_name"])
+
+
+@pytest.mark.asyncio
+async def test_query_projection(client: AsyncClient) -> None:
+    """
+    Test projection:
+    - Query with a projection and a content preview
+    - Make sure only the requested fields are returned
+    - Fetch the full content on demand
+    - Make sure an invalid preview length is rejected
+    """
+    response = await client.post(
+        "/webhooks/test",
+        json={"thread_id": "projection", "revision": 1.0, "data": "x" * 1000},
+    )
+    assert response.status_code == 200
+
+    body = {"fields": ["thread_id", "status", "content_preview"], "preview_length": 20}
+    data = (await client.post("/api/query", json=body)).json()
+    update = data["updates"][0]
+    assert set(update) == {"id", "thread_id", "status", "content_preview"}
+    assert len(update["content_preview"]) == 20
+
+    response = await client.get(f"/api/updates/{update['id']}")
+    assert response.status_code == 200
+    assert response.json()["content"]["data"] == "x" * 1000
+
+    for preview_length in ["long", -1]:
+        body["preview_length"] = preview_length
+        response = await client.post("/api/query", json=body)
+        assert response.status_code == 400
+
+    response = await client.get("/api/updates/0")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_metrics_rollup(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test the metrics rollup:
+    - Push updates and pop one of them
+    - Make sure the metrics are right before and after folding the deltas, and after a rebuild
+    - Make sure the per-webhook breakdown is returned
+    """
+    for thread_id in ["metrics-1", "metrics-2"]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": thread_id, "revision": 1.0, "data": "metrics"},
+        )
+        assert response.status_code == 200
+
+    async with basehook.pop("test") as update:
+        assert update is not None
+
+    for step in ["deltas", "fold", "rebuild"]:
+        if step == "fold":
+            await basehook.fold_metrics()
+        elif step == "rebuild":
+            await basehook.rebuild_metrics(batch_seconds=60)
+        data = (await client.get("/api/metrics", params={"range": "1h"})).json()["data"]
+        assert data[-1]["pending"] == 1
+        assert data[-1]["success"] == 1
+
+    data = (await client.get("/api/metrics", params={"range": "1h", "breakdown": True})).json()
+    assert data["series"]["test"][-1]["pending"] == 1
+
+    data = (await client.get("/api/metrics", params={"range": "1h", "webhook": "other"})).json()
+    assert data["data"] == []
+
+
+@pytest.mark.asyncio
+async def test_response_cache() -> None:
+    """
+    Test the response cache:
+    - Concurrent misses share one computation
+    - Expired entries are refreshed from their previous value
+    - Least recently used entries are evicted
+    """
+    calls = []
+
+    async def compute(previous: Any) -> int:
+        calls.append(previous)
+        await asyncio.sleep(0.01)
+        return (previous or 0) + 1
+
+    cache = AsyncTTLCache(ttl_in_seconds=0.05, max_entries=2)
+    assert await asyncio.gather(*(cache.get("a", compute) for _ in range(10))) == [1] * 10
+    assert calls == [None]
+
+    await asyncio.sleep(0.1)
+    assert await cache.get("a", compute) == 2
+    assert calls == [None, 1]
+
+    await cache.get("b", compute)
+    await cache.get("c", compute)
+    assert len(cache) == 2
+    assert await cache.get("a", compute) == 1
+
+
+@pytest.mark.asyncio
+async def test_openmetrics(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test the OpenMetrics endpoint:
+    - Push two revisions of a thread and pop it
+    - Make sure latencies, skipped updates and pending depth are exposed
+    """
+    for revision in [1.0, 2.0]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": "openmetrics", "revision": revision, "data": "metrics"},
+        )
+        assert response.status_code == 200
+    async with basehook.pop("test") as update:
+        assert update["revision"] == 2.0
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/openmetrics-text")
+    lines = response.text.splitlines()
+    assert lines[-1] == "# EOF"
+    # Histograms and counters are process wide, other tests add to them
+    for prefix in [
+        'basehook_ingest_phase_seconds_count{webhook="test",phase="insert"}',
+        'basehook_pop_claim_seconds_count{webhook="test"}',
+        'basehook_pop_handler_seconds_count{webhook="test",status="success"}',
+        'basehook_updates_skipped_total{webhook="test"}',
+    ]:
+        assert any(line.startswith(prefix) for line in lines)
+    assert 'basehook_pending_updates{webhook="test"} 0' in lines
+
+
+class RecordingInstrumentation(Instrumentation):
+    def __init__(self) -> None:
+        self.events: list[str] = []
+        self.finished: list[PopTrace] = []
+
+    def pop_event(self, trace: PopTrace, name: str, attributes: dict[str, Any]) -> None:
+        self.events.append(name)
+
+    def pop_finished(self, trace: PopTrace) -> None:
+        self.finished.append(trace)
+
+    def ingest_event(self, trace: IngestTrace, name: str, attributes: dict[str, Any]) -> None:
+        self.events.append(name)
+
+    def ingest_finished(self, trace: IngestTrace) -> None:
+        self.finished.append(trace)
+
+
+@pytest.mark.asyncio
+async def test_pop_instrumentation(client: AsyncClient) -> None:
+    """
+    Test pop instrumentation:
+    - Push two revisions of a thread and pop it with an instrumentation
+    - Make sure the events and the pop summary are reported
+    - Make sure an empty pop is reported as such
+    """
+    for revision in [1.0, 2.0]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": "traced", "revision": revision, "data": "trace"},
+        )
+        assert response.status_code == 200
+
+    instrumentation = RecordingInstrumentation()
+    basehook = Basehook(instrumentation=instrumentation)
+    async with basehook.pop("test") as update:
+        assert update["revision"] == 2.0
+    async with basehook.pop("test") as update:
+        assert update is None
+    await basehook.engine.dispose()
+
+    assert instrumentation.events == [
+        "claim_attempt",
+        "rows_skipped",
+        "claimed",
+        "committed",
+        "empty",
+    ]
+    trace, empty_trace = instrumentation.finished
+    assert trace.outcome == "success"
+    assert trace.thread_id == "traced"
+    assert trace.rows_skipped == 1
+    assert trace.handler_seconds is not None
+    # At least BEGIN, claim, status update and COMMIT, the rest depends on the claim path
+    assert trace.round_trips >= 4
+    assert empty_trace.outcome == "empty"
+    assert empty_trace.round_trips >= 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_instrumentation(client: AsyncClient, monkeypatch: Any) -> None:
+    """
+    Test ingest instrumentation:
+    - Push an update with an instrumentation on the API's Basehook
+    - Make sure the insert, commit and handoff are reported with the ingest summary
+    - Make sure an unknown webhook is reported as an error
+    """
+    instrumentation = RecordingInstrumentation()
+    monkeypatch.setattr(api.basehook, "instrumentation", instrumentation)
+    install_round_trip_counter(api.basehook.engine)
+
+    response = await client.post(
+        "/webhooks/test", json={"thread_id": "traced-ingest", "revision": 1.0}
+    )
+    assert response.status_code == 200
+    response = await client.post("/webhooks/unknown", json={"thread_id": "traced-ingest"})
+    assert response.status_code == 404
+
+    assert instrumentation.events == ["inserted", "committed", "handoff"]
+    trace, error_trace = instrumentation.finished
+    assert trace.outcome == "inserted"
+    assert trace.thread_id == "traced-ingest"
+    assert trace.update_id is not None
+    assert trace.handed_off is False
+    # At least BEGIN, webhook lookup, update and thread inserts, and COMMIT
+    assert trace.round_trips >= 5
+    assert error_trace.outcome == "error"
+
+
+@pytest.mark.asyncio
+async def test_export(client: AsyncClient) -> None:
+    """
+    Test streaming export:
+    - Push a few updates
+    - Export them as NDJSON, then resume after the first id
+    - Export them as CSV
+    """
+    for i in range(3):
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": f"export-{i}", "revision": 1.0, "data": "export"},
+        )
+        assert response.status_code == 200
+
+    body = {
+        "fields": ["thread_id", "content"],
+        "filters": [{"id": "webhook_name", "value": "test"}],
+    }
+    response = await client.post("/api/export", json=body)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["thread_id"] for row in rows] == ["export-0", "export-1", "export-2"]
+    assert rows[0]["content"]["data"] == "export"
+
+    response = await client.post("/api/export", json={**body, "after_id": rows[0]["id"]})
+    assert [json.loads(line)["thread_id"] for line in response.text.splitlines()] == [
+        "export-1",
+        "export-2",
+    ]
+
+    response = await client.post("/api/export", json={**body, "format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "thread_id", "content"]
+    assert json.loads(rows[1][2])["data"] == "export"
+
+    response = await client.post("/api/export", json={**body, "format": "xml"})
+    assert response.status_code == 400
+
+
+async def wait_for_job(client: AsyncClient, job_id: str) -> dict[str, Any]:
+    for _ in range(100):
+        job = (await client.get(f"/api/jobs/{job_id}")).json()
+        if job["status"] != "running":
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+@pytest.mark.asyncio
+async def test_update_status_job(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test bulk status updates:
+    - Push a few updates
+    - Skip them with filters, in chunks of one row, and wait for the job
+    - Re-queue them at one row per second and cancel the job
+    - Make sure invalid chunk sizes and rates are rejected
+    """
+    for i in range(3):
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": f"bulk-{i}", "revision": 1.0, "data": "bulk"},
+        )
+        assert response.status_code == 200
+
+    filters = [{"id": "thread_id", "value": "bulk-", "operator": "startsWith"}]
+    response = await client.post(
+        "/api/update-status", json={"filters": filters, "status": "SKIPPED", "chunk_size": 1}
+    )
+    job = await wait_for_job(client, response.json()["id"])
+    assert job["status"] == "completed"
+    assert job["total"] == job["updated"] == 3
+    for i in range(3):
+        updates = await get_thread_updates(basehook, "test", f"bulk-{i}")
+        assert updates[0].status == ThreadUpdateStatus.SKIPPED
+
+    response = await client.post(
+        "/api/update-status", json={"filters": filters, "status": "PENDING", "rate": 1}
+    )
+    job_id = response.json()["id"]
+    await asyncio.sleep(0.2)
+    await client.post(f"/api/jobs/{job_id}/cancel")
+    job = await wait_for_job(client, job_id)
+    assert job["status"] == "cancelled"
+    assert job["updated"] == 1
+
+    for params in [
+        {"chunk_size": "many"},
+        {"chunk_size": 0},
+        {"chunk_size": 10**9},
+        {"rate": "fast"},
+        {"rate": 0},
+        {"rate": -1},
+    ]:
+        response = await client.post(
+            "/api/update-status", json={"filters": filters, "status": "SKIPPED", **params}
+        )
+        assert response.status_code == 400, params
+
+
+@pytest.mark.asyncio
+async def test_update_stream(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test the live update stream:
+    - Enable the update notifications and subscribe to the updates of a webhook
+    - Push an update and pop it, make sure both changes are received
+    - Make sure a subscriber that does not keep up is dropped
+    - Make sure the endpoint is unavailable when the notifications are not enabled
+    """
+    await basehook.set_update_notifications(True)
+    broadcaster = UpdateBroadcaster(test_engine)
+    subscription = await broadcaster.subscribe(webhook_name="test")
+    slow_subscription = await broadcaster.subscribe(max_buffered=1)
+
+    response = await client.post(
+        "/webhooks/test", json={"thread_id": "streamed", "revision": 1.0, "data": "stream"}
+    )
+    assert response.status_code == 200
+    async with basehook.pop("test") as update:
+        assert update is not None
+
+    update = await asyncio.wait_for(subscription.queue.get(), 5)
+    assert (update["thread_id"], update["status"], update["operation"]) == (
+        "streamed",
+        "PENDING",
+        "insert",
+    )
+    update = await asyncio.wait_for(subscription.queue.get(), 5)
+    assert (update["status"], update["operation"]) == ("SUCCESS", "update")
+
+    assert slow_subscription.dropped
+    assert len(broadcaster) == 1
+    await broadcaster.close()
+
+    await basehook.set_update_notifications(False)
+    response = await client.get("/api/stream")
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_queues(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test queue stats:
+    - Push two updates and pop one
+    - Make sure depth, lag and rates are reported, before and after folding the deltas
+    - Make sure the depth count stops at the limit
+    """
+    for thread_id in ["queue-1", "queue-2"]:
+        response = await client.post(
+            "/webhooks/test",
+            json={"thread_id": thread_id, "revision": 1.0, "data": "queue"},
+        )
+        assert response.status_code == 200
+    async with basehook.pop("test") as update:
+        assert update is not None
+
+    for fold in [False, True]:
+        if fold:
+            await basehook.fold_metrics()
+        response = await client.get("/api/queues", params={"rate_window": 60})
+        (queue,) = response.json()["queues"]
+        assert queue["webhook_name"] == "test"
+        assert queue["depth"] == 1
+        assert not queue["depth_capped"]
+        assert queue["oldest_pending_age"] >= 0
+        assert queue["ingest_rate"] > queue["drain_rate"] > 0
+
+    response = await client.post(
+        "/webhooks/test", json={"thread_id": "queue-3", "revision": 1.0, "data": "queue"}
+    )
+    assert response.status_code == 200
+    async with basehook.engine.begin() as conn:
+        (queue,) = await get_queue_stats(conn, depth_limit=1)
+    assert (queue.depth, queue.depth_capped) == (1, True)
+
+
+@pytest.mark.asyncio
+async def test_read_engine_routing(test_engine: AsyncEngine) -> None:
+    """
+    Test read replica routing:
+    - Without a replica, reads go to the primary
+    - A replica that is fresh enough is used (here the primary itself, which has no lag)
+    - A replica lagging more than the bound falls back to the primary
+    - Concurrent requests share one lag measurement, a slow one counts as unavailable
+    """
+    url = test_engine.url.render_as_string(hide_password=False)
+    basehook = Basehook(database_url=url)
+    assert await basehook.get_read_engine() is basehook.engine
+    await basehook.engine.dispose()
+
+    basehook = Basehook(database_url=url, read_database_url=url)
+    assert await basehook.get_read_engine(5) is basehook.read_engine
+    assert await basehook.get_read_engine(-1) is basehook.engine
+
+    # The lag is measured at most every second
+    basehook._replica_lag = (30.0, time.monotonic())
+    assert await basehook.get_read_engine(5) is basehook.engine
+    assert await basehook.get_read_engine(60) is basehook.read_engine
+
+    measurements = []
+
+    async def measure_slowly() -> float:
+        measurements.append(time.monotonic())
+        await asyncio.sleep(1)
+        return 0.0
+
+    basehook._measure_replica_lag = measure_slowly
+    basehook._replica_lag = None
+    engines = await asyncio.gather(
+        *(basehook.get_read_engine(5, lag_probe_timeout_in_seconds=0.1) for _ in range(10))
+    )
+    assert engines == [basehook.engine] * 10
+    assert len(measurements) == 1
+
+    await basehook.engine.dispose()
+    await basehook.read_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_delivery_dedup(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test delivery deduplication:
+    - Configure a webhook deduplicating on a header
+    - Redeliver the same event, answered from memory then from the delivery table
+    - Make sure a single update is stored, and that pruned keys are ingested again
+    """
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.insert().values(
+                name="dedup",
+                thread_id_path=["thread_id"],
+                revision_number_path=["revision"],
+                dedup_header="X-Delivery-Id",
+            )
+        )
+
+    async def deliver(delivery_id: str) -> str:
+        response = await client.post(
+            "/webhooks/dedup",
+            json={"thread_id": "dedup", "revision": 1.0},
+            headers={"X-Delivery-Id": delivery_id},
+        )
+        assert response.status_code == 200
+        return response.json()["message"]
+
+    async def count_updates() -> int:
+        async with test_engine.begin() as conn:
+            return await conn.scalar(
+                select(func.count()).where(thread_update_table.c.webhook_name == "dedup")
+            )
+
+    assert await deliver("delivery-1") == "Thread created"
+    assert await deliver("delivery-1") == "Duplicate delivery"
+    # Another process has not seen it, the unique key rejects it
+    recent_deliveries.clear()
+    assert await deliver("delivery-1") == "Duplicate delivery"
+    assert await deliver("delivery-2") == "Thread created"
+    assert await count_updates() == 2
+
+    assert await basehook.prune_deliveries(older_than_in_seconds=-1) == 2
+    recent_deliveries.clear()
+    assert await deliver("delivery-1") == "Thread created"
+    assert await count_updates() == 3
+
+
+@pytest.mark.asyncio
+async def test_large_payloads(
+    client: AsyncClient, basehook: Basehook, test_engine: AsyncEngine
+) -> None:
+    """
+    Test body size limits and out-of-line payloads:
+    - A body above the webhook limit is rejected with a 413
+    - A body above the offload threshold only keeps its extracted fields inline
+    - The full payload is popped, exported and served, and pruned once its update is deleted
+    - A body sending the reference key itself is not taken for a reference
+    """
+    async with test_engine.begin() as conn:
+        await conn.execute(
+            webhook_table.update().where(webhook_table.c.name == "test").values(max_body_bytes=4096)
+        )
+    response = await client.post(
+        "/webhooks/test", json={"thread_id": "large", "revision": 1.0, "data": "x" * 5000}
+    )
+    assert response.status_code == 413
+
+    payload = {"thread_id": "large", "revision": 1.0, "data": "x" * 2000}
+    offload_bytes = api.payload_offload_bytes
+    api.payload_offload_bytes = 1024
+    try:
+        response = await client.post("/webhooks/test", json=payload)
+        assert response.status_code == 200
+    finally:
+        api.payload_offload_bytes = offload_bytes
+
+    async with test_engine.begin() as conn:
+        (update_id, content) = (
+            await conn.execute(select(thread_update_table.c.id, thread_update_table.c.content))
+        ).one()
+    assert "data" not in content
+    assert content[PAYLOAD_KEY]["size"] > 2000
+
+    response = await client.get(f"/api/updates/{update_id}")
+    assert response.json()["content"] == payload
+    response = await client.post("/api/export", json={"fields": ["content"]})
+    assert json.loads(response.text) == {"id": update_id, "content": payload}
+
+    async with basehook.pop("test", only_last_revision=False) as update:
+        assert update == payload
+
+    assert await basehook.prune_payloads() == 0
+    async with test_engine.begin() as conn:
+        await conn.execute(thread_update_table.delete())
+    assert await basehook.prune_payloads() == 1
+
+    for reference in [1, {"id": "spoofed"}]:
+        spoofed = {"thread_id": "spoofed", "revision": 1.0, PAYLOAD_KEY: reference}
+        response = await client.post("/webhooks/test", json=spoofed)
+        assert response.status_code == 200
+        async with test_engine.begin() as conn:
+            update_id = await conn.scalar(select(func.max(thread_update_table.c.id)))
+        response = await client.get(f"/api/updates/{update_id}")
+        assert response.status_code == 200
+        assert response.json()["content"] == spoofed
+        async with basehook.pop("test", only_last_revision=False) as update:
+            assert update == spoofed
+
+
+@pytest.mark.asyncio
+async def test_raw_pop(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test raw pops:
+    - Push an update, its body is stored as received
+    - Pop it with raw=True, the content is JSON text decoded on demand
+    """
+    payload = {"thread_id": "raw", "revision": 1.0, "amount": 12.5, "tags": ["a", "é"]}
+    response = await client.post("/webhooks/test", json=payload)
+    assert response.status_code == 200
+
+    async with basehook.pop("test", raw=True) as update:
+        assert isinstance(update, RawJSON)
+        assert json.loads(bytes(update)) == payload
+        assert update.json() == payload
+
+
+@pytest.mark.asyncio
+async def test_pop_fields(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test content projection:
+    - Push updates with a large unused field, one of them stored out of line
+    - Pop them with fields, only the requested paths are returned
+    """
+    payload = {
+        "thread_id": "fields",
+        "revision": 1.0,
+        "event": {"user": "U1", "ts": "1700000000.1", "items": [{"id": 1}]},
+        "blob": "x" * 2000,
+    }
+    response = await client.post("/webhooks/test", json=payload)
+    assert response.status_code == 200
+    offload_bytes = api.payload_offload_bytes
+    api.payload_offload_bytes = 1024
+    try:
+        response = await client.post(
+            "/webhooks/test", json={**payload, "thread_id": "fields-offloaded"}
+        )
+        assert response.status_code == 200
+    finally:
+        api.payload_offload_bytes = offload_bytes
+
+    fields = ["event.user", "event.items.0.id", "missing"]
+    for _ in range(2):
+        async with basehook.pop("test", fields=fields) as update:
+            assert update == {"event.user": "U1", "event.items.0.id": 1, "missing": None}
+
+    async with basehook.pop("test", fields=fields) as update:
+        assert update is None
+
+
+@pytest.mark.asyncio
+async def test_local_handoff(client: AsyncClient, basehook: Basehook) -> None:
+    """
+    Test the embedded handoff:
+    - A consumer waits on an empty queue
+    - An update ingested in the same process is handed to it, without waiting for a poll
+    - Without updates, the wait times out and None is yielded
+    """
+
+    async def consume() -> Any:
+        async with basehook.pop("test", wait_in_seconds=5) as update:
+            return update
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.1)
+    assert not consumer.done()
+
+    response = await client.post(
+        "/webhooks/test", json={"thread_id": "handoff", "revision": 1.0, "data": "now"}
+    )
+    assert response.status_code == 200
+    update = await asyncio.wait_for(consumer, 1)
+    assert update["data"] == "now"
+
+    updates = await get_thread_updates(basehook, "test", "handoff")
+    assert [u.status for u in updates] == [ThreadUpdateStatus.SUCCESS]
+
+    async with basehook.pop("test", wait_in_seconds=0.1) as update:
+        assert update is None
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite", "postgres"])
+async def storage_backend(request, tmp_path) -> AsyncGenerator[StorageBackend, None]:
+    """Every storage backend, for the conformance tests."""
+    if request.param == "memory":
+        backend = MemoryBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteBackend(str(tmp_path / "basehook.db"))
+    else:
+        request.getfixturevalue("test_engine")  # Creates and drops the tables
+        backend = PostgresBackend(Basehook())
+    await backend.setup()
+    yield backend
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_backend_last_revision(storage_backend: StorageBackend) -> None:
+    """
+    Backend conformance, latest revision mode:
+    - Higher priorities are claimed first
+    - Only the latest revision of a thread is yielded, older ones are skipped
+    - A claimed thread is not claimed twice, older revisions arriving later are skipped
+    """
+    for revision in [1, 3, 2]:
+        await storage_backend.ingest("test", "thread-1", revision, {"revision": revision})
+    await storage_backend.ingest("test", "urgent", 1, {"revision": "urgent"}, priority=5)
+
+    async with storage_backend.pop("test") as update:
+        assert update == {"revision": "urgent"}
+    async with storage_backend.pop("test") as update:
+        assert update == {"revision": 3}
+        async with storage_backend.pop("test") as concurrent_update:
+            assert concurrent_update is None
+
+    await storage_backend.ingest("test", "thread-1", 2.5, {"revision": 2.5})
+    async with storage_backend.pop("test") as update:
+        assert update is None
+
+    counts = await storage_backend.counts("test")
+    assert counts[ThreadUpdateStatus.SUCCESS] == 2
+    assert counts[ThreadUpdateStatus.SKIPPED] == 3
+    assert counts[ThreadUpdateStatus.PENDING] == 0
+
+
+@pytest.mark.asyncio
+async def test_backend_in_order(storage_backend: StorageBackend) -> None:
+    """
+    Backend conformance, in order mode:
+    - Revisions of a thread are yielded one by one, lowest first
+    - An exception in the pop block marks the update as ERROR with its traceback
+    - Queries return the newest updates first
+    """
+    for revision in [2, 1]:
+        await storage_backend.ingest("test", "thread-1", revision, {"revision": revision})
+
+    async with storage_backend.pop("test", only_last_revision=False) as update:
+        assert update == {"revision": 1}
+    with pytest.raises(RuntimeError):
+        async with storage_backend.pop("test", only_last_revision=False) as update:
+            assert update == {"revision": 2}
+            raise RuntimeError("handler failed")
+
+    (failed,) = await storage_backend.query(status=ThreadUpdateStatus.ERROR)
+    assert failed.thread_id == "thread-1"
+    assert "handler failed" in failed.traceback
+    updates = await storage_backend.query(webhook_name="test")
+    assert [u.revision_number for u in updates] == [1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_eviction() -> None:
+    """
+    Test the bounded history of the memory backend:
+    - Skip and process more updates than max_finished
+    - Make sure only the last finished ones are kept and counted, pending ones are kept
+    """
+    backend = MemoryBackend(max_finished=2)
+    for revision in [1, 2, 3]:
+        await backend.ingest("test", "thread-1", revision, {"revision": revision})
+    await backend.ingest("test", "thread-2", 1, {"revision": 1})
+    await backend.ingest("test", "thread-3", 1, {"revision": 1}, priority=-1)
+
+    for _ in range(2):
+        async with backend.pop("test") as update:
+            assert update is not None
+
+    counts = await backend.counts("test")
+    assert counts[ThreadUpdateStatus.SUCCESS] + counts[ThreadUpdateStatus.SKIPPED] == 2
+    assert counts[ThreadUpdateStatus.PENDING] == 1
+    assert await backend.counts() == counts
+    updates = await backend.query(webhook_name="test")
+    assert [(u.thread_id, u.status) for u in updates] == [
+        ("thread-3", ThreadUpdateStatus.PENDING),
+        ("thread-2", ThreadUpdateStatus.SUCCESS),
+        ("thread-1", ThreadUpdateStatus.SUCCESS),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_migrations(test_engine: AsyncEngine) -> None:
+    """
+    Test the startup migrations:
+    - Concurrent processes migrate once, the others find the schema up to date
+    - A schema from before a column or an index was added is brought up to date, the required
+      migrations first, the background ones (index builds, rollup rebuild) when asked for
+    """
+    results = await asyncio.gather(migrate(test_engine), migrate(test_engine))
+    assert sorted(results) == [[], [1, 2, 4, 3, 5, 6]]
+    assert await schema_version(test_engine) == LATEST_VERSION
+    assert await migrate(test_engine) == []
+
+    # Schema of a deployment created before dedup, prioritized claims and the query indexes
+    async with test_engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE webhook DROP COLUMN dedup_header"))
+        await conn.execute(text("DROP INDEX ix_thread_update_claim_pending"))
+        await conn.execute(text("DROP INDEX ix_thread_update_thread_id_pattern"))
+        await conn.execute(
+            text("CREATE INDEX ix_thread_update_thread_id ON thread_update (thread_id)")
+        )
+        await conn.execute(text("ALTER TABLE thread_update ALTER COLUMN content SET NOT NULL"))
+        await conn.execute(text("DELETE FROM basehook_schema_version WHERE version > 1"))
+
+    assert await migrate(test_engine, background=False) == [2, 4]
+    assert await migrate(test_engine, background=False) == []
+    assert await migrate(test_engine) == [3, 5, 6]
+    async with test_engine.begin() as conn:
+        columns = await conn.scalars(
+            text("SELECT column_name FROM information_schema.columns WHERE table_name = 'webhook'")
+        )
+        assert "dedup_header" in columns.all()
+        nullable = await conn.scalar(
+            text(
+                "SELECT is_nullable FROM information_schema.columns "
+                "WHERE table_name = 'thread_update' AND column_name = 'content'"
+            )
+        )
+        assert nullable == "YES"
+        for name, exists in [
+            ("ix_thread_update_claim_pending", True),
+            ("ix_thread_update_thread_id_pattern", True),
+            ("ix_thread_update_thread_id", False),
+        ]:
+            index = await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name})
+            assert (index is not None) == exists
+
+
+@pytest.mark.asyncio
+async def test_migration_lock_timeout(test_engine: AsyncEngine, monkeypatch: Any) -> None:
+    """
+    Test the DDL lock timeout of the migrations:
+    - Hold a lock on the webhook table, make sure adding columns gives up after the retries
+    - Release the lock while adding columns is retried, make sure it then goes through
+    """
+    await migrate(test_engine)
+    monkeypatch.setattr(migrations, "DDL_LOCK_TIMEOUT", "100ms")
+    monkeypatch.setattr(migrations, "DDL_LOCK_RETRY_DELAY", 0.1)
+    monkeypatch.setattr(migrations, "DDL_LOCK_ATTEMPTS", 2)
+
+    async with test_engine.connect() as conn:
+        await conn.execute(text("LOCK TABLE webhook IN ACCESS SHARE MODE"))
+        with pytest.raises(DBAPIError):
+            await migrations._add_columns(test_engine, None)
+
+        monkeypatch.setattr(migrations, "DDL_LOCK_ATTEMPTS", 20)
+        adding = asyncio.create_task(migrations._add_columns(test_engine, None))
+        await asyncio.sleep(0.3)
+        assert not adding.done()
+        await conn.rollback()
+    await asyncio.wait_for(adding, 5)